@@ -0,0 +1,222 @@
+# coding: utf-8
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+
+from appmetrica.base import DEFAULT_POOL_SIZE, BaseAPI
+from appmetrica.exceptions import AppMetricaDeadlineExceeded, AppMetricaRequestError
+from appmetrica.metrics import RequestEvent
+from appmetrica.retry import is_retryable_status
+from appmetrica.serializers import default_serializer
+from appmetrica.utils import truncate
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, request_timeout=30):
+    """
+    Create aiohttp session with a pool of kept-alive connections
+    The session can be shared by several async API instances (see `session` param of AsyncBaseAPI)
+    Must be called with running event loop
+
+    :param pool_size: max number of open connections
+    :param request_timeout: total timeout of request in seconds
+    :return: aiohttp.ClientSession
+    """
+    connector = aiohttp.TCPConnector(limit=pool_size)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=request_timeout))
+
+
+class AsyncBaseAPI(object):
+    """
+    Asyncio version of BaseAPI with the same retry policy, rate limiter, serializer and request hooks
+    """
+    base_url = None
+    request_timeout = 30
+    access_token = None
+    app_id = None
+
+    rate_limit_family = None
+    retry_policy = BaseAPI.retry_policy
+    serializer = staticmethod(default_serializer)
+    compress_threshold = None
+    payload_dump_dir = None
+    hooks = ()
+
+    def __init__(self, app_id, access_token, session=None, pool_size=DEFAULT_POOL_SIZE, rate_limiter=None,
+                 retry_policy=None, serializer=None, compress_threshold=None, payload_dump_dir=None, hooks=None,
+                 base_url=None):
+        """
+        :param app_id: application identifier
+        :param access_token: OAuth token
+        :param session (optional): shared session made by `create_session`.
+            Shared session is not closed by `close`, its owner is responsible for that
+        :param pool_size (optional): size of connection pool of own session
+        :param rate_limiter (optional): `appmetrica.ratelimit.RateLimiter`, can be shared with sync instances,
+            requests wait for it with `asyncio.sleep`
+        :param retry_policy (optional): `appmetrica.retry.RetryPolicy` of failed requests
+        :param serializer (optional): function which serializes request data to JSON bytes
+        :param compress_threshold (optional): compress request bodies larger than this number of bytes with gzip
+        :param payload_dump_dir (optional): write whole bodies of failed requests to files in this directory
+        :param hooks (optional): list of `appmetrica.metrics.RequestHooks`, they are called in the event loop
+        :param base_url (optional): URL of API to use instead of the default one, e.g. of a test server
+        """
+        self.app_id = app_id
+        self.access_token = access_token
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        if serializer is not None:
+            self.serializer = serializer
+        if compress_threshold is not None:
+            self.compress_threshold = compress_threshold
+        if payload_dump_dir is not None:
+            self.payload_dump_dir = payload_dump_dir
+        if hooks is not None:
+            self.hooks = list(hooks)
+        if base_url is not None:
+            self.base_url = base_url
+        self._session = session
+        self._owns_session = session is None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = create_session(self.pool_size, self.request_timeout)
+        return self._session
+
+    async def close(self):
+        """
+        Close own session and release its connections
+        """
+        if self._owns_session and self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _request(self, method, endpoint, params=None, headers=None, json=None, idempotent=None):
+        """
+        :param idempotent: whether the request can be repeated after it is received by server, True for GET by default
+        """
+        params = self._query_params(params or {})
+        headers = headers or {}
+        headers.setdefault('Content-Type', 'application/json')
+        headers.setdefault('Authorization',
+                           'OAuth {access_token}'.format(access_token=self.access_token))
+
+        url = '{base_url}/{endpoint}'.format(base_url=self.base_url.rstrip('/'), endpoint=endpoint)
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
+
+        raw_body = self._serialize_body(method, url, headers, params, json) if json is not None else None
+        body = self._compress_body(raw_body, headers) if raw_body is not None else None
+
+        event = RequestEvent(method, endpoint, bytes_sent=len(body) if body is not None else 0)
+        self._call_hooks('on_request_start', event)
+        try:
+            try:
+                response, content = await self._send(method, url, endpoint, idempotent, event, params=params,
+                                                     data=body, headers=headers)
+            except Exception as exc:
+                event.error = exc.__class__.__name__
+                self._log_failure(method, url, headers, params, json, raw_body, exc, exc_info=True)
+                raise AppMetricaRequestError
+
+            event.status_code = response.status
+            event.bytes_received = len(content)
+            if not (200 <= response.status < 300):
+                self._log_failure(method, url, headers, params, json, raw_body, truncate(content))
+                raise AppMetricaRequestError(status_code=response.status)
+
+            parse_started = time.time()
+            data = self._data_from_response(response, content)
+            event.parse_time = time.time() - parse_started
+            return data
+        except Exception as exc:
+            event.error = event.error or exc.__class__.__name__
+            raise
+        finally:
+            event.finish()
+            self._call_hooks('on_request_end', event)
+
+    async def _send(self, method, url, endpoint, idempotent, event, **kwargs):
+        """
+        See `BaseAPI._send`, wait_time of event includes reading of response body
+        :return: tuple (response, content)
+        """
+        deadline_time = self.retry_policy.deadline_time()
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                remaining = deadline_time - time.time() if deadline_time is not None else None
+                delay = self.rate_limiter.reserve(self._rate_limit_family(endpoint), max_wait=remaining)
+                if delay is None:
+                    raise AppMetricaDeadlineExceeded('rate limit does not allow request before deadline')
+                await asyncio.sleep(delay)
+            timeout = self.request_timeout
+            if deadline_time is not None:
+                timeout = max(min(timeout, deadline_time - time.time()), 0.001)
+
+            response, content, error = None, None, None
+            sent_at = time.time()
+            try:
+                async with self.session.request(method, url, timeout=aiohttp.ClientTimeout(total=timeout),
+                                                **kwargs) as response:
+                    content = await response.read()
+                event.wait_time = time.time() - sent_at
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                error = exc
+
+            if error is not None:
+                retryable = isinstance(error, aiohttp.ClientConnectorError) or idempotent
+                delay = self.retry_policy.delay(attempt, retryable, deadline_time=deadline_time)
+            else:
+                retryable = is_retryable_status(response.status, idempotent)
+                delay = self.retry_policy.delay(attempt, retryable, retry_after=response.headers.get('Retry-After'),
+                                                deadline_time=deadline_time)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response, content
+
+            logger.warning('retry %s %s in %.1f seconds after attempt %s failed due to %s',
+                           method, url, delay, attempt + 1, error or response.status)
+            await asyncio.sleep(delay)
+            attempt += 1
+            event.retries = attempt
+
+    _rate_limit_family = BaseAPI._rate_limit_family
+    _call_hooks = BaseAPI._call_hooks
+    _serialize_body = BaseAPI._serialize_body
+    _compress_body = BaseAPI._compress_body
+    _log_failure = BaseAPI._log_failure
+
+    @staticmethod
+    def _describe_payload(data):
+        return {}
+
+    @staticmethod
+    def _query_params(params):
+        # aiohttp accepts only strings as query values, lists are sent as repeated keys like in requests
+        query = []
+        for key, value in params.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            query.extend((key, str(item)) for item in values)
+        return query
+
+    def _data_from_response(self, response, content):
+        try:
+            return json.loads(content.decode('utf-8'))
+        except Exception as exc:
+            logger.warning('unable to parse json response due to %s', exc, exc_info=True,
+                           extra={'data': {'content': truncate(content)}})
+            raise AppMetricaRequestError
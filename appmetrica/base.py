@@ -1,13 +1,38 @@
 # coding: utf-8
 import logging
+import threading
+import time
+
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3 import Retry
 
-from appmetrica.exceptions import AppMetricaRequestError
+from appmetrica.exceptions import AppMetricaDeadlineExceeded, AppMetricaRequestError
+from appmetrica.metrics import RequestEvent
+from appmetrica.retry import RetryPolicy
+from appmetrica.serializers import default_serializer, gzip_compress
+from appmetrica.utils import payload_summary, redact_headers, truncate
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_SIZE = 10
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Create http session with a pool of kept-alive connections
+    The session is thread-safe and can be shared by several API instances (see `session` param of BaseAPI)
+
+    :param pool_size: max number of connections kept open per host
+    :return: requests.Session
+    """
+    # requests are retried by RetryPolicy of API
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 
 class BaseAPI(object):
     base_url = None
@@ -15,11 +40,81 @@ class BaseAPI(object):
     access_token = None
     app_id = None
 
-    def __init__(self, app_id, access_token):
+    rate_limit_family = None
+    retry_policy = RetryPolicy()
+    serializer = staticmethod(default_serializer)
+    compress_threshold = None  # min size of request body in bytes to compress it with gzip, None to disable
+    payload_dump_dir = None  # directory to write bodies of failed requests to, None to log only their summary
+    hooks = ()
+
+    def __init__(self, app_id, access_token, session=None, pool_size=DEFAULT_POOL_SIZE, rate_limiter=None,
+                 retry_policy=None, serializer=None, compress_threshold=None, payload_dump_dir=None, hooks=None,
+                 base_url=None):
+        """
+        :param app_id: application identifier
+        :param access_token: OAuth token
+        :param session (optional): shared session made by `create_session`.
+            Shared session is not closed by `close`, its owner is responsible for that
+        :param pool_size (optional): size of connection pool of own session
+        :param rate_limiter (optional): `appmetrica.ratelimit.RateLimiter` to pace requests,
+            can be shared by several instances
+        :param retry_policy (optional): `appmetrica.retry.RetryPolicy` of failed requests
+        :param serializer (optional): function which serializes request data to JSON bytes,
+            stdlib json by default, see `appmetrica.serializers.get_serializer`
+        :param compress_threshold (optional): compress request bodies larger than this number of bytes with gzip
+        :param payload_dump_dir (optional): write whole bodies of failed requests to files in this directory.
+            Only size, digest and short description of body are logged by default
+        :param hooks (optional): list of `appmetrica.metrics.RequestHooks` called on start and end of every request,
+            e.g. `appmetrica.metrics.MetricsCollector`
+        :param base_url (optional): URL of API to use instead of the default one, e.g. of a test server
+        """
         self.app_id = app_id
         self.access_token = access_token
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        if serializer is not None:
+            self.serializer = serializer
+        if compress_threshold is not None:
+            self.compress_threshold = compress_threshold
+        if payload_dump_dir is not None:
+            self.payload_dump_dir = payload_dump_dir
+        if hooks is not None:
+            self.hooks = list(hooks)
+        if base_url is not None:
+            self.base_url = base_url
+        self._session = session
+        self._owns_session = session is None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = create_session(self.pool_size)
+        return self._session
 
-    def _request(self, method, endpoint, params=None, headers=None, json=None):
+    def close(self):
+        """
+        Close own session and release its connections
+        """
+        with self._session_lock:
+            if self._owns_session and self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _request(self, method, endpoint, params=None, headers=None, json=None, stream=False, idempotent=None):
+        """
+        :param idempotent: whether the request can be repeated after it is received by server, True for GET by default
+        """
         params = params or {}
         headers = headers or {}
         headers.setdefault('Content-Type', 'application/json')
@@ -27,37 +122,133 @@ class BaseAPI(object):
                            'OAuth {access_token}'.format(access_token=self.access_token))
 
         url = '{base_url}/{endpoint}'.format(base_url=self.base_url.rstrip('/'), endpoint=endpoint)
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
 
-        with requests.Session() as session:
-            number_of_retries = 3
-            retry_strategy = Retry(connect=number_of_retries,
-                                   method_whitelist=['GET', 'POST'],
-                                   backoff_factor=2)   # 1s, 2s, 4s
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session.mount('https://', adapter)
+        raw_body = self._serialize_body(method, url, headers, params, json) if json is not None else None
+        body = self._compress_body(raw_body, headers) if raw_body is not None else None
 
+        event = RequestEvent(method, endpoint, bytes_sent=len(body) if body is not None else 0)
+        self._call_hooks('on_request_start', event)
+        try:
             try:
-                response = session.request(method, url, params=params, json=json,
-                                           headers=headers, timeout=self.request_timeout)
+                response = self._send(method, url, endpoint, idempotent, event=event, params=params, data=body,
+                                      headers=headers, stream=stream)
             except Exception as exc:
-                logger.error('failed to request %s %s with headers=%s, params=%s json=%s due to %s',
-                             method, url, headers, params, json, exc,
-                             exc_info=True,
-                             extra={'data': {'json': json, 'params': params}})
+                event.error = exc.__class__.__name__
+                self._log_failure(method, url, headers, params, json, raw_body, exc, exc_info=True)
                 raise AppMetricaRequestError
 
-        if not (200 <= response.status_code < 300):
-            logger.error('failed to request %s %s with headers=%s, params=%s json=%s due to %s',
-                         method, url, headers, params, json, response.content,
-                         extra={'data': {'json': json, 'params': params}})
+            event.status_code = response.status_code
+            event.wait_time = response.elapsed.total_seconds()
+            if not (200 <= response.status_code < 300):
+                self._log_failure(method, url, headers, params, json, raw_body, truncate(response.content))
+                raise AppMetricaRequestError(status_code=response.status_code)
+
+            if stream:
+                return self._stream_from_response(response)
+            parse_started = time.time()
+            data = self._data_from_response(response)
+            event.parse_time = time.time() - parse_started
+            event.bytes_received = len(response.content)
+            return data
+        except Exception as exc:
+            event.error = event.error or exc.__class__.__name__
+            raise
+        finally:
+            event.finish()
+            self._call_hooks('on_request_end', event)
+
+    def _call_hooks(self, name, event):
+        for hook in self.hooks:
+            try:
+                getattr(hook, name)(event)
+            except Exception as exc:
+                logger.warning('request hook %s.%s failed due to %s', hook.__class__.__name__, name, exc,
+                               exc_info=True)
+
+    def _serialize_body(self, method, url, headers, params, data):
+        try:
+            return self.serializer(data)
+        except (TypeError, ValueError, OverflowError) as exc:
+            self._log_failure(method, url, headers, params, data, None, exc, exc_info=True)
             raise AppMetricaRequestError
 
-        return self._data_from_response(response)
+    def _compress_body(self, body, headers):
+        if self.compress_threshold is not None and len(body) >= self.compress_threshold:
+            body = gzip_compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        return body
+
+    def _log_failure(self, method, url, headers, params, data, body, reason, exc_info=False):
+        # payloads can hold hundreds of thousands of tokens, so only their summary is logged
+        payload = None
+        if body is not None:
+            payload = payload_summary(body, self._describe_payload(data), self.payload_dump_dir)
+        logger.error('failed to request %s %s with headers=%s, params=%s payload=%s due to %s',
+                     method, url, redact_headers(headers), params, payload, reason,
+                     exc_info=exc_info,
+                     extra={'data': {'payload': payload, 'params': params}})
+
+    @staticmethod
+    def _describe_payload(data):
+        """
+        :return: dict with short description of request data to be logged instead of the data
+        """
+        return {}
+
+    def _send(self, method, url, endpoint, idempotent, event=None, **kwargs):
+        deadline_time = self.retry_policy.deadline_time()
+        attempt = 0
+        while True:
+            self._wait_for_rate_limit(endpoint, deadline_time)
+            timeout = self.request_timeout
+            if deadline_time is not None:
+                timeout = max(min(timeout, deadline_time - time.time()), 0.001)
+
+            response, error = None, None
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as exc:
+                error = exc
+
+            delay = self.retry_policy.retry_delay(attempt, idempotent, response=response, error=error,
+                                                  deadline_time=deadline_time)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+
+            logger.warning('retry %s %s in %.1f seconds after attempt %s failed due to %s',
+                           method, url, delay, attempt + 1, error or response.status_code)
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+            if event is not None:
+                event.retries = attempt
+
+    def _wait_for_rate_limit(self, endpoint, deadline_time):
+        """
+        raise AppMetricaDeadlineExceeded if rate limiter does not allow the request before deadline
+        """
+        if self.rate_limiter is None:
+            return
+        remaining = deadline_time - time.time() if deadline_time is not None else None
+        if not self.rate_limiter.acquire(self._rate_limit_family(endpoint), timeout=remaining):
+            raise AppMetricaDeadlineExceeded('rate limit does not allow request before deadline')
+
+    def _rate_limit_family(self, endpoint):
+        return self.rate_limit_family
+
+    def _stream_from_response(self, response):
+        # body is not read yet, it is up to caller to read and close response
+        return response
 
     def _data_from_response(self, response):
         try:
             return response.json()
         except Exception as exc:
             logger.warning('unable to parse json response due to %s', exc, exc_info=True,
-                           extra={'data': {'content': response.content}})
+                           extra={'data': {'content': truncate(response.content)}})
             raise AppMetricaRequestError
@@ -5,4 +5,20 @@ class AppMetricaException(Exception):
 
 class AppMetricaRequestError(AppMetricaException):
     """Raised when received an expected error code from yandex push api"""
+
+    def __init__(self, *args, **kwargs):
+        self.status_code = kwargs.pop('status_code', None)  # None if response was not received
+        super(AppMetricaRequestError, self).__init__(*args, **kwargs)
+
+
+class AppMetricaDeadlineExceeded(AppMetricaException):
+    """Raised when request can not be sent before deadline of retry policy, e.g. due to rate limiter"""
     pass
+
+
+class AppMetricaMultiAppError(AppMetricaException):
+    """Raised when queries of some applications of multi-app client failed"""
+
+    def __init__(self, message='queries of some applications failed', errors=None):
+        super(AppMetricaMultiAppError, self).__init__(message)
+        self.errors = errors or {}  # dict {app_id: exception} of failed applications
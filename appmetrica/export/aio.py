@@ -0,0 +1,45 @@
+# coding: utf-8
+import logging
+
+from appmetrica.aiobase import AsyncBaseAPI
+from appmetrica.export import exceptions
+from appmetrica.export.api import ExportAPI
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncExportAPI(AsyncBaseAPI):
+    """
+    Asyncio version of ExportAPI, see its methods for details
+    """
+    base_url = ExportAPI.base_url
+    rate_limit_family = ExportAPI.rate_limit_family
+
+    async def export_push_tokens(self, *fields):
+        params = ExportAPI._push_tokens_params(self.app_id, fields)
+        try:
+            response_data = await self._request('get', 'push_tokens.json', params=params)
+        except exceptions.AppMetricaPrepareData:
+            raise
+        except Exception as exc:
+            logger.error('push_tokens request failed due to %s', exc, exc_info=True)
+            raise exceptions.AppMetricaExportPushTokenError
+        return response_data['data']
+
+    async def export_installations(self, *fields, **kwargs):
+        params = ExportAPI._installations_params(self.app_id, fields, **kwargs)
+        try:
+            response_data = await self._request('get', 'installations.json', params=params)
+        except exceptions.AppMetricaPrepareData:
+            raise
+        except Exception as exc:
+            logger.error('installations request failed due to %s', exc, exc_info=True)
+            raise exceptions.AppMetricaExportInstallationsError
+        return response_data['data']
+
+    def _data_from_response(self, response, content):
+        if response.status == 202:
+            # Query is added to the queue
+            raise exceptions.AppMetricaPrepareData
+
+        return super(AsyncExportAPI, self)._data_from_response(response, content)
@@ -1,27 +1,83 @@
 # coding: utf-8
+import datetime
 import logging
+import threading
+import time
+from concurrent import futures
+from contextlib import closing
+
 from appmetrica.base import BaseAPI
 from appmetrica.export import exceptions
-from appmetrica.utils import format_appmetrica_date
+from appmetrica.export.incremental import RECEIVE_TIMESTAMP_FIELD, Delta
+from appmetrica.export.parsers import iter_csv_rows, iter_json_array, make_record_type
+from appmetrica.export.sharding import iter_sharded, window_size
+from appmetrica.ratelimit import EndpointFamilies
+from appmetrica.sinks import open_sink
+from appmetrica.utils import Backoff, format_appmetrica_date
 
 logger = logging.getLogger(__name__)
 
+EXPORT_FORMATS = ('json', 'csv')
+
 
 class ExportAPI(BaseAPI):
     base_url = 'https://api.appmetrica.yandex.ru/logs/v1/export/'
+    rate_limit_family = EndpointFamilies.LOGS_EXPORT
+    max_workers = 4  # max number of exports submitted at once
+    stream_chunk_size = 64 * 1024  # size of chunks of streamed exports in bytes
+    max_record_size = 1024 * 1024  # max size of the one record of streamed exports in characters
+    prepare_timeout = 60 * 60  # max time of waiting for data preparation with wait=True in seconds
+
+    def __init__(self, *args, **kwargs):
+        super(ExportAPI, self).__init__(*args, **kwargs)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        super(ExportAPI, self).close()
+
+    def submit(self, export, *fields, **kwargs):
+        """
+        Run export in background and wait until data is prepared
+        Use `concurrent.futures.as_completed` to collect several exports as soon as they are ready
+        :param export: export method of this instance, e.g. `api.export_installations`
+        :param fields: list of requested fields
+        :param kwargs: params of export method, `wait=True` by default
+        :param callback (optional): function to call with the future when export is done
+        :return: concurrent.futures.Future with the result of export
+        """
+        callback = kwargs.pop('callback', None)
+        kwargs.setdefault('wait', True)
+        future = self.executor.submit(export, *fields, **kwargs)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
 
-    def export_push_tokens(self, *fields):
+    def export_push_tokens(self, *fields, **kwargs):
         """
         Download all push tokens registered in the application
         :param fields: list of requested fields
+        :param wait (optional): repeat request while data is being prepared instead of raising AppMetricaPrepareData.
+            True to wait with default Backoff limited by `prepare_timeout` (1 hour) and raise AppMetricaPrepareTimeout
+            after it, or Backoff instance to set up intervals and timeout
+            raise AppMetricaPrepareTimeout if data is not prepared before Backoff timeout
         :return: list of push tokens
         """
-        params = {
-            'application_id': self.app_id,
-            'fields': ','.join(fields)
-        }
+        params = self._push_tokens_params(self.app_id, fields)
         try:
-            response_data = self._request('get', 'push_tokens.json', params=params)
+            response_data = self._export('push_tokens.json', params, wait=kwargs.get('wait'))
         except exceptions.AppMetricaPrepareData:
             raise
         except Exception as exc:
@@ -47,20 +103,13 @@ class ExportAPI(BaseAPI):
         :param fields: list of requested fields
         :param date_from (optional): from which date to download data
         :param date_till (optional): till which date to download data
+        :param wait (optional): repeat request while data is being prepared, see `export_push_tokens`
         :return: list of devices
         """
-        params = {
-            'application_id': self.app_id,
-            'fields': ','.join(fields),
-            'date_dimension': 'receive'
-        }
-        if kwargs.get('date_from'):
-            params['date_since'] = format_appmetrica_date(kwargs['date_from'])
-        if kwargs.get('date_till'):
-            params['date_until'] = format_appmetrica_date(kwargs['date_till'])
-
+        wait = kwargs.pop('wait', None)
+        params = self._installations_params(self.app_id, fields, **kwargs)
         try:
-            response_data = self._request('get', 'installations.json', params=params)
+            response_data = self._export('installations.json', params, wait=wait)
         except exceptions.AppMetricaPrepareData:
             raise
         except Exception as exc:
@@ -80,9 +129,199 @@ class ExportAPI(BaseAPI):
         # }
         return response_data['data']
 
+    def iter_push_tokens(self, *fields, **kwargs):
+        """
+        Download all push tokens registered in the application record by record
+        Response is parsed while it is being received, so memory usage does not depend on the size of export
+        See `export_push_tokens` for params
+        :param format (optional): format of export:
+            json (default) - records are dicts
+            csv - smaller and faster to parse, records are tuples of strings in order of fields,
+                columns are matched to fields by the header
+        :param record (optional): make records of csv export as instances of `make_record_type(fields)`
+        :return: generator of push tokens
+        """
+        params = self._push_tokens_params(self.app_id, fields)
+        return self._iter_export('push_tokens', params, fields, exceptions.AppMetricaExportPushTokenError, **kwargs)
+
+    def iter_installations(self, *fields, **kwargs):
+        """
+        Download installations record by record
+        Response is parsed while it is being received, so memory usage does not depend on the size of export
+        See `export_installations` and `iter_push_tokens` for params
+        :return: generator of devices
+        """
+        options = {key: kwargs.pop(key) for key in ('wait', 'format', 'record') if key in kwargs}
+        params = self._installations_params(self.app_id, fields, **kwargs)
+        return self._iter_export('installations', params, fields, exceptions.AppMetricaExportInstallationsError,
+                                 **options)
+
+    def save_push_tokens(self, path, *fields, **kwargs):
+        """
+        Stream push tokens into Parquet, Arrow IPC or gzipped NDJSON file, see `appmetrica.sinks`
+        Memory usage is bounded by chunk size
+        :param path: path to file
+        :param fields: list of requested fields, columns of the file
+        :param file_format (optional): parquet, arrow, ndjson or auto, by extension of path by default
+        :param chunk_size (optional): number of records written at once, size of row group of Parquet file
+        :param field_types (optional): dict {field: int, float, bool or string} to override types of columns
+        :param wait (optional): repeat request while data is being prepared, True by default
+        :return: number of saved tokens
+        """
+        sink_options = self._pop_sink_options(kwargs)
+        kwargs.setdefault('wait', True)
+        return self._save(path, fields, self.iter_push_tokens(*fields, **kwargs), **sink_options)
+
+    def save_installations(self, path, *fields, **kwargs):
+        """
+        Stream installations into Parquet, Arrow IPC or gzipped NDJSON file
+        See `save_push_tokens` and `iter_installations` for params
+        :return: number of saved devices
+        """
+        sink_options = self._pop_sink_options(kwargs)
+        kwargs.setdefault('wait', True)
+        return self._save(path, fields, self.iter_installations(*fields, **kwargs), **sink_options)
+
+    def iter_installations_sharded(self, *fields, **kwargs):
+        """
+        Download installations of the long date range split into windows which are downloaded concurrently
+        Rows are yielded in order of windows, windows do not overlap
+        Failed window is retried without downloading other windows again
+        raise ValueError if window is invalid
+        raise AppMetricaExportShardError if a window fails after all retries
+        :param fields: list of requested fields
+        :param date_from: from which date to download data
+        :param date_till: till which date to download data
+        :param window (optional): size of window, 'day' (default), 'hour' or timedelta
+        :param max_rows (optional): adaptive mode, target number of rows of the window,
+            see `appmetrica.export.sharding.iter_sharded`
+        :param max_workers (optional): max number of concurrent downloads
+        :param retries (optional): number of retries of the failed window
+        :param wait (optional): Backoff of waiting for data preparation of every window, True by default
+        :return: generator of devices
+        """
+        date_from = kwargs.pop('date_from')
+        date_till = kwargs.pop('date_till')
+        wait = kwargs.pop('wait', True)
+        kwargs['window'] = window_size(kwargs.get('window', 'day'))
+        kwargs.setdefault('max_workers', self.max_workers)
+
+        def fetch(since, until):
+            return self.export_installations(*fields, date_from=since, date_till=until, wait=wait)
+
+        return iter_sharded(fetch, date_from, date_till, **kwargs)
+
+    def iter_installations_incremental(self, *fields, **kwargs):
+        """
+        Download installations received after the watermark of the previous export of the application
+        The export starts at the second of the watermark, rows consumed by the previous export are dropped.
+        The watermark is saved only after all rows are consumed, so interrupted export is downloaded again.
+        The first export downloads all installations unless date_from is passed
+        :param fields: list of requested fields, `install_receive_timestamp` is added if it is missing
+        :param watermarks: `appmetrica.export.incremental.WatermarkStore`
+        :param date_from (optional): start of the first export
+        :param overlap (optional): timedelta to start export before the watermark. Dates are passed in UTC,
+            pass offset of timezone of the application if it is behind UTC. Rows before the watermark are dropped,
+            so overlap costs only downloading of extra rows
+        :param wait (optional): repeat request while data is being prepared, True by default
+        :return: `appmetrica.export.incremental.Delta`, iterable of devices
+        """
+        watermarks = kwargs.pop('watermarks')
+        overlap = kwargs.pop('overlap', datetime.timedelta(0))
+        date_from = kwargs.pop('date_from', None)
+        wait = kwargs.pop('wait', True)
+        if RECEIVE_TIMESTAMP_FIELD not in fields:
+            fields += (RECEIVE_TIMESTAMP_FIELD,)
+
+        watermark = watermarks.get(self.app_id)
+        if watermark is not None:
+            date_from = datetime.datetime.utcfromtimestamp(watermark.timestamp) - overlap
+        rows = self.iter_installations(*fields, date_from=date_from, wait=wait)
+        return Delta(rows, watermarks, self.app_id, watermark)
+
+    @staticmethod
+    def _pop_sink_options(kwargs):
+        options = {key: kwargs.pop(key) for key in ('chunk_size', 'field_types') if key in kwargs}
+        options['format'] = kwargs.pop('file_format', None)
+        return options
+
+    @staticmethod
+    def _save(path, fields, records, **sink_options):
+        with open_sink(path, fields, **sink_options) as sink:
+            return sink.write_many(records)
+
+    def _iter_export(self, resource, params, fields, error_class, wait=None, format='json', record=False):
+        assert format in EXPORT_FORMATS
+        endpoint = '{resource}.{format}'.format(resource=resource, format=format)
+        try:
+            response = self._export(endpoint, params, wait=wait, stream=True)
+        except exceptions.AppMetricaPrepareData:
+            raise
+        except Exception as exc:
+            logger.error('%s request failed due to %s', endpoint, exc, exc_info=True)
+            raise error_class
+
+        with closing(response):
+            chunks = response.iter_content(chunk_size=self.stream_chunk_size)
+            if format == 'csv':
+                records = iter_csv_rows(chunks, record_type=make_record_type(fields) if record else None,
+                                        fields=fields or None)
+            else:
+                records = iter_json_array(chunks, 'data', max_record_size=self.max_record_size)
+            try:
+                for item in records:
+                    yield item
+            except Exception as exc:
+                logger.error('%s streaming failed due to %s', endpoint, exc, exc_info=True)
+                raise error_class
+
+    def _export(self, endpoint, params, wait=None, stream=False):
+        backoff = Backoff(timeout=self.prepare_timeout) if wait is True else wait
+        intervals = backoff.intervals() if backoff else iter(())
+        while True:
+            try:
+                return self._request('get', endpoint, params=params, stream=stream)
+            except exceptions.AppMetricaPrepareData:
+                interval = next(intervals, None)
+                if interval is None:
+                    if backoff:
+                        logger.error('%s data is not prepared in %s seconds', endpoint, backoff.timeout)
+                        raise exceptions.AppMetricaPrepareTimeout
+                    raise
+                logger.info('%s data is being prepared, retry in %s seconds', endpoint, interval)
+                time.sleep(interval)
+
+    @staticmethod
+    def _push_tokens_params(app_id, fields):
+        return {
+            'application_id': app_id,
+            'fields': ','.join(fields)
+        }
+
+    @staticmethod
+    def _installations_params(app_id, fields, date_from=None, date_till=None):
+        params = {
+            'application_id': app_id,
+            'fields': ','.join(fields),
+            'date_dimension': 'receive'
+        }
+        if date_from:
+            params['date_since'] = format_appmetrica_date(date_from)
+        if date_till:
+            params['date_until'] = format_appmetrica_date(date_till)
+        return params
+
     def _data_from_response(self, response):
         if response.status_code == 202:
             # Query is added to the queue
             raise exceptions.AppMetricaPrepareData
 
         return super(ExportAPI, self)._data_from_response(response)
+
+    def _stream_from_response(self, response):
+        if response.status_code == 202:
+            # Query is added to the queue
+            response.close()
+            raise exceptions.AppMetricaPrepareData
+
+        return super(ExportAPI, self)._stream_from_response(response)
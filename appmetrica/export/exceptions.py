@@ -14,3 +14,18 @@ class AppMetricaExportPushTokenError(AppMetricaException):
 class AppMetricaPrepareData(AppMetricaException):
     """Raised when yandex export api responds that the request is queued for processing"""
     pass
+
+
+class AppMetricaPrepareTimeout(AppMetricaPrepareData):
+    """Raised when yandex export api does not prepare data in the given time"""
+    pass
+
+
+class AppMetricaExportShardError(AppMetricaException):
+    """Raised when the shard of sharded export can not be downloaded after all retries"""
+
+    def __init__(self, since, until, error):
+        super(AppMetricaExportShardError, self).__init__('shard %s - %s failed due to %s' % (since, until, error))
+        self.since = since
+        self.until = until
+        self.error = error
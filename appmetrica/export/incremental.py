@@ -0,0 +1,101 @@
+# coding: utf-8
+import hashlib
+import json
+import threading
+from collections import namedtuple
+
+from appmetrica.utils import write_json_atomic
+
+RECEIVE_TIMESTAMP_FIELD = 'install_receive_timestamp'
+
+# timestamp - max receive timestamp of consumed rows (unix seconds),
+# boundary - digests of consumed rows with this timestamp, they are downloaded again by the next export
+Watermark = namedtuple('Watermark', ['timestamp', 'boundary'])
+
+
+def row_digest(row):
+    return hashlib.sha1(json.dumps(row, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class WatermarkStore(object):
+    """
+    Thread-safe JSON file with watermarks of incremental exports by app_id
+    The file is replaced atomically, so watermark is either old or new after crash
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to JSON file, it is created on the first update
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get(self, app_id):
+        """
+        :return: Watermark or None if export of the application was never completed
+        """
+        with self._lock:
+            data = self._read().get(str(app_id))
+        if data is None:
+            return None
+        return Watermark(data['timestamp'], frozenset(data['boundary']))
+
+    def set(self, app_id, watermark):
+        with self._lock:
+            data = self._read()
+            data[str(app_id)] = {'timestamp': watermark.timestamp, 'boundary': sorted(watermark.boundary)}
+            write_json_atomic(self.path, data)
+
+    def _read(self):
+        try:
+            with open(self.path) as watermarks_file:
+                return json.load(watermarks_file)
+        except (IOError, OSError):
+            return {}
+
+
+class Delta(object):
+    """
+    Rows received after the watermark
+    Rows which were consumed by previous export are dropped,
+    the new watermark is saved only when all rows are consumed
+    """
+
+    def __init__(self, rows, store, app_id, watermark=None):
+        """
+        :param rows: iterable of dicts with RECEIVE_TIMESTAMP_FIELD
+        :param store: WatermarkStore
+        :param app_id: application identifier
+        :param watermark (optional): Watermark of the previous export
+        """
+        self.rows = rows
+        self.store = store
+        self.app_id = app_id
+        self.watermark = watermark
+        self.dropped = 0
+
+    def __iter__(self):
+        timestamp, boundary = self.watermark or (None, frozenset())
+        # rows of the last second are kept to digest them once at the end
+        new_timestamp, last_rows = timestamp, []
+
+        for row in self.rows:
+            row_timestamp = int(row[RECEIVE_TIMESTAMP_FIELD])
+            if timestamp is not None and row_timestamp <= timestamp:
+                if row_timestamp < timestamp or row_digest(row) in boundary:
+                    self.dropped += 1
+                    continue
+
+            if new_timestamp is None or row_timestamp > new_timestamp:
+                new_timestamp, last_rows = row_timestamp, [row]
+            elif row_timestamp == new_timestamp:
+                last_rows.append(row)
+            yield row
+
+        if new_timestamp is None:
+            return
+        new_boundary = frozenset(row_digest(row) for row in last_rows)
+        if new_timestamp == timestamp:
+            new_boundary |= boundary
+        self.watermark = Watermark(new_timestamp, new_boundary)
+        self.store.set(self.app_id, self.watermark)
@@ -0,0 +1,204 @@
+# coding: utf-8
+import codecs
+import csv
+import json
+import re
+import sys
+
+PY2 = sys.version_info[0] == 2
+
+WHITESPACE = re.compile(r'\s*')
+
+
+def iter_json_array(chunks, key='data', max_record_size=1024 * 1024):
+    """
+    Incrementally parse items of the array stored by `key` in JSON object like:
+        {
+          "data": [
+            {"token": "85059BF7C6A07F7088FA75189BE045AAE9A584ACB80840A8622A8913C2ED7B40"},
+            ...
+          ]
+        }
+    Only not parsed part of the last chunk is kept in memory, so memory usage is limited
+    by size of chunk and `max_record_size` whatever size of the document is
+    raise ValueError if the document is malformed or an item is larger than `max_record_size`
+
+    :param chunks: iterable of bytes, e.g. `response.iter_content(chunk_size)`
+    :param key: key of the array
+    :param max_record_size: max size of the one item in characters
+    :return: generator of items
+    """
+    reader = _ChunkReader(chunks, max_record_size)
+    head = re.compile(r'"{key}"\s*:\s*\['.format(key=re.escape(key)))
+
+    match = head.search(reader.buffer)
+    while match is None:
+        if reader.exhausted:
+            raise ValueError('array %s is not found' % key)
+        reader.read_more()
+        match = head.search(reader.buffer)
+
+    decoder = json.JSONDecoder()
+    pos = match.end()
+    while True:
+        pos = WHITESPACE.match(reader.buffer, pos).end()
+        if pos == len(reader.buffer):
+            pos = reader.read_more(pos)
+            continue
+        char = reader.buffer[pos]
+        if char == ']':
+            return
+        if char == ',':
+            pos += 1
+            continue
+
+        item, end = _decode_item(decoder, reader.buffer, pos)
+        # an item may be truncated by the end of the buffer, e.g. number 2500.0 may be decoded as 2500 from "2500.",
+        # so it is accepted only when the next char after it is received and ends the item
+        if end is None:
+            pos = reader.read_more(pos)
+            continue
+        yield item
+        pos = end
+
+
+def _decode_item(decoder, buffer, pos):
+    """
+    :return: tuple (item, position of the next delimiter) or (None, None) if the item is not complete in the buffer
+    """
+    try:
+        item, end = decoder.raw_decode(buffer, pos)
+    except ValueError:
+        return None, None
+    end = WHITESPACE.match(buffer, end).end()
+    if end == len(buffer) or buffer[end] not in ',]':
+        return None, None
+    return item, end
+
+
+def iter_csv_rows(chunks, record_type=None, fields=None):
+    """
+    Incrementally parse CSV document, the first row is a header
+    Only the current line is kept in memory
+    raise ValueError if some of fields is not found in the header
+    :param chunks: iterable of bytes, e.g. `response.iter_content(chunk_size)`
+    :param record_type (optional): class to make rows, it is called with values of the row as positional arguments,
+        e.g. result of `make_record_type`
+    :param fields (optional): names of columns to yield in this order, they are looked up in the header,
+        all columns in order of the header by default
+    :return: generator of rows, tuples of unicode strings if record_type is not provided
+    """
+    reader = _csv_reader(_iter_lines(chunks))
+    header = next(reader, None)
+    if header is None:
+        return
+    indices = _column_indices(header, fields)
+    for row in reader:
+        if not row:
+            continue
+        if indices is not None:
+            row = [row[index] for index in indices]
+        yield record_type(*row) if record_type else tuple(row)
+
+
+def _column_indices(header, fields):
+    """
+    :return: list of indices of fields in the header or None if fields are the header itself
+    """
+    if fields is None:
+        return None
+    missing = [field for field in fields if field not in header]
+    if missing:
+        raise ValueError('fields %s are not found in csv header %s' % (', '.join(missing), ', '.join(header)))
+    indices = [header.index(field) for field in fields]
+    return indices if indices != list(range(len(header))) else None
+
+
+def _csv_reader(lines):
+    if not PY2:
+        return csv.reader(lines)
+    # csv module of python 2 does not support unicode, so it parses utf-8 bytes
+    rows = csv.reader(line.encode('utf-8') for line in lines)
+    return ([value.decode('utf-8') for value in row] for row in rows)
+
+
+class Record(object):
+    """
+    Base class of lightweight records with fixed set of fields
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        values = ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
+        return '%s(%s)' % (type(self).__name__, values)
+
+    def _asdict(self):
+        return dict(zip(self.__slots__, self))
+
+
+def make_record_type(fields, name='Record'):
+    """
+    Make subclass of Record with the given fields
+    :param fields: list of field names
+    :param name: name of the class
+    :return: class
+    """
+    return type(str(name), (Record,), {'__slots__': tuple(str(field) for field in fields)})
+
+
+def _iter_lines(chunks):
+    # csv module requires line endings to parse quoted values with line breaks
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = u''
+    for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split(u'\n')
+        tail = lines.pop()  # the last line may be incomplete
+        for line in lines:
+            yield line + u'\n'
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class _ChunkReader(object):
+    """
+    Buffer of decoded chunks
+    """
+
+    def __init__(self, chunks, max_record_size):
+        self.chunks = iter(chunks)
+        self.max_record_size = max_record_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = u''
+        self.exhausted = False
+
+    def read_more(self, pos=0):
+        """
+        Drop parsed part of the buffer before `pos` and append the next chunk
+        raise ValueError if there are no more chunks or not parsed part of the buffer is too large
+        :return: new position of `pos` in the buffer
+        """
+        if self.exhausted:
+            raise ValueError('unexpected end of data')
+        if len(self.buffer) - pos > self.max_record_size:
+            raise ValueError('record is larger than %s' % self.max_record_size)
+
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            chunk = b''
+        self.buffer = self.buffer[pos:] + self.decoder.decode(chunk, final=self.exhausted)
+        return 0
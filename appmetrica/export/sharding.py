@@ -0,0 +1,115 @@
+# coding: utf-8
+import logging
+from collections import deque
+from concurrent import futures
+from datetime import date, datetime, time, timedelta
+
+from appmetrica.export.exceptions import AppMetricaExportShardError
+
+logger = logging.getLogger(__name__)
+
+ONE_SECOND = timedelta(seconds=1)  # precision of dates of export api
+WINDOWS = {
+    'day': timedelta(days=1),
+    'hour': timedelta(hours=1),
+}
+
+
+def window_size(window):
+    """
+    raise ValueError if window is not one of WINDOWS names or positive timedelta
+
+    :param window: timedelta or one of WINDOWS names
+    :return: timedelta
+    """
+    if isinstance(window, timedelta):
+        if window < ONE_SECOND:
+            raise ValueError('window must be at least one second, got {}'.format(window))
+        return window
+    if window not in WINDOWS:
+        raise ValueError('unknown window {!r}, use timedelta or one of {}'.format(window, ', '.join(sorted(WINDOWS))))
+    return WINDOWS[window]
+
+
+def _as_datetime(value, end_of_day=False):
+    """
+    Date bound of the range as datetime, dates include the whole day
+    """
+    if isinstance(value, datetime) or not isinstance(value, date):
+        return value
+    return datetime.combine(value, time(23, 59, 59) if end_of_day else time())
+
+
+def iter_sharded(fetch, date_from, date_till, window, max_workers=4, retries=2, max_rows=None,
+                 min_window=timedelta(hours=1)):
+    """
+    Split date range into windows, fetch them concurrently and yield rows in order of windows
+    Windows do not overlap: the window ends a second before the next one starts, so rows are not duplicated
+    raise ValueError if window is invalid, see `window_size`
+    raise AppMetricaExportShardError if the shard fails after all retries (and can not be split in adaptive mode)
+
+    :param fetch: function (since, until) -> list of rows, both dates are inclusive
+    :param date_from: start of the range, datetime or date (from 00:00:00)
+    :param date_till: end of the range (inclusive), datetime or date (till 23:59:59)
+    :param window: size of window, timedelta or one of WINDOWS names
+    :param max_workers: max number of concurrent shards, not more than max_workers shards are kept in memory
+    :param retries: number of retries of the failed shard
+    :param max_rows (optional): adaptive mode, target number of rows of the shard.
+        Size of next windows is adjusted to the number of rows of received shards (between `min_window` and `window`)
+        and failed windows are split in halves before giving up
+    :param min_window: min size of window in adaptive mode
+    :return: generator of rows
+    """
+    max_window = window_size(window)
+    date_from = _as_datetime(date_from)
+    date_till = _as_datetime(date_till, end_of_day=True)
+    size = max_window
+    next_since = date_from
+    pending = deque()  # (since, until, future) in order of windows
+
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(since, until):
+            return since, until, executor.submit(_fetch_with_retries, fetch, since, until, retries)
+
+        try:
+            while pending or next_since <= date_till:
+                while len(pending) < max_workers and next_since <= date_till:
+                    until = min(next_since + size - ONE_SECOND, date_till)
+                    pending.append(submit(next_since, until))
+                    next_since = until + ONE_SECOND
+
+                since, until, future = pending.popleft()
+                try:
+                    rows = future.result()
+                except AppMetricaExportShardError:
+                    if max_rows is None or until - since < min_window:
+                        raise
+                    logger.warning('split failed shard %s - %s', since, until)
+                    middle = since + (until - since) // 2
+                    middle -= timedelta(microseconds=middle.microsecond)
+                    pending.appendleft(submit(middle + ONE_SECOND, until))
+                    pending.appendleft(submit(since, middle))
+                    continue
+
+                if max_rows is not None:
+                    size = _adapt_window(until - since + ONE_SECOND, len(rows), max_rows, min_window, max_window)
+                for row in rows:
+                    yield row
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+
+def _fetch_with_retries(fetch, since, until, retries):
+    for attempt in range(retries + 1):
+        try:
+            return fetch(since, until)
+        except Exception as exc:
+            logger.warning('shard %s - %s failed on attempt %s due to %s', since, until, attempt + 1, exc)
+            error = exc
+    raise AppMetricaExportShardError(since, until, error)
+
+
+def _adapt_window(size, rows, max_rows, min_window, max_window):
+    seconds = size.total_seconds() * max_rows / max(rows, 1)
+    return min(max(timedelta(seconds=int(seconds)), min_window), max_window)
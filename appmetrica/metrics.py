@@ -0,0 +1,184 @@
+# coding: utf-8
+import bisect
+import re
+import threading
+import time
+from collections import Counter
+
+# upper bounds of latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class RequestEvent(object):
+    """
+    Measurements of one API request including all its retries
+    Timings are in seconds:
+        elapsed - total time of the request with retries, backoff and waiting for rate limiter
+        wait_time - time from sending of the last attempt to receiving response headers,
+            includes connect, TLS handshake and server time, which are not measured separately by requests
+        parse_time - time of reading and parsing of response body, None for streamed responses
+    Bytes received are None for streamed responses, their body is read by caller
+    """
+    __slots__ = ('method', 'endpoint', 'started_at', 'bytes_sent', 'bytes_received', 'status_code', 'retries',
+                 'elapsed', 'wait_time', 'parse_time', 'error')
+
+    def __init__(self, method, endpoint, bytes_sent=0):
+        self.method = method.upper()
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self.bytes_sent = bytes_sent
+        self.bytes_received = None
+        self.status_code = None
+        self.retries = 0
+        self.elapsed = None
+        self.wait_time = None
+        self.parse_time = None
+        self.error = None  # class name of exception
+
+    def finish(self):
+        self.elapsed = time.time() - self.started_at
+
+
+class RequestHooks(object):
+    """
+    Base class of request instrumentation, pass instances to `hooks` param of API
+    Hooks are called in the thread of request, exceptions of hooks are logged and ignored
+    """
+
+    def on_request_start(self, event):
+        """
+        :param event: RequestEvent with method, endpoint and bytes sent
+        """
+
+    def on_request_end(self, event):
+        """
+        :param event: finished RequestEvent
+        """
+
+
+def endpoint_label(endpoint):
+    """
+    Replace identifiers in endpoint path, e.g. status/123 -> status/{id}
+    """
+    return re.sub(r'(^|/)\d+(?=/|$)', r'\1{id}', endpoint)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        :return: upper bound of the bucket which contains quantile q, max observed value for the last bucket
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _EndpointMetrics(object):
+
+    def __init__(self, buckets):
+        self.latency = Histogram(buckets)
+        self.wait_time = Histogram(buckets)
+        self.parse_time = Histogram(buckets)
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def add(self, event):
+        self.latency.observe(event.elapsed)
+        if event.wait_time is not None:
+            self.wait_time.observe(event.wait_time)
+        if event.parse_time is not None:
+            self.parse_time.observe(event.parse_time)
+        self.retries += event.retries
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received or 0
+        if event.status_code is not None:
+            self.statuses[event.status_code] += 1
+        if event.error is not None:
+            self.errors[event.error] += 1
+
+    def summary(self):
+        return {
+            'count': self.latency.count,
+            'retries': self.retries,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'statuses': dict(self.statuses),
+            'errors': dict(self.errors),
+            'latency': _histogram_summary(self.latency),
+            'wait_time': _histogram_summary(self.wait_time),
+            'parse_time': _histogram_summary(self.parse_time),
+        }
+
+
+def _histogram_summary(histogram):
+    return {
+        'p50': histogram.quantile(0.5),
+        'p90': histogram.quantile(0.9),
+        'p99': histogram.quantile(0.99),
+        'max': histogram.max if histogram.count else None,
+        'mean': histogram.sum / histogram.count if histogram.count else None,
+    }
+
+
+class MetricsCollector(RequestHooks):
+    """
+    In-process collector of latency histograms, retries, sizes, statuses and errors by method and endpoint
+    Can be shared by several API instances
+
+    Usage:
+        collector = MetricsCollector()
+        api = PushAPI(app_id, access_token, hooks=[collector])
+        ...
+        collector.snapshot()  # {('POST', 'send-batch'): {'count': 10, 'latency': {'p50': 0.25, ...}, ...}}
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def on_request_end(self, event):
+        key = (event.method, endpoint_label(event.endpoint))
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = _EndpointMetrics(self.buckets)
+            metrics.add(event)
+
+    def snapshot(self):
+        """
+        :return: dict {(method, endpoint): summary} where summary contains count, retries, bytes_sent,
+            bytes_received, statuses, errors by exception class and quantiles of latency, wait_time and parse_time
+        """
+        with self._lock:
+            return {key: metrics.summary() for key, metrics in self._metrics.items()}
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
@@ -0,0 +1,254 @@
+# coding: utf-8
+import logging
+import threading
+from collections import namedtuple
+from concurrent import futures
+
+from appmetrica.base import create_session
+from appmetrica.exceptions import AppMetricaMultiAppError
+from appmetrica.export.api import ExportAPI
+from appmetrica.ratelimit import RateLimiter
+from appmetrica.stat.api import StatAPI
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:  # pragma: no cover
+    from Queue import Empty, Full, Queue
+
+logger = logging.getLogger(__name__)
+
+# result - result of the query or None if it failed, error - exception of the failed query
+AppResult = namedtuple('AppResult', ['app_id', 'result', 'error'])
+AppRow = namedtuple('AppRow', ['app_id', 'row'])
+
+_DONE = object()
+
+
+class MultiAppClient(object):
+    """
+    Runs the same stat or export query for several applications concurrently
+    All API instances share one connection pool and one rate limiter, so rate limits hold for all applications.
+    Failure of the application does not stop queries of other ones.
+
+    Usage:
+        with MultiAppClient(app_ids, access_token) as client:
+            results = client.export_stat({'metrics': 'ym:ts:users'}, timeout=60)
+            for app_id, result in results.items():
+                ...
+            for app_id, device in client.iter_installations('ios_ifv', date_from=date_from, date_till=date_till):
+                ...
+    """
+
+    def __init__(self, app_ids, access_token, max_workers=8, pool_size=None, rate_limiter=None, **api_kwargs):
+        """
+        :param app_ids: list of application identifiers
+        :param access_token: OAuth token with access to all applications
+        :param max_workers: max number of applications queried at once
+        :param pool_size (optional): size of shared connection pool, max_workers by default
+        :param rate_limiter (optional): shared `appmetrica.ratelimit.RateLimiter`, limiter with default limits
+            by default, pass RateLimiter({}) to disable limits
+        :param api_kwargs: other params of API instances, see `BaseAPI`
+        """
+        self.app_ids = list(app_ids)
+        self.access_token = access_token
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.session = create_session(pool_size or max_workers)
+        self.api_kwargs = api_kwargs
+        self._apis = {}
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        # executors of `run` with queries which are not completed in time
+        self._abandoned = []
+
+    def api(self, api_class, app_id):
+        """
+        :return: API instance of the application sharing the connection pool and the rate limiter
+        """
+        with self._lock:
+            key = (api_class, app_id)
+            if key not in self._apis:
+                self._apis[key] = api_class(app_id, self.access_token, session=self.session,
+                                            rate_limiter=self.rate_limiter, **self.api_kwargs)
+            return self._apis[key]
+
+    def run(self, api_class, query, timeout=None):
+        """
+        Run query for every application concurrently
+        :param api_class: StatAPI, ExportAPI or PushAPI
+        :param query: function (api) -> result
+        :param timeout (optional): max time to wait in seconds, queries which are not completed in time
+            get futures.TimeoutError, other applications are not affected.
+            Every call has its own workers, so running queries of the timed out call do not delay next calls,
+            but they hold their workers and connections until they are completed, which is limited
+            by `request_timeout` and `retry_policy` of API
+        :return: dict {app_id: AppResult}
+        """
+        executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = {executor.submit(query, self.api(api_class, app_id)): app_id for app_id in self.app_ids}
+        done, not_done = futures.wait(pending, timeout=timeout)
+        executor.shutdown(wait=False)
+        if not_done:
+            self._abandon(executor, not_done)
+
+        results = {}
+        for future in done:
+            app_id = pending[future]
+            error = future.exception()
+            if error is not None:
+                logger.error('query of application %s failed due to %s', app_id, error)
+            results[app_id] = AppResult(app_id, future.result() if error is None else None, error)
+        for future in not_done:
+            app_id = pending[future]
+            future.cancel()
+            logger.error('query of application %s is not completed in %s seconds', app_id, timeout)
+            results[app_id] = AppResult(app_id, None, futures.TimeoutError())
+        return {app_id: results[app_id] for app_id in self.app_ids}
+
+    def _abandon(self, executor, running):
+        """
+        Keep executor with running queries until they are completed, so `close` waits for them
+        """
+        remaining = [len(running)]
+
+        def release(future):
+            with self._lock:
+                remaining[0] -= 1
+                if not remaining[0] and executor in self._abandoned:
+                    self._abandoned.remove(executor)
+
+        with self._lock:
+            self._abandoned.append(executor)
+        for future in running:
+            future.add_done_callback(release)
+
+    def stream(self, api_class, query, buffer_size=10000):
+        """
+        Run query for every application concurrently and merge rows into one stream in order of receiving
+        Not more than `buffer_size` rows are kept in memory, so slow consumer pauses downloads
+        raise AppMetricaMultiAppError after rows of all other applications if queries of some applications failed
+
+        :param api_class: StatAPI or ExportAPI
+        :param query: function (api) -> iterable of rows
+        :param buffer_size: max number of received rows waiting for consumer
+        :return: generator of AppRow(app_id, row)
+        """
+        rows = Queue(maxsize=buffer_size)
+        stopped = threading.Event()
+        tasks = [self._executor.submit(self._produce, api_class, app_id, query, rows, stopped)
+                 for app_id in self.app_ids]
+        errors = {}
+        remaining = len(tasks)
+        try:
+            while remaining:
+                try:
+                    app_id, row, error = rows.get(timeout=0.1)
+                except Empty:
+                    continue
+                if row is not _DONE:
+                    yield AppRow(app_id, row)
+                    continue
+                remaining -= 1
+                if error is not None:
+                    logger.error('query of application %s failed due to %s', app_id, error)
+                    errors[app_id] = error
+        finally:
+            stopped.set()
+            for task in tasks:
+                task.cancel()
+
+        if errors:
+            raise AppMetricaMultiAppError(errors=errors)
+
+    def _produce(self, api_class, app_id, query, rows, stopped):
+        """
+        Put rows of the application to the queue and _DONE with error at the end,
+        stop when consumer of the stream is closed
+        """
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    rows.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        try:
+            for row in query(self.api(api_class, app_id)):
+                if not put((app_id, row, None)):
+                    return
+        except Exception as exc:
+            put((app_id, _DONE, exc))
+        else:
+            put((app_id, _DONE, None))
+
+    def export_stat(self, params, columnar=False, timeout=None):
+        """
+        See `StatAPI.export_stat`, `ids` param is set to every application
+        :return: dict {app_id: AppResult}
+        """
+        return self.run(StatAPI, lambda api: api.export_stat(dict(params, ids=api.app_id), columnar=columnar),
+                        timeout=timeout)
+
+    def iter_stat(self, params, page_size=10000, prefetch=2):
+        """
+        See `StatAPI.iter_stat` and `stream`
+        :return: generator of AppRow(app_id, row)
+        """
+        def query(api):
+            return api.iter_stat(dict(params, ids=api.app_id), page_size=page_size, prefetch=prefetch)
+        return self.stream(StatAPI, query)
+
+    def export_push_tokens(self, *fields, **kwargs):
+        """
+        See `ExportAPI.export_push_tokens`
+        :param timeout (optional): see `run`
+        :return: dict {app_id: AppResult}
+        """
+        timeout = kwargs.pop('timeout', None)
+        return self.run(ExportAPI, lambda api: api.export_push_tokens(*fields, **kwargs), timeout=timeout)
+
+    def export_installations(self, *fields, **kwargs):
+        """
+        See `ExportAPI.export_installations`
+        :param timeout (optional): see `run`
+        :return: dict {app_id: AppResult}
+        """
+        timeout = kwargs.pop('timeout', None)
+        return self.run(ExportAPI, lambda api: api.export_installations(*fields, **kwargs), timeout=timeout)
+
+    def iter_push_tokens(self, *fields, **kwargs):
+        """
+        See `ExportAPI.iter_push_tokens` and `stream`
+        :return: generator of AppRow(app_id, row)
+        """
+        return self.stream(ExportAPI, lambda api: api.iter_push_tokens(*fields, **kwargs))
+
+    def iter_installations(self, *fields, **kwargs):
+        """
+        See `ExportAPI.iter_installations` and `stream`
+        :return: generator of AppRow(app_id, row)
+        """
+        return self.stream(ExportAPI, lambda api: api.iter_installations(*fields, **kwargs))
+
+    def close(self):
+        """
+        Stop workers and close connections, running queries are completed
+        """
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            abandoned = list(self._abandoned)
+        for executor in abandoned:
+            executor.shutdown(wait=True)
+        with self._lock:
+            for api in self._apis.values():
+                api.close()
+            self._apis = {}
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,62 @@
+# coding: utf-8
+import logging
+
+from appmetrica.aiobase import AsyncBaseAPI
+from appmetrica.push import exceptions
+from appmetrica.push.api import PushAPI
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPushAPI(AsyncBaseAPI):
+    """
+    Asyncio version of PushAPI, see its methods for details
+    """
+    base_url = PushAPI.base_url
+
+    _describe_payload = staticmethod(PushAPI._describe_payload)
+    _rate_limit_family = PushAPI._rate_limit_family
+
+    async def create_group(self, name, send_rate=None):
+        group = PushAPI._build_group(self.app_id, name, send_rate)
+        try:
+            response_data = await self._request('post', 'management/groups', json={'group': group})
+        except Exception as exc:
+            logger.error('create_group request with json %s failed due to %s', group, exc, exc_info=True)
+            raise exceptions.AppMetricaCreateGroupError
+        return response_data['group']['id']
+
+    async def get_groups(self):
+        try:
+            response_data = await self._request('get', 'management/groups', params={'app_id': self.app_id})
+        except Exception as exc:
+            logger.error('get_groups request failed due to %s', exc, exc_info=True)
+            raise exceptions.AppMetricaGetGroupsError
+        return response_data['groups']
+
+    async def send_push(self, group_id, devices=None, ios_message=None, android_message=None, tag=None):
+        data = PushAPI._build_push_data(group_id, devices, ios_message, android_message, tag)
+        return await self.send(data)
+
+    async def send(self, data):
+        PushAPI._validate(data)
+        # request with client_transfer_id is deduplicated by server, so it is safe to repeat it
+        idempotent = data['push_batch_request'].get('client_transfer_id') is not None
+        try:
+            response_data = await self._request('post', 'send-batch', json=data, idempotent=idempotent)
+        except Exception as exc:
+            logger.error('send_push request %s failed due to %s', PushAPI._describe_payload(data), exc, exc_info=True)
+            raise exceptions.AppMetricaSendPushError
+        return response_data['push_response']['transfer_id']
+
+    async def check_status(self, transfer_id):
+        endpoint = 'status/{transfer_id}'.format(transfer_id=transfer_id)
+        try:
+            response_data = await self._request('get', endpoint)
+        except Exception as exc:
+            logger.error('check_status request for transfer_id %s failed due to %s',
+                         transfer_id, exc, exc_info=True)
+            raise exceptions.AppMetricaCheckStatusError
+        return PushAPI._transfer_status(response_data)
+
+    build_ios_message = staticmethod(PushAPI.build_ios_message)
@@ -2,15 +2,33 @@
 import datetime
 import json
 import logging
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent import futures
 
 from appmetrica.base import BaseAPI
 from appmetrica.push import exceptions
+from appmetrica.push.batching import iter_device_batches, read_tokens
+from appmetrica.push.groups import GroupRegistry
+from appmetrica.push.personalized import PersonalizedBatches
+from appmetrica.ratelimit import EndpointFamilies
+from appmetrica.retry import RETRY_ALWAYS_STATUSES
 
 logger = logging.getLogger(__name__)
 
 MAX_NUMBER_IN_BATCH = 250000
 MAX_NUMBER_OF_GROUPS = 5
 
+# status of transfer which can not be polled, it is set by client
+POLL_ERROR_STATUS = 'error'
+FINAL_STATUSES = ('sent', 'failed', POLL_ERROR_STATUS)
+
+BulkSendResult = namedtuple('BulkSendResult', ['transfer_id', 'start', 'stop'])
+PersonalizedSendResult = namedtuple('PersonalizedSendResult', ['transfer_id', 'devices'])
+TransferStatus = namedtuple('TransferStatus', ['transfer_id', 'status', 'errors'])
+
 
 class TokenTypes(object):
     APPMETRICA_DEVICE_ID = 'appmetrica_device_id'
@@ -20,9 +38,92 @@ class TokenTypes(object):
     IOS_PUSH_TOKEN = 'ios_push_token'
 
 
+def new_client_transfer_id():
+    """
+    Random identifier which is used by server to deduplicate repeated send-batch requests
+    """
+    return uuid.uuid4().int >> 66  # 62 bits to fit in signed int64
+
+
+class _TransferPoll(object):
+    """
+    State of polling of the transfer status
+    """
+
+    def __init__(self, transfer_id, poll_interval):
+        self.transfer_id = transfer_id
+        self.status = None
+        self.errors = []
+        self.interval = poll_interval
+        self.next_time = 0
+
+        self.failures = 0  # number of consecutive failed polls
+
+    def update(self, response_data, poll_interval, max_poll_interval):
+        status = response_data['transfer']['status'] if response_data else self.status
+        if response_data and status != self.status:
+            self.interval = poll_interval
+        else:
+            self.interval = min(self.interval * 2, max_poll_interval)
+        if response_data:
+            self.status = status
+            self.errors = response_data['transfer'].get('errors') or []
+            self.failures = 0
+        self.next_time = time.time() + self.interval
+
+    def fail(self, error, max_failures):
+        """
+        Register failed poll, the transfer gets the final status `error` if the failure is permanent
+        (4xx response except 429) or polls failed `max_failures` times in a row
+        """
+        self.failures += 1
+        status_code = getattr(error, 'status_code', None)
+        permanent = status_code is not None and 400 <= status_code < 500 and status_code not in RETRY_ALWAYS_STATUSES
+        if permanent or self.failures >= max_failures:
+            self.status = POLL_ERROR_STATUS
+            self.errors = ['status request failed {failures} times, last response status {status_code}'.format(
+                failures=self.failures, status_code=status_code)]
+
+    def result(self):
+        return TransferStatus(self.transfer_id, self.status, self.errors)
+
+
 class PushAPI(BaseAPI):
     base_url = 'https://push.api.appmetrica.yandex.net/push/v1/'
 
+    def __init__(self, *args, **kwargs):
+        """
+        See BaseAPI for params
+        :param groups_ttl (optional): max age of cached groups in seconds, see `appmetrica.push.groups.GroupRegistry`
+        :param groups_path (optional): path to JSON file to keep cached groups in
+        """
+        self.groups_ttl = kwargs.pop('groups_ttl', 300)
+        self.groups_path = kwargs.pop('groups_path', None)
+        super(PushAPI, self).__init__(*args, **kwargs)
+        self._groups = None
+        self._groups_lock = threading.Lock()
+
+    @property
+    def groups(self):
+        """
+        Cached registry of groups, see `appmetrica.push.groups.GroupRegistry`
+        """
+        if self._groups is None:
+            with self._groups_lock:
+                if self._groups is None:
+                    self._groups = GroupRegistry(self, ttl=self.groups_ttl, path=self.groups_path)
+        return self._groups
+
+    def get_or_create_group(self, name, send_rate=None):
+        """
+        Find group by name in cached groups or create it
+        Concurrent calls create only one group, in all processes of the host if `groups_path` is set
+        :param name: name of the group
+        :param send_rate: send rate of created group, see `create_group`
+        :return: Identifier of the group
+        """
+        return self.groups.get_or_create(name, send_rate=send_rate)
+
     def create_group(self, name, send_rate=None):
         """
         Create group to combine the sending in the report
@@ -30,17 +131,7 @@ class PushAPI(BaseAPI):
         :param send_rate: Limit on the max speed of sending push messages (number per second)
         :return: Identifier of the created group
         """
-        assert name
-        group = {
-            'app_id': self.app_id,
-            'name': name,
-        }
-        if send_rate is not None:
-            if not (100 <= send_rate <= 5000):
-                logger.error('create_group with send_rate = %s failed. possible values from 100 to 5000', send_rate)
-                raise exceptions.AppMetricaCreateGroupError
-            group['send_rate'] = send_rate
-
+        group = self._build_group(self.app_id, name, send_rate)
         try:
             response_data = self._request('post', 'management/groups', json={'group': group})
         except Exception as exc:
@@ -119,31 +210,99 @@ class PushAPI(BaseAPI):
         :param tag: send tag to combine the sending in the report
         :return: Identifier of the sending push (transfer_id)
         """
+        data = self._build_push_data(group_id, devices, ios_message, android_message, tag)
+        return self.send(data)
+
+    def send_bulk(self, group_id, devices, ios_message=None, android_message=None, tag=None, max_workers=4,
+                  id_type=None, token_filter=None):
+        """
+        Sends push messages to any number of devices
+        Devices are packed into send-batch requests that fit in MAX_NUMBER_IN_BATCH and MAX_NUMBER_OF_GROUPS,
+        requests are sent concurrently
+        Devices are read lazily, so not more than `max_workers` requests are kept in memory
+        raise AppMetricaBulkSendError if some of requests failed, sent requests are available in `results` attribute
+
+        :param group_id: group to combine the sending in the report
+        :param devices: list of token objects (see `send_push`), iterable of (id_type, token) pairs
+            or path to newline-delimited file with tokens (see `appmetrica.push.batching.read_tokens`)
+        :param ios_message: push message for ios devices, see `send_push`
+        :param android_message: push message for android devices, see `send_push`
+        :param tag: send tag to combine the sending in the report
+        :param max_workers: max number of concurrent requests
+        :param id_type: type of tokens in the file without id types
+        :param token_filter (optional): `appmetrica.push.validation.TokenFilter` to drop invalid and duplicate
+            tokens, its `report` has numbers of dropped tokens after sending
+        :return: list of BulkSendResult(transfer_id, start, stop) ordered by range of devices,
+            start and stop are positions of first and after last device of the request in passed devices
+            (in filtered devices if token_filter is passed)
+        """
         if not devices:
             logger.error('send push error: devices are not provided')
             raise exceptions.AppMetricaSendPushError('devices are not provided')
-        if not ios_message and not android_message:
-            logger.error('send push error: messages are not provided')
-            raise exceptions.AppMetricaSendPushError('messages are not provided')
+        messages = self._build_messages(ios_message, android_message)
+        tag = tag or datetime.datetime.now().isoformat()  # default tag
+        chunks = self._iter_chunks(devices, id_type, token_filter)
 
-        messages = {}
-        if ios_message:
-            messages['iOS'] = ios_message
-        if android_message:
-            messages['android'] = android_message
+        batches = (((start, stop), [{'messages': messages, 'devices': devices} for devices in devices_list])
+                   for start, stop, devices_list in chunks)
+        try:
+            return self._send_batches(group_id, tag, batches, max_workers)
+        finally:
+            if token_filter is not None:
+                logger.info('send_bulk filtered tokens: %s', token_filter.report())
 
+    def send_personalized(self, group_id, template, devices, tag=None, max_workers=4):
+        """
+        Sends personalized push messages rendered from the template with variables of every device
+        Devices with equal rendered messages are sent in one batch item, items are packed into the fewest requests
+        (see `appmetrica.push.personalized.PersonalizedBatches`), requests are sent concurrently
+        raise AppMetricaBulkSendError if some of requests failed, sent requests are available in `results` attribute,
+        failed ones in `errors` attribute as (devices, exception)
+
+        :param group_id: group to combine the sending in the report
+        :param template: `appmetrica.push.personalized.MessageTemplate`
+        :param devices: iterable of (id_type, token, variables) where variables is dict with values of placeholders
+        :param tag: send tag to combine the sending in the report
+        :param max_workers: max number of concurrent requests
+        :return: list of PersonalizedSendResult(transfer_id, devices) where devices is sorted list of positions
+            of devices of the request in passed devices
+        """
+        batches = PersonalizedBatches(template, max_devices=MAX_NUMBER_IN_BATCH, max_groups=MAX_NUMBER_OF_GROUPS)
+        batches.add_many(devices)
+        if not batches.devices:
+            logger.error('send push error: devices are not provided')
+            raise exceptions.AppMetricaSendPushError('devices are not provided')
+        logger.info('send_personalized: %s devices, %s distinct messages, %s renders',
+                    batches.devices, batches.distinct_messages, template.renders)
         tag = tag or datetime.datetime.now().isoformat()  # default tag
-        data = {
-            'push_batch_request': {
-                'group_id': group_id,
-                'tag': tag,
-                'batch': [{
-                    'messages': messages,
-                    'devices': devices
-                }]
-            }
-        }
-        return self.send(data)
+        return self._send_batches(group_id, tag, (((positions,), batch) for positions, batch in batches), max_workers,
+                                  result_class=PersonalizedSendResult)
+
+    def _send_batches(self, group_id, tag, batches, max_workers, result_class=BulkSendResult):
+        """
+        :param batches: iterable of (position, batch), batch is list of batch items of the request,
+            position is tuple of fields of result_class after transfer_id, e.g. (start, stop)
+        :return: list of result_class ordered by position
+        """
+        results, errors = [], []
+        pending = {}
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for position, batch in batches:
+                # do not read more chunks than can be sent right now
+                if len(pending) >= max_workers:
+                    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    self._collect_bulk_results(done, pending, results, errors, result_class)
+
+                data = self._build_request_data(group_id, tag, batch, new_client_transfer_id())
+                pending[executor.submit(self.send, data)] = position
+
+            self._collect_bulk_results(futures.as_completed(list(pending)), pending, results, errors, result_class)
+
+        results.sort(key=lambda result: tuple(result[1:]))
+        if errors:
+            logger.error('sending failed for %s of %s requests', len(errors), len(errors) + len(results))
+            raise exceptions.AppMetricaBulkSendError(results=results, errors=errors)
+        return results
 
     def send(self, data):
         """
@@ -153,10 +312,12 @@ class PushAPI(BaseAPI):
         :return: Identifier of the sending push (transfer_id)
         """
         self._validate(data)
+        # request with client_transfer_id is deduplicated by server, so it is safe to repeat it
+        idempotent = data['push_batch_request'].get('client_transfer_id') is not None
         try:
-            response_data = self._request('post', 'send-batch', json=data)
+            response_data = self._request('post', 'send-batch', json=data, idempotent=idempotent)
         except Exception as exc:
-            logger.error('send_push request with json %s failed due to %s', data, exc, exc_info=True)
+            logger.error('send_push request %s failed due to %s', self._describe_payload(data), exc, exc_info=True)
             raise exceptions.AppMetricaSendPushError
         return response_data['push_response']['transfer_id']
 
@@ -172,6 +333,84 @@ class PushAPI(BaseAPI):
             pending — the request is accepted and waits for validation
             sent — sending completed
         """
+        response_data = self._request_transfer(transfer_id)
+        return self._transfer_status(response_data)
+
+    def wait_for_transfers(self, transfer_ids, timeout=None, poll_interval=1, max_poll_interval=60, max_workers=10,
+                           max_poll_failures=10):
+        """
+        Wait until sending of pushes is completed
+        See `iter_transfers` for params
+
+        :return: dict {transfer_id: TransferStatus}
+        """
+        return {
+            transfer.transfer_id: transfer
+            for transfer in self.iter_transfers(transfer_ids, timeout=timeout, poll_interval=poll_interval,
+                                                max_poll_interval=max_poll_interval, max_workers=max_workers,
+                                                max_poll_failures=max_poll_failures)
+        }
+
+    def iter_transfers(self, transfer_ids, timeout=None, poll_interval=1, max_poll_interval=60, max_workers=10,
+                       max_poll_failures=10):
+        """
+        Poll statuses of pushes concurrently and yield every transfer as soon as it is sent or failed
+        Interval between polls of transfer doubles while its status (pending, in_progress) stays the same
+        and drops to `poll_interval` when the status changes
+        Transfer gets status `error` when status request responds with 4xx (except 429),
+        e.g. for unknown transfer, or `max_poll_failures` status requests in a row failed
+
+        :param transfer_ids: Push identifiers (return after call `send_push`)
+        :param timeout: max time to wait in seconds, unfinished transfers are yielded with the last known status
+            (None if status was not received) when it is expired
+        :param poll_interval: min interval between polls of the transfer in seconds
+        :param max_poll_interval: max interval between polls of the transfer in seconds
+        :param max_workers: max number of concurrent requests
+        :param max_poll_failures: max number of consecutive failed status requests of the transfer
+        :return: generator of TransferStatus(transfer_id, status, errors)
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        polls = {transfer_id: _TransferPoll(transfer_id, poll_interval) for transfer_id in transfer_ids}
+
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while polls:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    break
+
+                due = [poll for poll in polls.values() if poll.next_time <= now]
+                for poll, (response_data, error) in zip(due, executor.map(self._poll_transfer, due)):
+                    poll.update(response_data, poll_interval, max_poll_interval)
+                    if error is not None:
+                        poll.fail(error, max_poll_failures)
+                    if poll.status in FINAL_STATUSES:
+                        del polls[poll.transfer_id]
+                        yield poll.result()
+
+                if polls:
+                    wake_time = min(poll.next_time for poll in polls.values())
+                    if deadline is not None:
+                        wake_time = min(wake_time, deadline)
+                    time.sleep(max(wake_time - time.time(), 0))
+
+        for poll in polls.values():
+            logger.warning('transfer %s is not completed in %s seconds', poll.transfer_id, timeout)
+            yield poll.result()
+
+    def _poll_transfer(self, poll):
+        try:
+            return self._request_transfer(poll.transfer_id), None
+        except exceptions.AppMetricaCheckStatusError as exc:
+            return None, exc
+
+    def _rate_limit_family(self, endpoint):
+        if endpoint == 'send-batch':
+            return EndpointFamilies.PUSH_SEND
+        if endpoint.startswith('status/'):
+            return EndpointFamilies.PUSH_STATUS
+        return EndpointFamilies.PUSH_MANAGEMENT
+
+    def _request_transfer(self, transfer_id):
         endpoint = 'status/{transfer_id}'.format(transfer_id=transfer_id)
 
         try:
@@ -179,7 +418,7 @@ class PushAPI(BaseAPI):
         except Exception as exc:
             logger.error('check_status request for transfer_id %s failed due to %s',
                          transfer_id, exc, exc_info=True)
-            raise exceptions.AppMetricaCheckStatusError
+            raise exceptions.AppMetricaCheckStatusError(status_code=getattr(exc, 'status_code', None))
 
         # response_data contain dict like:
         # {
@@ -194,6 +433,80 @@ class PushAPI(BaseAPI):
         #     ]
         #   }
         # }
+        return response_data
+
+    @staticmethod
+    def _build_group(app_id, name, send_rate):
+        assert name
+        group = {
+            'app_id': app_id,
+            'name': name,
+        }
+        if send_rate is not None:
+            if not (100 <= send_rate <= 5000):
+                logger.error('create_group with send_rate = %s failed. possible values from 100 to 5000', send_rate)
+                raise exceptions.AppMetricaCreateGroupError
+            group['send_rate'] = send_rate
+        return group
+
+    @classmethod
+    def _build_push_data(cls, group_id, devices, ios_message, android_message, tag):
+        if not devices:
+            logger.error('send push error: devices are not provided')
+            raise exceptions.AppMetricaSendPushError('devices are not provided')
+        messages = cls._build_messages(ios_message, android_message)
+
+        tag = tag or datetime.datetime.now().isoformat()  # default tag
+        return {
+            'push_batch_request': {
+                'group_id': group_id,
+                'tag': tag,
+                'batch': [{
+                    'messages': messages,
+                    'devices': devices
+                }]
+            }
+        }
+
+    @staticmethod
+    def _iter_chunks(devices, id_type=None, token_filter=None):
+        if isinstance(devices, (type(''), type(u''))):
+            devices = read_tokens(devices, id_type=id_type)
+        if token_filter is not None:
+            devices = token_filter.filter(devices)
+        return iter_device_batches(devices, max_devices=MAX_NUMBER_IN_BATCH, max_groups=MAX_NUMBER_OF_GROUPS)
+
+    @staticmethod
+    def _describe_payload(data):
+        if 'push_batch_request' not in data:
+            return {}
+        request = data['push_batch_request']
+        return {
+            'group_id': request.get('group_id'),
+            'tag': request.get('tag'),
+            'client_transfer_id': request.get('client_transfer_id'),
+            'batch_items': len(request['batch']),
+            'devices': sum(len(group['id_values']) for item in request['batch'] for group in item['devices']),
+        }
+
+    @classmethod
+    def _build_batch_data(cls, group_id, tag, messages, devices_list, client_transfer_id):
+        batch = [{'messages': messages, 'devices': devices} for devices in devices_list]
+        return cls._build_request_data(group_id, tag, batch, client_transfer_id)
+
+    @staticmethod
+    def _build_request_data(group_id, tag, batch, client_transfer_id):
+        return {
+            'push_batch_request': {
+                'group_id': group_id,
+                'client_transfer_id': client_transfer_id,
+                'tag': tag,
+                'batch': batch
+            }
+        }
+
+    @staticmethod
+    def _transfer_status(response_data):
         if response_data['transfer']['status'] == 'failed':
             errors = response_data['transfer']['errors']
             if errors:
@@ -201,6 +514,28 @@ class PushAPI(BaseAPI):
 
         return response_data['transfer']['status']
 
+    @staticmethod
+    def _build_messages(ios_message, android_message):
+        if not ios_message and not android_message:
+            logger.error('send push error: messages are not provided')
+            raise exceptions.AppMetricaSendPushError('messages are not provided')
+
+        messages = {}
+        if ios_message:
+            messages['iOS'] = ios_message
+        if android_message:
+            messages['android'] = android_message
+        return messages
+
+    @staticmethod
+    def _collect_bulk_results(done, pending, results, errors, result_class=BulkSendResult):
+        for future in done:
+            position = pending.pop(future)
+            try:
+                results.append(result_class(future.result(), *position))
+            except exceptions.AppMetricaSendPushError as exc:
+                errors.append(position + (exc,))
+
     @staticmethod
     def build_ios_message(**kwargs):
         """
@@ -228,7 +563,8 @@ class PushAPI(BaseAPI):
             "content": content,
         }
 
-    def _validate(self, data):
+    @staticmethod
+    def _validate(data):
         required_fileds = ['group_id', 'tag', 'batch']
         for field in required_fileds:
             if field not in data['push_batch_request']:
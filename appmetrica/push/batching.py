@@ -0,0 +1,94 @@
+# coding: utf-8
+import io
+import itertools
+from collections import OrderedDict
+
+
+def read_tokens(path, id_type=None):
+    """
+    Lazily read devices from newline-delimited file
+    Every line contains token or id type and token separated by tab:
+        ios_push_token\tF6A79E9F844A24C5FBED5C58A4C71561C180F...
+    :param path: path to file
+    :param id_type: type of tokens for lines without id type
+    :return: generator of (id_type, token) pairs
+    """
+    with io.open(path, encoding='utf-8') as tokens_file:
+        for line in tokens_file:
+            line = line.strip()
+            if not line:
+                continue
+            if '\t' in line:
+                line_id_type, token = line.split('\t', 1)
+                yield line_id_type, token
+            elif id_type is None:
+                raise ValueError('id type of token %s is unknown' % line)
+            else:
+                yield id_type, line
+
+
+def iter_device_batches(devices, max_devices, max_groups):
+    """
+    Pack devices into chunks which fit in the limits of one send-batch request
+    Devices are consumed lazily, so only about one chunk is kept in memory
+    :param devices: list of token objects like:
+        [
+            {
+                "id_type": "appmetrica_device_id",
+                "id_values": ["123456789", "42"]
+            },
+            ...
+        ]
+        or any iterable of (id_type, token) pairs, e.g. `read_tokens` result
+    :param max_devices: max number of devices in the one request
+    :param max_groups: max number of device groups in the one batch item
+    :return: generator of tuples (start, stop, devices_list) where
+        start, stop - range of devices (in order of passing) covered by chunk
+        devices_list - list of device groups of every batch item of the request
+    """
+    devices = iter(devices)
+    try:
+        first = next(devices)
+    except StopIteration:
+        return iter(())
+    devices = itertools.chain([first], devices)
+
+    if isinstance(first, dict):
+        segments = ((group['id_type'], group['id_values']) for group in devices)
+    else:
+        segments = _segments_from_pairs(devices, max_devices)
+    return _pack_segments(segments, max_devices, max_groups)
+
+
+def _segments_from_pairs(pairs, max_devices):
+    for id_type, group in itertools.groupby(pairs, key=lambda pair: pair[0]):
+        while True:
+            values = [value for _, value in itertools.islice(group, max_devices)]
+            if not values:
+                break
+            yield id_type, values
+
+
+def _pack_segments(segments, max_devices, max_groups):
+    chunk = OrderedDict()
+    chunk_size = 0
+    start = 0
+    for id_type, values in segments:
+        offset = 0
+        while offset < len(values):
+            taken = values[offset:offset + max_devices - chunk_size]
+            chunk.setdefault(id_type, []).extend(taken)
+            chunk_size += len(taken)
+            offset += len(taken)
+            if chunk_size == max_devices:
+                yield start, start + chunk_size, _split_groups(chunk, max_groups)
+                start += chunk_size
+                chunk, chunk_size = OrderedDict(), 0
+
+    if chunk_size:
+        yield start, start + chunk_size, _split_groups(chunk, max_groups)
+
+
+def _split_groups(chunk, max_groups):
+    groups = [{'id_type': id_type, 'id_values': values} for id_type, values in chunk.items()]
+    return [groups[i:i + max_groups] for i in range(0, len(groups), max_groups)]
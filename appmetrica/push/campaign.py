@@ -0,0 +1,181 @@
+# coding: utf-8
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from appmetrica.push import exceptions
+from appmetrica.push.api import FINAL_STATUSES, TransferStatus, new_client_transfer_id
+
+logger = logging.getLogger(__name__)
+
+BatchRecord = namedtuple('BatchRecord', ['batch', 'start', 'stop', 'tag', 'client_transfer_id', 'transfer_id',
+                                         'status', 'errors'])
+
+
+class CampaignJournal(object):
+    """
+    Append-only SQLite journal of batches of push campaigns
+    Every change of the batch is a new event, the state of the batch is its last event
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS campaign_events ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' campaign TEXT NOT NULL,'
+                ' batch INTEGER NOT NULL,'
+                ' event TEXT NOT NULL,'
+                ' start INTEGER NOT NULL,'
+                ' stop INTEGER NOT NULL,'
+                ' tag TEXT,'
+                ' client_transfer_id INTEGER,'
+                ' transfer_id INTEGER,'
+                ' status TEXT,'
+                ' errors TEXT,'
+                ' created_at REAL NOT NULL)'
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS campaign_events_batch ON campaign_events (campaign, batch)'
+            )
+
+    def append(self, campaign, event, record):
+        """
+        Write event of the batch, it is committed before return
+        :param campaign: name of campaign
+        :param event: planned, sent or status
+        :param record: BatchRecord
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO campaign_events (campaign, batch, event, start, stop, tag, client_transfer_id, '
+                'transfer_id, status, errors, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (campaign, record.batch, event, record.start, record.stop, record.tag, record.client_transfer_id,
+                 record.transfer_id, record.status, json.dumps(record.errors or []), time.time())
+            )
+
+    def batches(self, campaign):
+        """
+        :param campaign: name of campaign
+        :return: dict {batch number: BatchRecord} with the last state of every batch
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT batch, start, stop, tag, client_transfer_id, transfer_id, status, errors '
+                'FROM campaign_events WHERE campaign = ? ORDER BY id',
+                (campaign,)
+            ).fetchall()
+        batches = {}
+        for batch, start, stop, tag, client_transfer_id, transfer_id, status, errors in rows:
+            batches[batch] = BatchRecord(batch, start, stop, tag, client_transfer_id, transfer_id, status,
+                                         json.loads(errors) if errors else [])
+        return batches
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class Campaign(object):
+    """
+    Resumable push campaign
+    Every batch is written to the journal before and after sending, so after crash `run` sends only batches
+    which are not confirmed. Not confirmed batch is sent again with the same client_transfer_id,
+    so it is deduplicated by server if the previous request was received.
+    Devices must be passed in the same order on every run.
+    """
+
+    def __init__(self, api, journal, name, group_id, ios_message=None, android_message=None, tag=None):
+        """
+        :param api: PushAPI instance
+        :param journal: CampaignJournal instance
+        :param name: unique name of the campaign in the journal
+        :param group_id: group to combine the sending in the report
+        :param ios_message: push message for ios devices, see `PushAPI.send_push`
+        :param android_message: push message for android devices, see `PushAPI.send_push`
+        :param tag: send tag to combine the sending in the report, name of campaign by default
+        """
+        self.api = api
+        self.journal = journal
+        self.name = name
+        self.group_id = group_id
+        self.messages = api._build_messages(ios_message, android_message)
+        self.tag = tag or name
+
+    def run(self, devices, id_type=None, token_filter=None):
+        """
+        Send batches of devices which are not confirmed in the journal
+        raise AppMetricaSendPushError if sending of batch failed, run again to resume the campaign
+
+        :param devices: list of token objects, iterable of (id_type, token) pairs or path to file with tokens,
+            see `PushAPI.send_bulk`
+        :param id_type: type of tokens in the file without id types
+        :param token_filter (optional): `appmetrica.push.validation.TokenFilter` to drop invalid and duplicate tokens,
+            ranges of batches are positions in filtered devices
+        :return: list of BatchRecord of all batches
+        """
+        journaled = self.journal.batches(self.name)
+        records = []
+        chunks = self.api._iter_chunks(devices, id_type, token_filter)
+        for batch, (start, stop, devices_list) in enumerate(chunks):
+            record = journaled.get(batch)
+            if record is not None and (record.start, record.stop) != (start, stop):
+                logger.error('campaign %s batch %s has range %s - %s in journal, but got %s - %s',
+                             self.name, batch, record.start, record.stop, start, stop)
+                raise exceptions.AppMetricaSendPushError('devices of campaign are changed')
+
+            if record is None or record.transfer_id is None:
+                record = self._send_batch(batch, start, stop, devices_list, record)
+            records.append(record)
+        return records
+
+    def reconcile(self, timeout=None, poll_interval=1, max_workers=10):
+        """
+        Wait for statuses of sent batches which are not completed yet and write them to the journal
+        See `PushAPI.iter_transfers` for params
+        :return: list of BatchRecord of all batches
+        """
+        batches = self.journal.batches(self.name)
+        polled = {
+            record.transfer_id: record for record in batches.values()
+            if record.transfer_id is not None and record.status not in FINAL_STATUSES
+        }
+        transfers = self.api.iter_transfers(list(polled), timeout=timeout, poll_interval=poll_interval,
+                                            max_workers=max_workers)
+        for transfer in transfers:
+            record = polled[transfer.transfer_id]._replace(status=transfer.status, errors=transfer.errors)
+            self.journal.append(self.name, 'status', record)
+            batches[record.batch] = record
+        return [batches[batch] for batch in sorted(batches)]
+
+    def statuses(self):
+        """
+        :return: dict {transfer_id: TransferStatus} of sent batches known from the journal
+        """
+        return {
+            record.transfer_id: TransferStatus(record.transfer_id, record.status, record.errors)
+            for record in self.journal.batches(self.name).values() if record.transfer_id is not None
+        }
+
+    def _send_batch(self, batch, start, stop, devices_list, record=None):
+        if record is None:
+            record = BatchRecord(batch, start, stop, self.tag, new_client_transfer_id(), None, None, [])
+            self.journal.append(self.name, 'planned', record)
+        else:
+            logger.warning('campaign %s batch %s is not confirmed, send it again', self.name, batch)
+
+        data = self.api._build_batch_data(self.group_id, record.tag, self.messages, devices_list,
+                                          record.client_transfer_id)
+        transfer_id = self.api.send(data)
+        record = record._replace(transfer_id=transfer_id)
+        self.journal.append(self.name, 'sent', record)
+        return record
@@ -18,4 +18,17 @@ class AppMetricaSendPushError(AppMetricaException):
 
 class AppMetricaCheckStatusError(AppMetricaException):
     """Raised when yandex push api responds with an error that checking status"""
-    pass
+
+    def __init__(self, *args, **kwargs):
+        self.status_code = kwargs.pop('status_code', None)  # None if response was not received
+        super(AppMetricaCheckStatusError, self).__init__(*args, **kwargs)
+
+
+class AppMetricaBulkSendError(AppMetricaSendPushError):
+    """Raised when some of requests of bulk sending failed"""
+
+    def __init__(self, message='some of requests failed', results=None, errors=None):
+        super(AppMetricaBulkSendError, self).__init__(message)
+        self.results = results or []  # list of BulkSendResult of successful requests
+        # list of (start, stop, exception) of failed requests, (devices, exception) of personalized sending
+        self.errors = errors or []
@@ -0,0 +1,178 @@
+# coding: utf-8
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from appmetrica.utils import write_json_atomic
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def _null_lock():
+    yield
+
+
+@contextmanager
+def _file_lock(path):
+    """
+    Exclusive lock between processes, no-op where fcntl is not available
+    """
+    if fcntl is None:  # pragma: no cover
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class GroupRegistry(object):
+    """
+    Thread-safe in-process index of push groups by name and by id
+    Groups are loaded once and refreshed in background thread when they are older than ttl,
+    so lookups do not wait for management endpoints. With a file the index is shared between processes
+    and survives restarts, and creation of groups is serialized between processes of the host.
+    """
+
+    def __init__(self, api, ttl=300, path=None):
+        """
+        :param api: PushAPI instance
+        :param ttl: max age of the index in seconds before it is refreshed in background, None to never refresh
+        :param path (optional): path to JSON file with the index
+        """
+        self.api = api
+        self.ttl = ttl
+        self.path = path
+        self._lock = threading.RLock()
+        self._by_name = {}
+        self._by_id = {}
+        self._updated_at = None
+        self._refreshing = None
+        if path is not None:
+            self._load()
+
+    def get(self, name):
+        """
+        :return: dict with group metadata or None if there is no group with the name
+        """
+        self._ensure_fresh()
+        return self._by_name.get(name)
+
+    def get_by_id(self, group_id):
+        """
+        :return: dict with group metadata or None if there is no group with the id
+        """
+        self._ensure_fresh()
+        return self._by_id.get(group_id)
+
+    def get_or_create(self, name, send_rate=None):
+        """
+        Find group by name or create it, concurrent calls with the same name create only one group
+        raise AppMetricaCreateGroupError or AppMetricaGetGroupsError if management request failed
+
+        :param name: name of the group
+        :param send_rate: send rate of created group, see `PushAPI.create_group`
+        :return: identifier of the group
+        """
+        group = self.get(name)
+        if group is not None:
+            return group['id']
+
+        with self._lock, self._process_lock():
+            # the group can be created by another thread or process while waiting for the lock
+            if self.path is not None:
+                self._load(merge=True)
+            if name not in self._by_name:
+                self.refresh()
+            if name not in self._by_name:
+                group_id = self.api.create_group(name, send_rate=send_rate)
+                group = self.api._build_group(self.api.app_id, name, send_rate)
+                self._add(dict(group, id=group_id))
+                self._save()
+            return self._by_name[name]['id']
+
+    def refresh(self):
+        """
+        Reload all groups from API
+        """
+        groups = self.api.get_groups()
+        with self._lock:
+            self._replace(groups, time.time())
+            self._save()
+
+    def _add(self, group):
+        self._by_name[group['name']] = group
+        self._by_id[group['id']] = group
+
+    def _replace(self, groups, updated_at):
+        # indexes are swapped at once, so lookups without lock never see partially filled index
+        self._by_name = {group['name']: group for group in groups}
+        self._by_id = {group['id']: group for group in groups}
+        self._updated_at = updated_at
+
+    def _ensure_fresh(self):
+        if self._updated_at is None:
+            with self._lock:
+                if self._updated_at is None:
+                    self.refresh()
+        elif self.ttl is not None and time.time() - self._updated_at > self.ttl:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return
+            self._refreshing = threading.Thread(target=self._background_refresh, name='appmetrica-groups')
+            self._refreshing.daemon = True
+            self._refreshing.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as exc:
+            # stale index is still used, refresh is retried on the next lookup
+            logger.warning('failed to refresh push groups due to %s', exc, exc_info=True)
+
+    def _process_lock(self):
+        if self.path is None:
+            return _null_lock()
+        return _file_lock(self.path + '.lock')
+
+    def _load(self, merge=False):
+        """
+        :param merge: add groups from the file to the index instead of replacing older index
+        """
+        try:
+            with open(self.path) as index_file:
+                data = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('app_id') != self.api.app_id:
+            return
+        with self._lock:
+            if merge:
+                for group in data['groups']:
+                    if group['name'] not in self._by_name:
+                        self._add(group)
+                return
+            if self._updated_at is None or self._updated_at < data['updated_at']:
+                self._replace(data['groups'], data['updated_at'])
+
+    def _save(self):
+        if self.path is None:
+            return
+        write_json_atomic(self.path, {
+            'app_id': self.api.app_id,
+            'updated_at': self._updated_at or time.time(),
+            'groups': list(self._by_id.values()),
+        })
@@ -0,0 +1,176 @@
+# coding: utf-8
+import array
+import hashlib
+import string
+from collections import OrderedDict
+
+from appmetrica.push import exceptions
+from appmetrica.serializers import default_serializer
+
+
+def _template_fields(value, fields):
+    """
+    Collect names of placeholders of all strings of the message
+    raise AppMetricaSendPushError if some string has `$` which does not start a placeholder
+    """
+    if isinstance(value, dict):
+        for item in value.values():
+            _template_fields(item, fields)
+    elif isinstance(value, list):
+        for item in value:
+            _template_fields(item, fields)
+    elif isinstance(value, (type(''), type(u''))):
+        for match in string.Template.pattern.finditer(value):
+            if match.group('invalid') is not None:
+                raise exceptions.AppMetricaSendPushError(
+                    'invalid placeholder at position %s of template %r, use $$ for $' % (match.start(), value))
+            name = match.group('named') or match.group('braced')
+            if name is not None and name not in fields:
+                fields.append(name)
+    return fields
+
+
+def _render(value, variables):
+    if isinstance(value, dict):
+        return {key: _render(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_render(item, variables) for item in value]
+    if isinstance(value, (type(''), type(u''))):
+        return string.Template(value).substitute(variables)
+    return value
+
+
+class MessageTemplate(object):
+    """
+    Push messages with `$name` or `${name}` placeholders in strings, e.g. built by `PushAPI.build_ios_message`:
+        MessageTemplate(ios_message=api.build_ios_message(title='Hi, $name', text='$book for $$5 is waiting'))
+    `$$` is rendered as `$`, any other `$` which does not start a placeholder is an error
+    Messages are rendered once per distinct values of placeholders, rendered messages are cached
+    and identified by digest of their JSON, so equal messages of different variables are sent together
+    """
+
+    def __init__(self, ios_message=None, android_message=None, cache_size=100000, serializer=None):
+        """
+        :param ios_message: template of push message for ios devices, see `PushAPI.send_push`
+        :param android_message: template of push message for android devices
+        :param cache_size: max number of rendered messages kept in cache, the oldest ones are evicted
+        :param serializer (optional): function which serializes messages to JSON bytes for digest
+        raise AppMetricaSendPushError if messages are not provided or some of them has invalid placeholder
+        """
+        if not ios_message and not android_message:
+            raise exceptions.AppMetricaSendPushError('messages are not provided')
+        self.messages = {}
+        if ios_message:
+            self.messages['iOS'] = ios_message
+        if android_message:
+            self.messages['android'] = android_message
+        self.fields = tuple(_template_fields(self.messages, []))
+        self.cache_size = cache_size
+        self.serializer = serializer or default_serializer
+        self.renders = 0
+        self._cache = OrderedDict()
+
+    def render(self, variables):
+        """
+        raise AppMetricaSendPushError if value of some placeholder is not provided
+
+        :param variables: dict with values of placeholders, other keys are ignored
+        :return: tuple (digest, messages)
+        """
+        try:
+            key = tuple([variables[field] for field in self.fields])
+        except KeyError as exc:
+            raise exceptions.AppMetricaSendPushError('variable %s is not provided' % exc.args[0])
+
+        rendered = self._cache.get(key)
+        if rendered is None:
+            messages = _render(self.messages, dict(zip(self.fields, key)))
+            rendered = hashlib.sha1(self.serializer(messages)).hexdigest(), messages
+            self.renders += 1
+            self._cache[key] = rendered
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rendered
+
+
+class PersonalizedBatches(object):
+    """
+    Groups devices by rendered message and packs them into the fewest send-batch requests
+    Requests are filled up to max_devices one by one, so the number of requests is minimal,
+    and every distinct message is one batch item (or one per max_groups types of tokens)
+    except for messages split by the end of the request, at most one per request.
+    All devices are kept in memory until the batches are built.
+
+    Usage:
+        batches = PersonalizedBatches(template, MAX_NUMBER_IN_BATCH, MAX_NUMBER_OF_GROUPS)
+        batches.add_many((id_type, token, {'name': name}) for id_type, token, name in rows)
+        for devices, batch in batches:
+            ...
+    """
+
+    def __init__(self, template, max_devices, max_groups):
+        """
+        :param template: MessageTemplate
+        :param max_devices: max number of devices in the one request
+        :param max_groups: max number of device groups in the one batch item
+        """
+        self.template = template
+        self.max_devices = max_devices
+        self.max_groups = max_groups
+        self.devices = 0
+        # digest -> (messages, OrderedDict {id_type: ([tokens], array of positions of devices in order of adding)})
+        self._messages = OrderedDict()
+
+    def add(self, id_type, token, variables):
+        digest, messages = self.template.render(variables)
+        groups = self._messages.get(digest)
+        if groups is None:
+            self._messages[digest] = messages, OrderedDict()
+            groups = self._messages[digest]
+        group = groups[1].get(id_type)
+        if group is None:
+            group = groups[1][id_type] = [], array.array('l')
+        group[0].append(token)
+        group[1].append(self.devices)
+        self.devices += 1
+
+    def add_many(self, devices):
+        """
+        :param devices: iterable of (id_type, token, variables)
+        """
+        for id_type, token, variables in devices:
+            self.add(id_type, token, variables)
+
+    @property
+    def distinct_messages(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        """
+        :return: generator of tuples (devices, batch) where
+            devices - sorted list of positions of devices of the request in order of adding
+            batch - list of batch items {"messages": ..., "devices": [...]} of the request
+        """
+        batch, positions, size = [], [], 0
+        for messages, groups in self._messages.values():
+            item_groups = []
+            for id_type, (tokens, indices) in groups.items():
+                offset = 0
+                while offset < len(tokens):
+                    stop = offset + self.max_devices - size
+                    item_groups.append({'id_type': id_type, 'id_values': tokens[offset:stop]})
+                    positions.extend(indices[offset:stop])
+                    size = len(positions)
+                    offset = min(stop, len(tokens))
+                    if size == self.max_devices:
+                        batch.extend(self._items(messages, item_groups))
+                        yield sorted(positions), batch
+                        batch, item_groups, positions, size = [], [], [], 0
+            batch.extend(self._items(messages, item_groups))
+
+        if batch:
+            yield sorted(positions), batch
+
+    def _items(self, messages, groups):
+        return [{'messages': messages, 'devices': groups[i:i + self.max_groups]}
+                for i in range(0, len(groups), self.max_groups)]
@@ -0,0 +1,134 @@
+# coding: utf-8
+import itertools
+import operator
+import re
+from collections import Counter, OrderedDict
+
+from appmetrica.push.api import TokenTypes
+
+_UUID = r'[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}'
+
+TOKEN_PATTERNS = {
+    TokenTypes.APPMETRICA_DEVICE_ID: re.compile(r'[0-9]{1,20}\Z'),
+    TokenTypes.IOS_IFA: re.compile(_UUID + r'\Z'),
+    TokenTypes.GOOGLE_AID: re.compile(_UUID + r'\Z'),
+    # APNs device token is 32 bytes now, but Apple allows it to grow up to 100 bytes
+    TokenTypes.IOS_PUSH_TOKEN: re.compile(r'(?:[0-9A-Fa-f]{2}){32,100}\Z'),
+    # FCM registration token is opaque, only its alphabet is checked
+    TokenTypes.ANDROID_PUSH_TOKEN: re.compile(r'[0-9A-Za-z_:.\-]{20,4096}\Z'),
+}
+
+
+_TEXT_TYPES = (type(''), type(u''))
+
+
+def _token_text(value):
+    """
+    Stripped token as string, e.g. int appmetrica_device_id, None is empty
+    """
+    if isinstance(value, _TEXT_TYPES):
+        return value.strip()
+    return u'' if value is None else u'{}'.format(value).strip()
+
+
+class DropReasons(object):
+    EMPTY = 'empty'
+    DUPLICATE = 'duplicate'
+    MALFORMED = 'malformed'
+    UNKNOWN_TYPE = 'unknown_type'
+
+
+class TokenFilter(object):
+    """
+    Drop empty, malformed and duplicate tokens before sending
+    Tokens are deduplicated within and across groups of every id type for the whole life of the filter,
+    so use one filter per sending. Tokens are checked by groups with set operations and C-level regex matching,
+    millions of tokens are filtered in seconds.
+
+    Usage:
+        token_filter = TokenFilter()
+        api.send_bulk(group_id, devices, ios_message=message, token_filter=token_filter)
+        token_filter.report()  # {'accepted': 999000, 'duplicate': 700, 'malformed': 300, ...}
+    """
+
+    def __init__(self, patterns=None, group_size=10000):
+        """
+        :param patterns (optional): dict {id_type: compiled regex} of valid tokens, TOKEN_PATTERNS by default.
+            Tokens of id types without pattern are dropped
+        :param group_size: number of (id_type, token) pairs checked at once
+        """
+        self.patterns = TOKEN_PATTERNS if patterns is None else patterns
+        self.group_size = group_size
+        self.accepted = 0
+        self.dropped = Counter()
+        self._seen = {}
+
+    def filter(self, devices):
+        """
+        :param devices: list of token objects or iterable of (id_type, token) pairs, see `PushAPI.send_bulk`
+        :return: generator of token objects with valid unique tokens
+        """
+        devices = iter(devices)
+        try:
+            first = next(devices)
+        except StopIteration:
+            return iter(())
+        devices = itertools.chain([first], devices)
+
+        if isinstance(first, dict):
+            return self._filter_groups(devices)
+        return self._filter_pairs(devices)
+
+    def filter_values(self, id_type, values):
+        """
+        :param id_type: type of tokens, see TokenTypes
+        :param values: list of tokens, strings or values converted to strings like int appmetrica_device_id
+        :return: list of valid tokens (strings) not seen before in the order of passing
+        """
+        pattern = self.patterns.get(id_type)
+        if pattern is None:
+            self.dropped[DropReasons.UNKNOWN_TYPE] += len(values)
+            return []
+
+        stripped = [_token_text(value) for value in values]
+        present = list(filter(None, stripped))
+        unique = list(OrderedDict.fromkeys(present))
+        seen = self._seen.setdefault(id_type, set())
+        if seen:
+            unique = [value for value in unique if value not in seen]
+        valid = list(filter(pattern.match, unique))
+        seen.update(unique)
+
+        self.dropped[DropReasons.EMPTY] += len(stripped) - len(present)
+        self.dropped[DropReasons.DUPLICATE] += len(present) - len(unique)
+        self.dropped[DropReasons.MALFORMED] += len(unique) - len(valid)
+        self.accepted += len(valid)
+        return valid
+
+    def report(self):
+        """
+        :return: dict with number of accepted tokens and numbers of dropped tokens by DropReasons
+        """
+        report = {
+            DropReasons.EMPTY: 0, DropReasons.DUPLICATE: 0, DropReasons.MALFORMED: 0, DropReasons.UNKNOWN_TYPE: 0,
+        }
+        report.update(self.dropped)
+        report['accepted'] = self.accepted
+        return report
+
+    def _filter_groups(self, groups):
+        for group in groups:
+            values = self.filter_values(group['id_type'], group['id_values'])
+            if values:
+                yield {'id_type': group['id_type'], 'id_values': values}
+
+    def _filter_pairs(self, pairs):
+        # pairs are checked and yielded by groups to avoid per token overhead
+        for id_type, group in itertools.groupby(pairs, key=operator.itemgetter(0)):
+            while True:
+                values = list(map(operator.itemgetter(1), itertools.islice(group, self.group_size)))
+                if not values:
+                    break
+                values = self.filter_values(id_type, values)
+                if values:
+                    yield {'id_type': id_type, 'id_values': values}
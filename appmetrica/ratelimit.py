@@ -0,0 +1,107 @@
+# coding: utf-8
+import threading
+import time
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class EndpointFamilies(object):
+    PUSH_MANAGEMENT = 'push_management'
+    PUSH_SEND = 'push_send'
+    PUSH_STATUS = 'push_status'
+    STAT = 'stat'
+    LOGS_EXPORT = 'logs_export'
+
+
+# requests per second, adjust to the quotas of your account
+DEFAULT_LIMITS = {
+    EndpointFamilies.PUSH_MANAGEMENT: 5,
+    EndpointFamilies.PUSH_SEND: 5,
+    EndpointFamilies.PUSH_STATUS: 20,
+    EndpointFamilies.STAT: 10,
+    EndpointFamilies.LOGS_EXPORT: 1,
+}
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket
+    Tokens are reserved in order of calls, so waiting callers are served fairly
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: number of tokens added per second
+        :param capacity: max number of tokens available at once (burst), equals to rate by default
+        """
+        assert rate > 0
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1, max_wait=None):
+        """
+        Take tokens, possibly in advance
+        :param max_wait (optional): do not take tokens if they are available later than in this number of seconds
+        :return: time in seconds to wait before using the tokens or None if it is longer than max_wait
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            delay = max((tokens - self._tokens) / self.rate, 0)
+            if max_wait is not None and delay > max_wait:
+                return None
+            self._tokens -= tokens
+            return delay
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Block until tokens are available
+        :param timeout (optional): max time to wait in seconds
+        :return: False if tokens are not available in timeout, they are not taken then
+        """
+        delay = self.reserve(tokens, max_wait=timeout)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+class RateLimiter(object):
+    """
+    Set of token buckets by endpoint families
+    It is thread-safe and can be shared by several API instances (see `rate_limiter` param of BaseAPI)
+    """
+
+    def __init__(self, limits=None):
+        """
+        :param limits: dict {endpoint family: requests per second or TokenBucket}, DEFAULT_LIMITS by default.
+            Requests of families missing in limits are not limited
+        """
+        limits = DEFAULT_LIMITS if limits is None else limits
+        self.buckets = {
+            family: limit if isinstance(limit, TokenBucket) else TokenBucket(limit)
+            for family, limit in limits.items()
+        }
+
+    def acquire(self, family, timeout=None):
+        """
+        Block until request of the endpoint family is allowed
+        :param timeout (optional): max time to wait in seconds
+        :return: False if the request is not allowed in timeout
+        """
+        bucket = self.buckets.get(family)
+        return bucket.acquire(timeout=timeout) if bucket is not None else True
+
+    def reserve(self, family, max_wait=None):
+        """
+        Take a token of the endpoint family without blocking, e.g. to wait with `asyncio.sleep`
+        :param max_wait (optional): do not take the token if the request is allowed later than in this number of seconds
+        :return: time in seconds to wait before the request or None if it is longer than max_wait
+        """
+        bucket = self.buckets.get(family)
+        return bucket.reserve(max_wait=max_wait) if bucket is not None else 0
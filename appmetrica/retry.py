@@ -0,0 +1,120 @@
+# coding: utf-8
+import random
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+# the request was not processed, so it is safe to repeat any request
+RETRY_ALWAYS_STATUSES = (429, 503)
+# the request may have been processed, only idempotent requests are repeated
+RETRY_IDEMPOTENT_STATUSES = (500, 502, 504)
+
+
+class RetryPolicy(object):
+    """
+    Retries of failed requests with exponential backoff and full jitter
+
+    Connection errors and responses 429, 503 are retried for any request,
+    read errors and responses 500, 502, 504 only for idempotent ones (GET or deduplicated by server)
+    """
+
+    def __init__(self, retries=3, backoff_factor=1, max_backoff=60, deadline=None, respect_retry_after=True):
+        """
+        :param retries: max number of retries
+        :param backoff_factor: base of backoff, delay before retry N is random between 0 and backoff_factor * 2 ** N
+        :param max_backoff: max delay before retry in seconds, the request is not retried
+            if Retry-After of response is longer
+        :param deadline (optional): max total time of the request with all retries in seconds
+        :param respect_retry_after: wait for time from Retry-After header of response if it is provided
+        """
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.respect_retry_after = respect_retry_after
+
+    def deadline_time(self):
+        """
+        :return: time when all attempts must be finished or None
+        """
+        return time.time() + self.deadline if self.deadline is not None else None
+
+    def retry_delay(self, attempt, idempotent, response=None, error=None, deadline_time=None):
+        """
+        :param attempt: number of the failed attempt starting from 0
+        :param idempotent: whether the request can be repeated safely after it is received by server
+        :param response: response of the failed attempt
+        :param error: exception of the failed attempt
+        :param deadline_time: result of `deadline_time`
+        :return: delay before the next attempt in seconds or None if the request must not be repeated
+        """
+        retryable = self._is_retryable(idempotent, response, error)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        return self.delay(attempt, retryable, retry_after=retry_after, deadline_time=deadline_time)
+
+    def delay(self, attempt, retryable, retry_after=None, deadline_time=None):
+        """
+        Delay before the next attempt for any http client, see `retry_delay`
+        :param retryable: whether the failure of the attempt can be retried, see `is_retryable_status`
+        :param retry_after: value of Retry-After header of response
+        """
+        if attempt >= self.retries or not retryable:
+            return None
+
+        delay = random.uniform(0, min(self.backoff_factor * 2 ** attempt, self.max_backoff))
+        if self.respect_retry_after:
+            retry_after = parse_retry_after(retry_after)
+            if retry_after is not None:
+                if retry_after > self.max_backoff:
+                    return None
+                delay = retry_after
+
+        if deadline_time is not None and time.time() + delay >= deadline_time:
+            return None
+        return delay
+
+    @staticmethod
+    def _is_retryable(idempotent, response, error):
+        if error is not None:
+            return is_connect_error(error) or (idempotent and isinstance(error, requests.RequestException))
+        return is_retryable_status(response.status_code, idempotent)
+
+
+def is_retryable_status(status_code, idempotent):
+    """
+    Whether the request which got response with the status can be repeated
+    """
+    if status_code in RETRY_ALWAYS_STATUSES:
+        return True
+    return idempotent and status_code in RETRY_IDEMPOTENT_STATUSES
+
+
+def is_connect_error(error):
+    """
+    Whether the request failed before it was sent to server
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def parse_retry_after(value):
+    """
+    :param value: value of Retry-After header, number of seconds or http date
+    :return: delay in seconds or None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(mktime_tz(date) - time.time(), 0)
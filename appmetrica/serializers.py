@@ -0,0 +1,77 @@
+# coding: utf-8
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def dumps_json(data):
+    """
+    Serialize data to compact JSON with stdlib encoder
+    :return: bytes
+    """
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_orjson(data):
+    """
+    Serialize data with orjson, data which orjson does not support (non-str keys of dicts, namedtuples,
+    integers out of 64-bit range) is serialized with stdlib encoder. Unlike stdlib encoder NaN is written as null
+    :return: bytes
+    """
+    try:
+        return orjson.dumps(data)
+    except TypeError:
+        return dumps_json(data)
+
+
+def dumps_ujson(data):
+    """
+    Serialize data with ujson, falls back to stdlib encoder if ujson can not serialize the data
+    :return: bytes
+    """
+    try:
+        return ujson.dumps(data, escape_forward_slashes=False).encode('utf-8')
+    except (TypeError, OverflowError):
+        return dumps_json(data)
+
+
+SERIALIZERS = {
+    'json': dumps_json,
+    'orjson': dumps_orjson if orjson is not None else None,
+    'ujson': dumps_ujson if ujson is not None else None,
+}
+
+
+def get_serializer(name='json'):
+    """
+    :param name: json (stdlib), orjson, ujson or fast (the fastest installed one)
+    :return: function which serializes data to JSON bytes
+    """
+    if name == 'fast':
+        return SERIALIZERS['orjson'] or SERIALIZERS['ujson'] or SERIALIZERS['json']
+    serializer = SERIALIZERS.get(name)
+    if serializer is None:
+        raise ValueError('serializer %s is not available' % name)
+    return serializer
+
+
+def gzip_compress(body, level=6):
+    """
+    :param body: bytes
+    :return: gzip compressed bytes
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+# fast serializers are opt-in: they differ from stdlib json in edge cases like NaN
+default_serializer = dumps_json
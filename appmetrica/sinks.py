@@ -0,0 +1,269 @@
+# coding: utf-8
+import gzip
+import io
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+SINK_FORMATS = ('parquet', 'arrow', 'ndjson')
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def field_type(name):
+    """
+    Type of the export field by its name: int for timestamps, bool for flags, string for others
+    """
+    if name.endswith('_timestamp'):
+        return 'int'
+    if name.startswith('is_'):
+        return 'bool'
+    return 'string'
+
+
+def _to_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+def _to_float(value):
+    return float(value) if value not in (None, '') else None
+
+
+def _to_bool(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, (type(''), type(u''))):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _to_string(value):
+    return value if value is None or isinstance(value, type(u'')) else u'{}'.format(value)
+
+
+CONVERTERS = {
+    'int': _to_int,
+    'float': _to_float,
+    'bool': _to_bool,
+    'string': _to_string,
+}
+
+
+class BaseSink(object):
+    """
+    Writer of records to file by chunks, so memory usage is bounded by chunk size
+    Records are dicts or sequences of values in order of fields
+    If the block of `with` raises, the partial file is removed, so the file exists only if all records are written
+
+    Usage:
+        with open_sink('installations.parquet', fields) as sink:
+            sink.write_many(records)
+    """
+
+    def __init__(self, path, fields, field_types=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        :param path: path to file
+        :param fields: list of fields, columns of the file
+        :param field_types (optional): dict {field: int, float, bool or string}, see `field_type` for defaults
+        :param chunk_size: number of records buffered before writing, size of row group of Parquet file
+        """
+        self.path = path
+        self.fields = list(fields)
+        field_types = field_types or {}
+        self.field_types = [field_types.get(field) or field_type(field) for field in self.fields]
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._columns = [[] for _ in self.fields]
+        self._buffered = 0
+
+    def write(self, record):
+        if isinstance(record, dict):
+            record = [record.get(field) for field in self.fields]
+        for column, value in zip(self._columns, record):
+            column.append(value)
+        self._buffered += 1
+        self.count += 1
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def write_many(self, records):
+        """
+        :return: number of written records
+        """
+        written = self.count
+        for record in records:
+            self.write(record)
+        return self.count - written
+
+    def flush(self):
+        if self._buffered:
+            columns = [
+                [CONVERTERS[type_name](value) for value in column]
+                for type_name, column in zip(self.field_types, self._columns)
+            ]
+            self._write_chunk(columns)
+        self._columns = [[] for _ in self.fields]
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def abort(self):
+        """
+        Close the file without writing buffered records and remove it
+        """
+        self._columns = [[] for _ in self.fields]
+        self._buffered = 0
+        try:
+            self._close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _write_chunk(self, columns):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+class NDJSONSink(BaseSink):
+    """
+    Gzip compressed newline-delimited JSON, does not require pyarrow
+    """
+
+    def __init__(self, path, fields, field_types=None, chunk_size=DEFAULT_CHUNK_SIZE, compresslevel=6):
+        super(NDJSONSink, self).__init__(path, fields, field_types, chunk_size)
+        self._file = io.TextIOWrapper(gzip.open(path, 'wb', compresslevel=compresslevel), encoding='utf-8')
+
+    def _write_chunk(self, columns):
+        lines = (json.dumps(dict(zip(self.fields, values)), ensure_ascii=False) for values in zip(*columns))
+        self._file.write(u'\n'.join(lines) + u'\n')
+
+    def _close(self):
+        self._file.close()
+
+
+class _ArrowSink(BaseSink):
+    arrow_types = {
+        'int': 'int64',
+        'float': 'float64',
+        'bool': 'bool_',
+        'string': 'string',
+    }
+
+    def __init__(self, path, fields, field_types=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for {} sink, install appmetrica[arrow]'.format(self.format))
+        super(_ArrowSink, self).__init__(path, fields, field_types, chunk_size)
+        self.schema = pyarrow.schema([
+            (field, getattr(pyarrow, self.arrow_types[type_name])())
+            for field, type_name in zip(self.fields, self.field_types)
+        ])
+        self._writer = self._open_writer()
+
+    def _write_chunk(self, columns):
+        arrays = [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def _close(self):
+        self._writer.close()
+
+
+class ParquetSink(_ArrowSink):
+    """
+    Parquet file, every chunk is a row group
+    """
+    format = 'parquet'
+
+    def __init__(self, path, fields, field_types=None, chunk_size=DEFAULT_CHUNK_SIZE, compression='snappy'):
+        self.compression = compression
+        super(ParquetSink, self).__init__(path, fields, field_types, chunk_size)
+
+    def _open_writer(self):
+        return pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+
+
+class ArrowSink(_ArrowSink):
+    """
+    Arrow IPC (Feather v2) file, every chunk is a record batch
+    """
+    format = 'arrow'
+
+    def _open_writer(self):
+        return pyarrow.ipc.new_file(self.path, self.schema)
+
+
+SINKS = {
+    'parquet': ParquetSink,
+    'arrow': ArrowSink,
+    'ndjson': NDJSONSink,
+}
+
+
+def sink_format(path, format=None):
+    """
+    :param format: parquet, arrow, ndjson or auto (parquet if pyarrow is installed, otherwise ndjson),
+        by extension of path by default (.parquet, .arrow or .feather, otherwise ndjson)
+    """
+    if format == 'auto':
+        return 'parquet' if pyarrow is not None else 'ndjson'
+    if format is not None:
+        assert format in SINK_FORMATS
+        return format
+    if path.endswith('.parquet'):
+        return 'parquet'
+    if path.endswith(('.arrow', '.feather')):
+        return 'arrow'
+    return 'ndjson'
+
+
+def open_sink(path, fields, format=None, **kwargs):
+    """
+    :param path: path to file
+    :param fields: list of fields
+    :param format: see `sink_format`
+    :param kwargs: params of sink, see `BaseSink`
+    :return: sink
+    """
+    return SINKS[sink_format(path, format)](path, fields, **kwargs)
+
+
+def read_records(path, format=None, batch_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read records written by sink
+    :param format: see `sink_format`, `auto` is resolved like for writing
+    :return: generator of dicts
+    """
+    format = sink_format(path, format)
+    if format == 'ndjson':
+        with io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8') as records_file:
+            for line in records_file:
+                yield json.loads(line)
+        return
+
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to read {} file, install appmetrica[arrow]'.format(format))
+    if format == 'parquet':
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_size)
+    else:
+        reader = pyarrow.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for batch in batches:
+        for record in batch.to_pylist():
+            yield record
@@ -0,0 +1,24 @@
+# coding: utf-8
+import logging
+
+from appmetrica.aiobase import AsyncBaseAPI
+from appmetrica.exceptions import AppMetricaException
+from appmetrica.stat.api import StatAPI
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncStatAPI(AsyncBaseAPI):
+    """
+    Asyncio version of StatAPI, see its methods for details
+    """
+    base_url = StatAPI.base_url
+    rate_limit_family = StatAPI.rate_limit_family
+
+    async def export_stat(self, params):
+        try:
+            response_data = await self._request('get', endpoint='data', params=params)
+        except AppMetricaException as exc:  # pragma: no cover
+            logger.error('failed to export stat due to %s', exc, exc_info=True)
+            raise exc
+        return response_data['data']
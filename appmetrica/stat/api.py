@@ -1,28 +1,41 @@
 # coding: utf-8
 import logging
+from collections import deque
+from concurrent import futures
 
 from appmetrica.exceptions import AppMetricaException
 
 from appmetrica.base import BaseAPI
+from appmetrica.ratelimit import EndpointFamilies
+from appmetrica.sinks import open_sink
+from appmetrica.stat.cache import cache_key, cache_ttl
+from appmetrica.stat.report import StatReport
 
 logger = logging.getLogger(__name__)
 
 
 class StatAPI(BaseAPI):
     base_url = 'https://api.appmetrica.yandex.ru/stat/v1/'
+    rate_limit_family = EndpointFamilies.STAT
 
-    def export_stat(self, params):
+    def __init__(self, *args, **kwargs):
+        """
+        See BaseAPI for params
+        :param cache (optional): cache of responses, MemoryCache or DiskCache from `appmetrica.stat.cache`
+        """
+        self.cache = kwargs.pop('cache', None)
+        super(StatAPI, self).__init__(*args, **kwargs)
+
+    def export_stat(self, params, columnar=False):
         """
         Download stat reports https://appmetrica.yandex.ru/docs/mobile-api/api_v1/data.html
 
         :param params: dict with query params
-        :return: dict with stat data
+        :param columnar: return StatReport with metrics as 2-D numpy array, dimensions as arrays,
+            totals, min, max and sampling metadata (requires numpy)
+        :return: list of dicts with stat data or StatReport
         """
-        try:
-            response_data = self._request('get', endpoint='data', params=params)
-        except AppMetricaException as exc:  # pragma: no cover
-            logger.error('failed to export stat due to %s', exc, exc_info=True)
-            raise exc
+        response_data = self._fetch_stat(params)
 
         # response_data contains dict like:
         # {
@@ -54,4 +67,93 @@ class StatAPI(BaseAPI):
         #         "metrics" : [ <double>, ... ]
         #     }, ... ]
         # }
+        if columnar:
+            return StatReport.from_response(response_data)
         return response_data['data']
+
+    def iter_stat(self, params, page_size=10000, prefetch=2):
+        """
+        Download all rows of stat report page by page using limit and offset params
+        Next pages are downloaded concurrently while the current one is being consumed
+
+        :param params: dict with query params, `offset` (1-based) is the first row to download
+        :param page_size: number of rows of the page (limit param)
+        :param prefetch: number of pages downloaded in advance
+        :return: generator of dicts with stat data like `export_stat`
+        """
+        first_offset = int(params.get('offset', 1))
+        first_page = self._fetch_stat(dict(params, limit=page_size, offset=first_offset))
+        for row in first_page['data']:
+            yield row
+
+        last_offset = first_page['total_rows']  # offsets are 1-based
+        offsets = iter(range(first_offset + page_size, last_offset + 1, page_size))
+        pending = deque()
+        with futures.ThreadPoolExecutor(max_workers=max(prefetch, 1)) as executor:
+            try:
+                while True:
+                    for offset in offsets:
+                        pending.append(executor.submit(self._fetch_stat, dict(params, limit=page_size, offset=offset)))
+                        if len(pending) > prefetch:
+                            break
+                    if not pending:
+                        break
+                    page = pending.popleft().result()
+                    if not page['data']:
+                        break
+                    for row in page['data']:
+                        yield row
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def save_stat(self, path, params, page_size=10000, prefetch=2, file_format=None, chunk_size=None):
+        """
+        Download all rows of stat report into Parquet, Arrow IPC or gzipped NDJSON file, see `appmetrica.sinks`
+        Every dimension is saved as two string columns: name and id (`<dimension>.id`), metrics as float columns
+
+        :param path: path to file
+        :param params: dict with query params, `dimensions` and `metrics` define columns of the file
+        :param page_size: see `iter_stat`
+        :param prefetch: see `iter_stat`
+        :param file_format (optional): parquet, arrow, ndjson or auto, by extension of path by default
+        :param chunk_size (optional): number of rows written at once, size of row group of Parquet file
+        :return: number of saved rows
+        """
+        dimensions = self._param_list(params.get('dimensions'))
+        metrics = self._param_list(params.get('metrics'))
+        fields = dimensions + ['{}.id'.format(dimension) for dimension in dimensions] + metrics
+        field_types = dict({field: 'string' for field in fields}, **{metric: 'float' for metric in metrics})
+        sink_options = {'chunk_size': chunk_size} if chunk_size else {}
+
+        records = (
+            [(value or {}).get(key) for key in ('name', 'id') for value in row['dimensions']] + row['metrics']
+            for row in self.iter_stat(params, page_size=page_size, prefetch=prefetch)
+        )
+        with open_sink(path, fields, format=file_format, field_types=field_types, **sink_options) as sink:
+            return sink.write_many(records)
+
+    @staticmethod
+    def _param_list(value):
+        if not value:
+            return []
+        if isinstance(value, (list, tuple)):
+            return list(value)
+        return [item.strip() for item in str(value).split(',')]
+
+    def _fetch_stat(self, params):
+        if self.cache is not None:
+            key = cache_key(self.app_id, params)
+            response_data = self.cache.get(key)
+            if response_data is not None:
+                return response_data
+
+        try:
+            response_data = self._request('get', endpoint='data', params=params)
+        except AppMetricaException as exc:  # pragma: no cover
+            logger.error('failed to export stat due to %s', exc, exc_info=True)
+            raise exc
+
+        if self.cache is not None:
+            self.cache.set(key, response_data, ttl=cache_ttl(params, response_data))
+        return response_data
@@ -0,0 +1,128 @@
+# coding: utf-8
+import copy
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from appmetrica.utils import write_json_atomic
+
+DATE_FORMAT = '%Y-%m-%d'
+ABSOLUTE_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def cache_key(app_id, params):
+    """
+    Make key of the stat query which does not depend on order of params and form of lists
+    :param app_id: application identifier
+    :param params: dict with query params
+    :return: str
+    """
+    normalized = {}
+    for key, value in params.items():
+        if isinstance(value, (list, tuple)):
+            value = ','.join(str(item) for item in value)
+        normalized[key] = str(value).strip()
+    data = json.dumps([app_id, normalized], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def cache_ttl(params, response_data, min_ttl=60, max_ttl=3600, now=None):
+    """
+    Time to live of the stat response in cache
+    Reports of absolute dates in the past are not changed anymore and cached forever,
+    other reports are cached for `data_lag` seconds limited by `min_ttl` and `max_ttl`
+    :param params: dict with query params
+    :param response_data: dict with stat data
+    :return: ttl in seconds or None to cache forever
+    """
+    data_lag = response_data.get('data_lag') or 0
+    now = now or datetime.datetime.now()
+    date2 = str(params.get('date2') or (response_data.get('query') or {}).get('date2') or '')
+    # relative dates like yesterday or 7daysAgo point to other days tomorrow
+    if ABSOLUTE_DATE.match(date2):
+        last_date = datetime.datetime.strptime(date2, DATE_FORMAT).date()
+        if last_date < (now - datetime.timedelta(seconds=data_lag)).date():
+            return None
+    return min(max(data_lag, min_ttl), max_ttl)
+
+
+class MemoryCache(object):
+    """
+    Thread-safe in-memory LRU cache with ttl
+    Values are copied on set and get, so callers can modify them without changing the cache
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires <= time.time():
+                return None
+            self._data[key] = item
+        return copy.deepcopy(value)
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class DiskCache(object):
+    """
+    LRU cache with ttl which keeps every value in JSON file of the directory
+    Time of last access is stored as modification time of the file
+    """
+
+    def __init__(self, directory, maxsize=1000):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, key):
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path) as cache_file:
+                    item = json.load(cache_file)
+            except (IOError, OSError, ValueError):
+                return None
+            if item['expires'] is not None and item['expires'] <= time.time():
+                os.remove(path)
+                return None
+            os.utime(path, None)
+            return item['value']
+
+    def set(self, key, value, ttl=None):
+        item = {'expires': time.time() + ttl if ttl is not None else None, 'value': value}
+        with self._lock:
+            write_json_atomic(self._path(key), item)
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _evict(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')]
+        if len(paths) <= self.maxsize:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.maxsize]:
+            os.remove(path)
@@ -0,0 +1,73 @@
+# coding: utf-8
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+SAMPLING_FIELDS = ('total_rows', 'sampled', 'sample_share', 'sample_size', 'sample_space', 'data_lag')
+
+
+class StatReport(object):
+    """
+    Stat report in columnar form
+    Attributes:
+        metrics - 2-D float array (rows x metrics), null values are nan
+        metric_names - list of metrics in order of columns
+        dimensions - dict {dimension: array of names of dimension values}
+        dimension_ids - dict {dimension: array of ids of dimension values}
+        totals, min, max - float arrays of aggregates of metrics of the whole report
+        query - query of the report
+        total_rows, sampled, sample_share, sample_size, sample_space, data_lag - metadata of the report
+    """
+
+    def __init__(self, metrics, metric_names, dimensions, dimension_ids, totals, min, max, query, **metadata):
+        self.metrics = metrics
+        self.metric_names = metric_names
+        self.dimensions = dimensions
+        self.dimension_ids = dimension_ids
+        self.totals = totals
+        self.min = min
+        self.max = max
+        self.query = query
+        for field in SAMPLING_FIELDS:
+            setattr(self, field, metadata.get(field))
+
+    def __len__(self):
+        return len(self.metrics)
+
+    @classmethod
+    def from_response(cls, response_data):
+        """
+        :param response_data: dict with stat data, see `StatAPI.export_stat`
+        :return: StatReport
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for columnar stat report, install appmetrica[numpy]')
+
+        query = response_data.get('query') or {}
+        metric_names = list(query.get('metrics') or [])
+        dimension_names = list(query.get('dimensions') or [])
+        rows = response_data.get('data') or []
+
+        metrics = numpy.array([row['metrics'] for row in rows], dtype=float)
+        if not rows:
+            metrics = metrics.reshape(0, len(metric_names))
+
+        dimensions = {}
+        dimension_ids = {}
+        for i, name in enumerate(dimension_names):
+            values = [row['dimensions'][i] or {} for row in rows]
+            dimensions[name] = numpy.array([value.get('name') for value in values], dtype=object)
+            dimension_ids[name] = numpy.array([value.get('id') for value in values], dtype=object)
+
+        return cls(
+            metrics=metrics,
+            metric_names=metric_names,
+            dimensions=dimensions,
+            dimension_ids=dimension_ids,
+            totals=numpy.array(response_data.get('totals') or [], dtype=float),
+            min=numpy.array(response_data.get('min') or [], dtype=float),
+            max=numpy.array(response_data.get('max') or [], dtype=float),
+            query=query,
+            **{field: response_data.get(field) for field in SAMPLING_FIELDS}
+        )
@@ -1,2 +1,93 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+
+
 def format_appmetrica_date(dt):
     return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def write_json_atomic(path, data):
+    """
+    Write data to JSON file so that readers never see partially written file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(data, tmp_file)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+LOG_CONTENT_LIMIT = 1024
+
+
+def redact_headers(headers):
+    """
+    :return: copy of headers without secrets to be logged
+    """
+    return {key: '<redacted>' if key.lower() == 'authorization' else value for key, value in headers.items()}
+
+
+def truncate(content, limit=LOG_CONTENT_LIMIT):
+    """
+    Cut long response content or text to be logged
+    """
+    if content is None or len(content) <= limit:
+        return content
+    return content[:limit] + (b'...' if isinstance(content, bytes) else u'...')
+
+
+def payload_summary(body, description=None, dump_dir=None):
+    """
+    Describe request body for logging without formatting the body itself
+    :param body: serialized request body, bytes
+    :param description (optional): dict with details of payload, e.g. number of devices
+    :param dump_dir (optional): directory to write the whole body to, file is named by its digest
+    :return: dict with size, sha1 digest, details and path of dump
+    """
+    summary = {'bytes': len(body), 'sha1': hashlib.sha1(body).hexdigest()}
+    summary.update(description or {})
+    if dump_dir is not None:
+        path = os.path.join(dump_dir, '{digest}.json'.format(digest=summary['sha1']))
+        try:
+            with io.open(path, 'wb') as dump_file:
+                dump_file.write(body)
+        except (IOError, OSError) as exc:
+            summary['dump_error'] = str(exc)
+        else:
+            summary['dump'] = path
+    return summary
+
+
+class Backoff(object):
+    """
+    Exponentially growing intervals between attempts limited by total timeout
+    """
+
+    def __init__(self, interval=10, factor=2, max_interval=300, timeout=None):
+        """
+        :param interval: first interval in seconds
+        :param factor: multiplier of every next interval
+        :param max_interval: max interval in seconds
+        :param timeout (optional): max total time of all attempts in seconds
+        """
+        self.interval = interval
+        self.factor = factor
+        self.max_interval = max_interval
+        self.timeout = timeout
+
+    def intervals(self):
+        """
+        :return: generator of intervals, stops when the next interval exceeds the timeout
+        """
+        deadline = time.time() + self.timeout if self.timeout is not None else None
+        interval = self.interval
+        while deadline is None or time.time() + interval <= deadline:
+            yield interval
+            interval = min(interval * self.factor, self.max_interval)
@@ -0,0 +1,114 @@
+# coding: utf-8
+"""
+Compare memory usage and throughput of parsing JSON and CSV exports
+
+Usage:
+    python benchmarks/export_formats.py [--rows 1000000] [--chunk-size 65536]
+
+Synthetic installations export is written to temporary files and read chunk by chunk,
+so only memory allocated by parser is measured. Throughput and memory are measured in separate passes
+because tracemalloc slows down parsing.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from appmetrica.export.parsers import iter_csv_rows, iter_json_array, make_record_type
+
+FIELDS = ['appmetrica_device_id', 'ios_ifv', 'os_name', 'install_receive_timestamp']
+
+
+def synthetic_rows(rows):
+    for i in range(rows):
+        yield ('%019d' % i, '8677D879-AC64-47D3-A6FD-%012X' % i, 'ios' if i % 2 else 'android', 1600000000 + i)
+
+
+def chunked(parts, chunk_size):
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def json_chunks(rows, chunk_size):
+    def parts():
+        yield b'{"data":['
+        for i, row in enumerate(synthetic_rows(rows)):
+            item = json.dumps(dict(zip(FIELDS, row)), separators=(',', ':')).encode('utf-8')
+            yield b',' + item if i else item
+        yield b']}'
+    return chunked(parts(), chunk_size)
+
+
+def csv_chunks(rows, chunk_size):
+    def parts():
+        yield (','.join(FIELDS) + '\n').encode('utf-8')
+        for row in synthetic_rows(rows):
+            yield (','.join(str(value) for value in row) + '\n').encode('utf-8')
+    return chunked(parts(), chunk_size)
+
+
+def write_fixture(path, chunks):
+    with open(path, 'wb') as fixture:
+        for chunk in chunks:
+            fixture.write(chunk)
+
+
+def read_chunks(path, chunk_size):
+    with open(path, 'rb') as fixture:
+        while True:
+            chunk = fixture.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def measure(name, path, chunk_size, parse):
+    started = time.time()
+    count = sum(1 for _ in parse(read_chunks(path, chunk_size)))
+    elapsed = time.time() - started
+
+    tracemalloc.start()
+    for _ in parse(read_chunks(path, chunk_size)):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('{name:<12} rows={count} bytes={size} time={elapsed:.2f}s rows/s={speed:.0f} peak={peak:.1f}KiB'.format(
+        name=name, count=count, size=os.path.getsize(path), elapsed=elapsed, speed=count / elapsed,
+        peak=peak / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(directory, 'installations.json')
+        csv_path = os.path.join(directory, 'installations.csv')
+        write_fixture(json_path, json_chunks(args.rows, args.chunk_size))
+        write_fixture(csv_path, csv_chunks(args.rows, args.chunk_size))
+
+        record_type = make_record_type(FIELDS)
+        measure('json', json_path, args.chunk_size, iter_json_array)
+        measure('csv', csv_path, args.chunk_size, iter_csv_rows)
+        measure('csv-record', csv_path, args.chunk_size, lambda chunks: iter_csv_rows(chunks, record_type=record_type))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
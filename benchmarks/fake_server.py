@@ -0,0 +1,254 @@
+# coding: utf-8
+"""
+Local fake AppMetrica server for load tests
+
+Usage:
+    python benchmarks/fake_server.py [--port 8000] [--latency 0.01] [--throttle 100] [--failure-rate 0.01]
+
+Serves push API at /push/v1/, logs export at /logs/v1/export/ and stat at /stat/v1/ with synthetic data.
+Export responds 202 to the first `--prepare-polls` requests of every query and then streams `--export-rows` rows.
+Requests above `--throttle` per second get 429 with Retry-After, `--failure-rate` of requests get 503.
+The port of started server is printed to stdout.
+"""
+import argparse
+import gzip
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Throttle(object):
+    """
+    Fixed window limit of requests per second
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._window = int(time.time())
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """
+        :return: None if request is allowed, otherwise seconds until the next window
+        """
+        with self._lock:
+            now = time.time()
+            if int(now) != self._window:
+                self._window, self._count = int(now), 0
+            self._count += 1
+            if self._count <= self.rate:
+                return None
+            return self._window + 1 - now
+
+
+class FakeAppMetricaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0, throttle=None, failure_rate=0, prepare_polls=1,
+                 export_rows=100000, stat_rows=100000, seed=0):
+        ThreadingHTTPServer.__init__(self, address, FakeAppMetricaHandler)
+        self.latency = latency
+        self.throttle = Throttle(throttle) if throttle else None
+        self.failure_rate = failure_rate
+        self.prepare_polls = prepare_polls
+        self.export_rows = export_rows
+        self.stat_rows = stat_rows
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.groups = []
+        self.transfer_ids = itertools.count(1)
+        self.client_transfers = {}
+        self.export_polls = {}
+
+    @property
+    def url(self):
+        return 'http://{host}:{port}'.format(host=self.server_address[0], port=self.server_address[1])
+
+
+class FakeAppMetricaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent in one segment, otherwise delayed ACK adds 40ms to every response
+    wbufsize = STREAM_CHUNK_SIZE
+    disable_nagle_algorithm = True
+
+    routes = [
+        ('GET', re.compile(r'/push/v1/management/groups$'), 'get_groups'),
+        ('POST', re.compile(r'/push/v1/management/groups$'), 'create_group'),
+        ('POST', re.compile(r'/push/v1/send-batch$'), 'send_batch'),
+        ('GET', re.compile(r'/push/v1/status/(?P<transfer_id>\d+)$'), 'status'),
+        ('GET', re.compile(r'/logs/v1/export/(?P<resource>\w+)\.(?P<format>json|csv)$'), 'export'),
+        ('GET', re.compile(r'/stat/v1/data$'), 'stat'),
+    ]
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+    def dispatch(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self.read_body()
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttle is not None:
+            retry_after = server.throttle.retry_after()
+            if retry_after is not None:
+                return self.send_json(429, {'message': 'too many requests'},
+                                      headers={'Retry-After': '%.3f' % retry_after})
+        with server.lock:
+            failed = server.random.random() < server.failure_rate
+        if failed:
+            return self.send_json(503, {'message': 'injected failure'})
+
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                return getattr(self, handler)(body, **match.groupdict())
+        self.send_json(404, {'message': 'not found'})
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def send_json(self, status, data, headers=None):
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def get_groups(self, body):
+        with self.server.lock:
+            groups = list(self.server.groups)
+        self.send_json(200, {'groups': groups})
+
+    def create_group(self, body):
+        with self.server.lock:
+            group = dict(body['group'], id=len(self.server.groups) + 1)
+            self.server.groups.append(group)
+        self.send_json(200, {'group': group})
+
+    def send_batch(self, body):
+        request = body['push_batch_request']
+        client_transfer_id = request.get('client_transfer_id')
+        with self.server.lock:
+            transfer_id = self.server.client_transfers.get(client_transfer_id)
+            if transfer_id is None:
+                transfer_id = next(self.server.transfer_ids)
+                if client_transfer_id is not None:
+                    self.server.client_transfers[client_transfer_id] = transfer_id
+        self.send_json(200, {'push_response': {'transfer_id': transfer_id}})
+
+    def status(self, body, transfer_id):
+        self.send_json(200, {'transfer': {'id': int(transfer_id), 'status': 'sent', 'errors': []}})
+
+    def export(self, body, resource, format):
+        with self.server.lock:
+            polls = self.server.export_polls.get(self.path, 0)
+            self.server.export_polls[self.path] = polls + 1
+        if polls < self.server.prepare_polls:
+            return self.send_json(202, {'message': 'query is added to the queue'})
+
+        fields = self.query.get('fields', 'appmetrica_device_id').split(',')
+        rows = self.server.export_rows
+        if format == 'csv':
+            parts = itertools.chain(
+                [(','.join(fields) + '\n').encode('utf-8')],
+                ((','.join('%s_%d' % (field, i) for field in fields) + '\n').encode('utf-8') for i in range(rows)),
+            )
+        else:
+            parts = itertools.chain(
+                [b'{"data":['],
+                ((b',' if i else b'') + json.dumps({field: '%s_%d' % (field, i) for field in fields}).encode('utf-8')
+                 for i in range(rows)),
+                [b']}'],
+            )
+        self.send_chunked(200, parts, 'text/csv' if format == 'csv' else 'application/json')
+
+    def send_chunked(self, status, parts, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        buffer, size = [], 0
+        for part in parts:
+            buffer.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                self.write_chunk(b''.join(buffer))
+                buffer, size = [], 0
+        if buffer:
+            self.write_chunk(b''.join(buffer))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, chunk):
+        self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii') + chunk + b'\r\n')
+
+    def stat(self, body):
+        offset = int(self.query.get('offset', 1))
+        limit = int(self.query.get('limit', 100))
+        total_rows = self.server.stat_rows
+        data = [
+            {'dimensions': [{'name': 'dimension_%d' % i}], 'metrics': [float(i)]}
+            for i in range(offset, min(offset + limit, total_rows + 1))
+        ]
+        self.send_json(200, {
+            'total_rows': total_rows, 'sampled': False, 'sample_share': 1, 'data_lag': 0,
+            'query': {'offset': offset, 'limit': limit, 'metrics': ['ym:ts:users']},
+            'totals': [0.0], 'min': [0.0], 'max': [0.0], 'data': data,
+        })
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0, help='delay of every response in seconds')
+    parser.add_argument('--throttle', type=int, default=None, help='max requests per second')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of 503 responses')
+    parser.add_argument('--prepare-polls', type=int, default=1, help='number of 202 responses to export query')
+    parser.add_argument('--export-rows', type=int, default=100000)
+    parser.add_argument('--stat-rows', type=int, default=100000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeAppMetricaServer((args.host, args.port), latency=args.latency, throttle=args.throttle,
+                                  failure_rate=args.failure_rate, prepare_polls=args.prepare_polls,
+                                  export_rows=args.export_rows, stat_rows=args.stat_rows)
+    print(server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# coding: utf-8
+"""
+Load test of PushAPI, ExportAPI and StatAPI against local fake AppMetrica server
+
+Usage:
+    python benchmarks/load_test.py [--scenarios push_send,push_status,export,stat] [--workers 8] [--latency 0.01]
+
+The fake server (see benchmarks/fake_server.py) runs in a separate process, every scenario runs in its own
+process too, so peak RSS of the client is measured for every scenario separately.
+Latency is measured per API request with request hooks and includes retries, 202 responses of export
+are counted as errors.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from appmetrica.export.api import ExportAPI
+from appmetrica.metrics import RequestHooks
+from appmetrica.push.api import PushAPI, TokenTypes
+from appmetrica.retry import RetryPolicy
+from appmetrica.stat.api import StatAPI
+from appmetrica.utils import Backoff
+
+from fake_server import add_server_arguments
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_server.py')
+SERVER_OPTIONS = ('latency', 'throttle', 'failure_rate', 'prepare_polls', 'export_rows', 'stat_rows')
+
+
+class LatencyRecorder(RequestHooks):
+
+    def __init__(self):
+        self.latencies = []
+        self.retries = 0
+        self.errors = 0
+
+    def on_request_end(self, event):
+        self.latencies.append(event.elapsed)
+        self.retries += event.retries
+        self.errors += event.error is not None
+
+
+def api_kwargs(args, hooks, path):
+    return {
+        'app_id': 1,
+        'access_token': 'token',
+        'base_url': args.url + path,
+        'pool_size': args.workers,
+        'hooks': hooks,
+        'retry_policy': RetryPolicy(retries=args.retries, backoff_factor=args.backoff_factor),
+    }
+
+
+def run_push_send(args, hooks):
+    tokens = ((TokenTypes.IOS_PUSH_TOKEN, '%064X' % i) for i in range(args.devices))
+    with PushAPI(**api_kwargs(args, hooks, '/push/v1/')) as api:
+        message = api.build_ios_message(title='Title', text='Text', extra_data={'book_id': 42})
+        results = api.send_bulk(1, tokens, ios_message=message, tag='load-test', max_workers=args.workers)
+    return {'items': args.devices, 'batches': len(results)}
+
+
+def run_push_status(args, hooks):
+    with PushAPI(**api_kwargs(args, hooks, '/push/v1/')) as api:
+        statuses = api.wait_for_transfers(range(1, args.transfers + 1), poll_interval=0, max_workers=args.workers)
+    return {'items': len(statuses)}
+
+
+def run_export(args, hooks):
+    with ExportAPI(**api_kwargs(args, hooks, '/logs/v1/export/')) as api:
+        rows = api.iter_installations('appmetrica_device_id', 'ios_ifv', 'os_name',
+                                      date_from=datetime.datetime(2020, 1, 1), date_till=datetime.datetime(2020, 2, 1),
+                                      wait=Backoff(interval=0.01, timeout=60))
+        return {'items': sum(1 for _ in rows)}
+
+
+def run_stat(args, hooks):
+    with StatAPI(**api_kwargs(args, hooks, '/stat/v1/')) as api:
+        rows = api.iter_stat({'ids': 1, 'metrics': 'ym:ts:users'}, page_size=args.page_size, prefetch=args.workers)
+        return {'items': sum(1 for _ in rows)}
+
+
+SCENARIOS = {
+    'push_send': run_push_send,
+    'push_status': run_push_status,
+    'export': run_export,
+    'stat': run_stat,
+}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def run_scenario(args):
+    recorder = LatencyRecorder()
+    started = time.time()
+    result = SCENARIOS[args.scenario](args, [recorder])
+    elapsed = time.time() - started
+    result.update({
+        'scenario': args.scenario,
+        'requests': len(recorder.latencies),
+        'retries': recorder.retries,
+        'errors': recorder.errors,
+        'elapsed': elapsed,
+        'rps': len(recorder.latencies) / elapsed,
+        'p50': percentile(recorder.latencies, 0.5),
+        'p99': percentile(recorder.latencies, 0.99),
+        # kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    })
+    print(json.dumps(result))
+
+
+def start_server(args):
+    command = [sys.executable, SERVER_SCRIPT]
+    for option in SERVER_OPTIONS:
+        value = getattr(args, option)
+        if value is not None:
+            command.extend(['--' + option.replace('_', '-'), str(value)])
+    server = subprocess.Popen(command, stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+    return server, 'http://127.0.0.1:{port}'.format(port=port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(sorted(SCENARIOS)))
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--devices', type=int, default=1000000, help='number of devices of push_send')
+    parser.add_argument('--transfers', type=int, default=2000, help='number of transfers of push_status')
+    parser.add_argument('--page-size', type=int, default=10000, help='page size of stat')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff-factor', type=float, default=0.1)
+    parser.add_argument('--log-level', default='CRITICAL', help='log level of clients, retries are logged as WARNING')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.scenario:
+        logging.basicConfig(level=args.log_level)
+        return run_scenario(args)
+
+    server, url = start_server(args)
+    try:
+        print('{:<12} {:>9} {:>9} {:>8} {:>8} {:>9} {:>9} {:>9} {:>10}'.format(
+            'scenario', 'items', 'requests', 'retries', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'rss MB'))
+        for scenario in args.scenarios.split(','):
+            command = [sys.executable, __file__, '--scenario', scenario, '--url', url]
+            output = subprocess.check_output(command + sys.argv[1:])
+            result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            result.update(p50=result['p50'] * 1000, p99=result['p99'] * 1000)
+            print('{scenario:<12} {items:>9} {requests:>9} {retries:>8} {errors:>8} {rps:>9.1f} {p50:>9.1f} '
+                  '{p99:>9.1f} {peak_rss_mb:>10.1f}'.format(**result))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
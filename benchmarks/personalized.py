@@ -0,0 +1,48 @@
+# coding: utf-8
+"""
+Measure rendering, grouping and packing of personalized push messages
+
+Usage:
+    python benchmarks/personalized.py [--devices 2000000] [--texts 3000]
+
+Every device gets a template with its name and one of `texts` distinct books, so rendered messages
+are shared by many devices and the template is rendered once per distinct message.
+"""
+import argparse
+import random
+import time
+
+from appmetrica.push.api import MAX_NUMBER_IN_BATCH, MAX_NUMBER_OF_GROUPS, PushAPI, TokenTypes
+from appmetrica.push.personalized import MessageTemplate, PersonalizedBatches
+
+
+def synthetic_devices(devices, texts):
+    rnd = random.Random(0)
+    for i in range(devices):
+        yield TokenTypes.IOS_PUSH_TOKEN, '%064X' % i, {'book': 'Book %d' % rnd.randrange(texts), 'user_id': i}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=2000000)
+    parser.add_argument('--texts', type=int, default=3000)
+    args = parser.parse_args()
+
+    template = MessageTemplate(ios_message=PushAPI.build_ios_message(title='New book', text='$book is waiting'))
+    batches = PersonalizedBatches(template, max_devices=MAX_NUMBER_IN_BATCH, max_groups=MAX_NUMBER_OF_GROUPS)
+    devices = list(synthetic_devices(args.devices, args.texts))
+    started = time.time()
+    batches.add_many(devices)
+    grouped = time.time()
+    requests = list(batches)
+    packed = time.time()
+
+    print('devices={devices} renders={renders} messages={messages} requests={requests} items={items} '
+          'group={group:.2f}s pack={pack:.2f}s devices/s={speed:.0f}'.format(
+              devices=args.devices, renders=template.renders, messages=batches.distinct_messages,
+              requests=len(requests), items=sum(len(batch) for _, batch in requests),
+              group=grouped - started, pack=packed - grouped, speed=args.devices / (packed - started)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# coding: utf-8
+"""
+Compare size and serialization time of send-batch request bodies
+
+Usage:
+    python benchmarks/serialization.py [--devices 250000] [--repeat 5]
+
+Synthetic batch with the max number of devices is serialized by every installed serializer
+and by `json.dumps` with default separators, which was used before serializers were added.
+Every serialized body is also compressed with gzip.
+"""
+import argparse
+import json
+import time
+
+from appmetrica.push.api import MAX_NUMBER_IN_BATCH, MAX_NUMBER_OF_GROUPS, PushAPI, new_client_transfer_id
+from appmetrica.serializers import SERIALIZERS, gzip_compress
+
+
+def synthetic_batch(devices):
+    tokens = [('ios_push_token' if i % 2 else 'android_push_token', '%064X' % i) for i in range(devices)]
+    messages = PushAPI._build_messages(
+        PushAPI.build_ios_message(title=u'Заголовок', text=u'Текст сообщения', extra_data={'book_id': 42}),
+        {'silent': False, 'content': {'title': u'Заголовок', 'text': u'Текст сообщения'}},
+    )
+    _, _, devices_list = next(PushAPI._iter_chunks(sorted(tokens), None))
+    return PushAPI._build_batch_data(1, 'benchmark', messages, devices_list, new_client_transfer_id())
+
+
+def best_time(func, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        result = func(data)
+        timings.append(time.time() - started)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=MAX_NUMBER_IN_BATCH)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = synthetic_batch(args.devices)
+    serializers = [('requests-json', lambda value: json.dumps(value).encode('utf-8'))]
+    serializers.extend((name, func) for name, func in sorted(SERIALIZERS.items()) if func is not None)
+    print('devices={devices} max_groups={groups}'.format(devices=args.devices, groups=MAX_NUMBER_OF_GROUPS))
+
+    for name, serializer in serializers:
+        body, elapsed = best_time(serializer, data, args.repeat)
+        compressed, compress_elapsed = best_time(gzip_compress, body, args.repeat)
+        print('{name:<14} bytes={size} ms={elapsed:.1f} gzip_bytes={gzip_size} gzip_ms={gzip_elapsed:.1f}'.format(
+            name=name, size=len(body), elapsed=elapsed * 1000, gzip_size=len(compressed),
+            gzip_elapsed=compress_elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# coding: utf-8
+"""
+Measure throughput of validation and deduplication of device tokens
+
+Usage:
+    python benchmarks/token_validation.py [--tokens 2000000] [--duplicates 0.1] [--malformed 0.01]
+
+Synthetic iOS push tokens and IFAs are passed as (id_type, token) pairs like tokens read from file.
+"""
+import argparse
+import random
+import time
+
+from appmetrica.push.api import TokenTypes
+from appmetrica.push.validation import TokenFilter
+
+
+def synthetic_pairs(tokens, duplicates, malformed):
+    rnd = random.Random(0)
+    for i in range(tokens):
+        if rnd.random() < duplicates:
+            i = rnd.randrange(i + 1)
+        if i % 2:
+            pair = TokenTypes.IOS_PUSH_TOKEN, '%064X' % i
+        else:
+            pair = TokenTypes.IOS_IFA, '%08X-0000-4000-8000-%012X' % (i % 2 ** 32, i)
+        if rnd.random() < malformed:
+            pair = pair[0], pair[1][:-1] + 'Z'
+        yield pair
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=2000000)
+    parser.add_argument('--duplicates', type=float, default=0.1)
+    parser.add_argument('--malformed', type=float, default=0.01)
+    args = parser.parse_args()
+
+    pairs = sorted(synthetic_pairs(args.tokens, args.duplicates, args.malformed), key=lambda pair: pair[0])
+    token_filter = TokenFilter()
+    started = time.time()
+    for _ in token_filter.filter(pairs):
+        pass
+    elapsed = time.time() - started
+    print('tokens={tokens} time={elapsed:.2f}s tokens/s={speed:.0f} {report}'.format(
+        tokens=args.tokens, elapsed=elapsed, speed=args.tokens / elapsed, report=token_filter.report()))
+
+
+if __name__ == '__main__':
+    main()
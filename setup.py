@@ -26,6 +26,7 @@ with open('CHANGELOG.rst') as history_file:
 
 requirements = [
     'requests>=2.10.0',
+    'futures>=3.0.0; python_version < "3"',
 ]
 
 setup(
@@ -42,6 +43,12 @@ setup(
     package_dir={'appmetrica': 'appmetrica'},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'aio': ['aiohttp>=3.6.0; python_version >= "3.6"'],
+        'numpy': ['numpy'],
+        'arrow': ['pyarrow; python_version >= "3.6"'],
+        'fast': ['orjson; python_version >= "3.6"', 'ujson'],
+    },
     license='BSD',
     zip_safe=False,
     keywords='appmetrica',
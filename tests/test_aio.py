@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+from appmetrica.export.aio import AsyncExportAPI  # noqa: E402
+from appmetrica.export.exceptions import AppMetricaPrepareData, AppMetricaExportPushTokenError  # noqa: E402
+from appmetrica.push.aio import AsyncPushAPI  # noqa: E402
+from appmetrica.push.api import TokenTypes  # noqa: E402
+from appmetrica.push.exceptions import AppMetricaSendPushError, AppMetricaCheckStatusError  # noqa: E402
+from appmetrica.metrics import MetricsCollector  # noqa: E402
+from appmetrica.ratelimit import EndpointFamilies, RateLimiter  # noqa: E402
+from appmetrica.retry import RetryPolicy  # noqa: E402
+from appmetrica.stat.aio import AsyncStatAPI  # noqa: E402
+
+
+def run_with_server(routes, api_class, scenario, **api_kwargs):
+    """
+    Run scenario(api) against local server which responds with routes {(method, path): handler}
+    """
+    # retries without delays
+    api_kwargs.setdefault('retry_policy', RetryPolicy(backoff_factor=0))
+
+    async def main():
+        app = web.Application()
+        for (method, path), handler in routes.items():
+            app.router.add_route(method, path, handler)
+        async with TestServer(app) as server:
+            test_api_class = type(api_class.__name__, (api_class,), {'base_url': str(server.make_url('/'))})
+            async with test_api_class(app_id=123, access_token='123', **api_kwargs) as api:
+                await scenario(api)
+
+    # asyncio.run is not available before python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def json_handler(*responses):
+    responses = list(responses)
+    requests = []
+
+    async def handler(request):
+        body = await request.read()
+        requests.append((request.query, body))
+        status, data = responses.pop(0) if len(responses) > 1 else responses[0]
+        return web.json_response(data, status=status)
+
+    handler.requests = requests
+    return handler
+
+
+def test_push_api():
+    groups = json_handler((200, {'group': {'id': 9}}))
+    status = json_handler((200, {'transfer': {'status': 'sent'}}),
+                          (200, {'transfer': {'status': 'failed', 'errors': ['Error']}}))
+
+    async def scenario(api):
+        assert await api.create_group('foobar', send_rate=200) == 9
+        assert await api.check_status(505) == 'sent'
+        with pytest.raises(AppMetricaCheckStatusError):
+            await api.check_status(506)
+
+    run_with_server({('POST', '/management/groups'): groups, ('GET', '/status/{id}'): status},
+                    AsyncPushAPI, scenario)
+    assert json.loads(groups.requests[0][1]) == {'group': {'app_id': 123, 'name': 'foobar', 'send_rate': 200}}
+
+
+def test_send_push():
+    send_batch = json_handler((200, {'push_response': {'transfer_id': 1020}}), (500, {}))
+    devices = [{'id_type': TokenTypes.APPMETRICA_DEVICE_ID, 'id_values': ['123456789', '42']}]
+
+    async def scenario(api):
+        message = api.build_ios_message(title='Subject', text='Body')
+        assert await api.send_push(9, devices=devices, ios_message=message) == 1020
+        with pytest.raises(AppMetricaSendPushError):
+            await api.send_push(9, devices=devices, ios_message=message)
+        # validation is shared with PushAPI
+        with pytest.raises(AppMetricaSendPushError):
+            await api.send_push(9, ios_message=message)
+
+    run_with_server({('POST', '/send-batch'): send_batch}, AsyncPushAPI, scenario)
+    assert len(send_batch.requests) == 2
+
+
+def test_export_api():
+    push_tokens = json_handler((202, {}), (200, {'data': [{'token': 'D7BB4C4F8B3CF81488DEAAC8ABC1B955'}]}),
+                               (500, {}))
+
+    async def scenario(api):
+        with pytest.raises(AppMetricaPrepareData):
+            await api.export_push_tokens('token')
+        assert await api.export_push_tokens('token') == [{'token': 'D7BB4C4F8B3CF81488DEAAC8ABC1B955'}]
+        with pytest.raises(AppMetricaExportPushTokenError):
+            await api.export_push_tokens('token')
+
+    run_with_server({('GET', '/push_tokens.json'): push_tokens}, AsyncExportAPI, scenario)
+    assert dict(push_tokens.requests[0][0]) == {'application_id': '123', 'fields': 'token'}
+
+
+def test_stat_api():
+    data = json_handler((200, {'data': [{'dimensions': [], 'metrics': [1, 2]}]}))
+
+    async def scenario(api):
+        result = await api.export_stat({'ids': 123, 'metrics': ['ym:ts:users', 'ym:ts:sessions']})
+        assert result == [{'dimensions': [], 'metrics': [1, 2]}]
+
+    run_with_server({('GET', '/data'): data}, AsyncStatAPI, scenario)
+    assert data.requests[0][0].getall('metrics') == ['ym:ts:users', 'ym:ts:sessions']
+
+
+def test_retries_rate_limit_and_hooks():
+    data = json_handler((503, {}), (200, {'data': []}))
+    collector = MetricsCollector()
+    reserved = []
+
+    class Limiter(RateLimiter):
+        def reserve(self, family, max_wait=None):
+            reserved.append(family)
+            return super(Limiter, self).reserve(family, max_wait=max_wait)
+
+    limiter = Limiter({EndpointFamilies.STAT: 1000})
+
+    async def scenario(api):
+        assert await api.export_stat({'ids': 123, 'metrics': 'ym:ts:users'}) == []
+
+    run_with_server({('GET', '/data'): data}, AsyncStatAPI, scenario, hooks=[collector], rate_limiter=limiter)
+    assert len(data.requests) == 2
+    stat = collector.snapshot()[('GET', 'data')]
+    assert stat['count'] == 1 and stat['retries'] == 1 and stat['statuses'] == {200: 1}
+    assert reserved == [EndpointFamilies.STAT] * 2
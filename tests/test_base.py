@@ -0,0 +1,311 @@
+import gzip
+import io
+import json
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+import responses
+from requests import Response
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+
+from appmetrica.base import create_session
+from appmetrica.exceptions import AppMetricaRequestError
+from appmetrica.export.api import ExportAPI
+from appmetrica.metrics import Histogram, MetricsCollector, RequestHooks, endpoint_label
+from appmetrica.push.api import PushAPI
+from appmetrica.push.exceptions import AppMetricaCreateGroupError, AppMetricaSendPushError
+from appmetrica.ratelimit import EndpointFamilies, RateLimiter, TokenBucket
+from appmetrica.retry import RetryPolicy, parse_retry_after
+from appmetrica.serializers import SERIALIZERS, get_serializer
+from appmetrica.stat.api import StatAPI
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
+
+@responses.activate
+def test_session_is_reused():
+    api = PushAPI(app_id=123, access_token='123', pool_size=2)
+    url = urljoin(PushAPI.base_url, 'status/1')
+    responses.add(responses.GET, url, status=200, json={'transfer': {'status': 'sent'}})
+
+    session = api.session
+    assert api.session.get_adapter(url)._pool_maxsize == 2
+    api.check_status(1)
+    api.check_status(1)
+    assert api.session is session
+
+    api.close()
+    assert api._session is None
+
+
+def test_shared_session_is_not_closed_by_api():
+    session = create_session(pool_size=5)
+    apis = [cls(app_id=123, access_token='123', session=session) for cls in (PushAPI, ExportAPI, StatAPI)]
+    for api in apis:
+        assert api.session is session
+        api.close()
+        assert api.session is session
+    session.close()
+
+
+@responses.activate
+def test_base_url_override():
+    api = StatAPI(app_id=123, access_token='123', base_url='http://127.0.0.1:8000/stat/v1/')
+    responses.add(responses.GET, 'http://127.0.0.1:8000/stat/v1/data', json={'data': [1]})
+    assert api.export_stat({'ids': 123}) == [1]
+    assert StatAPI.base_url.startswith('https://api.appmetrica')
+
+
+def test_context_manager_closes_session():
+    with StatAPI(app_id=123, access_token='123') as api:
+        assert api.session is not None
+    assert api._session is None
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=5)
+    started = time.time()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(15)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 5 tokens of burst and 10 tokens at 100 per second
+    assert 0.08 <= time.time() - started < 0.5
+
+
+class RecordingLimiter(RateLimiter):
+    def __init__(self):
+        super(RecordingLimiter, self).__init__(limits={})
+        self.families = []
+
+    def acquire(self, family, timeout=None):
+        self.families.append(family)
+        return True
+
+
+@responses.activate
+def test_rate_limiter_families():
+    limiter = RecordingLimiter()
+    push_api = PushAPI(app_id=123, access_token='123', rate_limiter=limiter)
+    stat_api = StatAPI(app_id=123, access_token='123', rate_limiter=limiter)
+    responses.add(responses.GET, PushAPI.base_url + 'status/1', json={'transfer': {'status': 'sent'}})
+    responses.add(responses.GET, PushAPI.base_url + 'management/groups', json={'groups': []})
+    responses.add(responses.GET, StatAPI.base_url + 'data', json={'data': []})
+
+    push_api.check_status(1)
+    push_api.get_groups()
+    stat_api.export_stat({'ids': 123})
+    assert limiter.families == [EndpointFamilies.PUSH_STATUS, EndpointFamilies.PUSH_MANAGEMENT, EndpointFamilies.STAT]
+
+
+@pytest.mark.parametrize('idempotent, kwargs, retried', [
+    (False, {'error': ConnectTimeout()}, True),
+    (False, {'error': ReadTimeout()}, False),
+    (True, {'error': ReadTimeout()}, True),
+    (False, {'status': 429}, True),
+    (False, {'status': 503}, True),
+    (False, {'status': 500}, False),
+    (True, {'status': 500}, True),
+    (True, {'status': 400}, False),
+])
+def test_retry_policy(idempotent, kwargs, retried):
+    response = None
+    if 'status' in kwargs:
+        response = Response()
+        response.status_code = kwargs['status']
+    policy = RetryPolicy(retries=1)
+    delay = policy.retry_delay(0, idempotent, response=response, error=kwargs.get('error'))
+    assert (delay is not None) == retried
+    assert policy.retry_delay(1, idempotent, response=response, error=kwargs.get('error')) is None
+
+
+def test_retry_after_longer_than_max_backoff():
+    response = Response()
+    response.status_code = 429
+    response.headers['Retry-After'] = '3600'
+    assert RetryPolicy(max_backoff=60).retry_delay(0, False, response=response) is None
+    response.headers['Retry-After'] = '30'
+    assert RetryPolicy(max_backoff=60).retry_delay(0, False, response=response) == 30
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('garbage') is None
+
+
+@responses.activate
+def test_request_retries():
+    api = StatAPI(app_id=123, access_token='123', retry_policy=RetryPolicy(retries=3, backoff_factor=0))
+    url = urljoin(StatAPI.base_url, 'data')
+    responses.add(responses.GET, url, status=429, headers={'Retry-After': '0.01'})
+    responses.add(responses.GET, url, body=ConnectionError())
+    responses.add(responses.GET, url, status=502)
+    responses.add(responses.GET, url, status=200, json={'data': [1]})
+
+    assert api.export_stat({'ids': 123}) == [1]
+    assert len(responses.calls) == 4
+
+
+@responses.activate
+def test_request_deadline():
+    api = StatAPI(app_id=123, access_token='123',
+                  retry_policy=RetryPolicy(retries=10, backoff_factor=0, deadline=0.1))
+    url = urljoin(StatAPI.base_url, 'data')
+    responses.add(responses.GET, url, status=503, headers={'Retry-After': '0.04'})
+
+    started = time.time()
+    with pytest.raises(AppMetricaRequestError):
+        api._request('get', 'data')
+    assert time.time() - started < 0.2
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_rate_limiter_wait_is_limited_by_deadline():
+    limiter = RateLimiter({EndpointFamilies.STAT: TokenBucket(rate=1, capacity=1)})
+    api = StatAPI(app_id=123, access_token='123', rate_limiter=limiter,
+                  retry_policy=RetryPolicy(retries=0, deadline=0.1))
+    responses.add(responses.GET, urljoin(StatAPI.base_url, 'data'), json={'data': []})
+
+    assert api.export_stat({'ids': 123}) == []
+    started = time.time()
+    # the next token is available in a second, after the deadline
+    with pytest.raises(AppMetricaRequestError):
+        api.export_stat({'ids': 123})
+    assert time.time() - started < 0.1
+    assert len(responses.calls) == 1
+    # the token is not taken by failed request
+    assert limiter.buckets[EndpointFamilies.STAT].reserve(max_wait=5) < 1.5
+
+
+@responses.activate
+def test_send_batch_is_retried_only_with_client_transfer_id():
+    api = PushAPI(app_id=123, access_token='123', retry_policy=RetryPolicy(retries=1, backoff_factor=0))
+    url = urljoin(PushAPI.base_url, 'send-batch')
+    responses.add(responses.POST, url, status=500)
+    data = {'push_batch_request': {'group_id': 1, 'tag': 'tag', 'batch': [
+        {'messages': {}, 'devices': [{'id_type': 'ios_ifa', 'id_values': ['1']}]}
+    ]}}
+
+    with pytest.raises(AppMetricaSendPushError):
+        api.send(data)
+    assert len(responses.calls) == 1
+
+    data['push_batch_request']['client_transfer_id'] = 42
+    with pytest.raises(AppMetricaSendPushError):
+        api.send(data)
+    assert len(responses.calls) == 3
+
+
+@pytest.mark.parametrize('name', [name for name, serializer in sorted(SERIALIZERS.items()) if serializer])
+def test_serializers(name):
+    data = {'push_batch_request': {'tag': u'тег', 'batch': [{'devices': [{'id_values': ['1', '2']}]}]}}
+    assert json.loads(get_serializer(name)(data).decode('utf-8')) == data
+
+
+@pytest.mark.parametrize('name', [name for name, serializer in sorted(SERIALIZERS.items()) if serializer])
+def test_serializers_fall_back_to_json(name):
+    point = namedtuple('Point', ['x', 'y'])
+    data = {'keys': {1: 'a'}, 'point': point(1, 2), 'big': 2 ** 70}
+    assert json.loads(get_serializer(name)(data).decode('utf-8')) == {
+        'keys': {'1': 'a'}, 'point': [1, 2], 'big': 2 ** 70
+    }
+
+
+def test_default_serializer_is_json():
+    assert PushAPI.serializer is get_serializer() is get_serializer('json')
+    assert get_serializer('fast') in [serializer for serializer in SERIALIZERS.values() if serializer]
+    assert PushAPI.build_ios_message(title='Title', text='Text', extra_data={1: 'a'})['content']['data'] == (
+        '{"1": "a"}'
+    )
+
+
+@responses.activate
+def test_unserializable_body():
+    api = PushAPI(app_id=123, access_token='123')
+    with pytest.raises(AppMetricaRequestError):
+        api._request('post', 'send-batch', json={'devices': {object()}})
+    assert len(responses.calls) == 0
+
+
+@responses.activate
+def test_request_body_is_compressed():
+    api = PushAPI(app_id=123, access_token='123', compress_threshold=100)
+    url = urljoin(PushAPI.base_url, 'management/groups')
+    responses.add(responses.POST, url, json={'group': {'id': 1}})
+
+    api.create_group('foobar')
+    assert 'Content-Encoding' not in responses.calls[0].request.headers
+
+    api.create_group('foobar' * 20)
+    request = responses.calls[1].request
+    assert request.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.GzipFile(fileobj=io.BytesIO(request.body)).read().decode('utf-8')) == {
+        'group': {'app_id': 123, 'name': 'foobar' * 20}
+    }
+
+
+class RecordingHooks(RequestHooks):
+    def __init__(self):
+        self.events = []
+
+    def on_request_start(self, event):
+        self.events.append(('start', event.method, event.endpoint))
+
+    def on_request_end(self, event):
+        self.events.append(('end', event.status_code, event.retries, event.error))
+
+
+class FailingHooks(RequestHooks):
+    def on_request_end(self, event):
+        raise ValueError
+
+
+@responses.activate
+def test_request_hooks():
+    hooks = RecordingHooks()
+    collector = MetricsCollector()
+    api = PushAPI(app_id=123, access_token='123', retry_policy=RetryPolicy(retries=1, backoff_factor=0),
+                  hooks=[hooks, FailingHooks(), collector])
+    responses.add(responses.GET, PushAPI.base_url + 'status/1', status=503)
+    responses.add(responses.GET, PushAPI.base_url + 'status/1', json={'transfer': {'status': 'sent'}})
+    responses.add(responses.POST, PushAPI.base_url + 'management/groups', body=ConnectionError())
+
+    api.check_status(1)
+    with pytest.raises(AppMetricaCreateGroupError):
+        api.create_group('foobar')
+
+    assert hooks.events == [
+        ('start', 'GET', 'status/1'), ('end', 200, 1, None),
+        ('start', 'POST', 'management/groups'), ('end', None, 0, 'ConnectionError'),
+    ]
+    snapshot = collector.snapshot()
+    status = snapshot[('GET', 'status/{id}')]
+    assert status['count'] == 1 and status['retries'] == 1 and status['statuses'] == {200: 1}
+    assert status['bytes_received'] > 0 and status['latency']['p99'] is not None
+    groups = snapshot[('POST', 'management/groups')]
+    assert groups['errors'] == {'ConnectionError': 1} and groups['bytes_sent'] > 0
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 2, 5))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.quantile(0.2) == 1
+    assert histogram.quantile(0.5) == 2
+    assert histogram.quantile(0.8) == 5
+    assert histogram.quantile(1) == 10
+    assert Histogram().quantile(0.5) is None
+
+
+def test_endpoint_label():
+    assert endpoint_label('status/123') == 'status/{id}'
+    assert endpoint_label('management/groups') == 'management/groups'
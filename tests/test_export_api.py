@@ -1,10 +1,21 @@
+import json
+import threading
 import pytest
 import responses
-from datetime import datetime, timedelta
+from concurrent import futures
+from datetime import date, datetime, timedelta
 from requests.exceptions import ConnectionError
 
 from appmetrica.export.api import ExportAPI
-from appmetrica.export.exceptions import AppMetricaPrepareData, AppMetricaExportPushTokenError
+from appmetrica.export.exceptions import (AppMetricaPrepareData, AppMetricaExportPushTokenError,
+                                          AppMetricaPrepareTimeout, AppMetricaExportInstallationsError,
+                                          AppMetricaExportShardError)
+from appmetrica.export.incremental import WatermarkStore
+from appmetrica.export.parsers import iter_csv_rows, iter_json_array, make_record_type
+from appmetrica.export.sharding import iter_sharded
+from appmetrica.retry import RetryPolicy
+from appmetrica.sinks import open_sink, read_records
+from appmetrica.utils import Backoff
 
 try:
     from urllib.parse import urljoin
@@ -14,7 +25,8 @@ except ImportError:
 
 @pytest.fixture
 def api():
-    yield ExportAPI(app_id=123, access_token='123')
+    # retries without delays
+    yield ExportAPI(app_id=123, access_token='123', retry_policy=RetryPolicy(backoff_factor=0))
 
 
 @responses.activate
@@ -77,3 +89,309 @@ def test_get_installations_success(api):
     data = api.export_installations('ios_ifv', **params)
     assert len(data) == 2
     assert data[1]['ios_ifv'] == 'D8218A67-4972-416D-8B2D-A65BD5BDE4CE'
+
+
+@responses.activate
+def test_export_wait_prepared_data(api):
+    url = urljoin(ExportAPI.base_url, 'push_tokens.json')
+    responses.add(responses.GET, url, status=202, body='')
+    responses.add(responses.GET, url, status=202, body='')
+    responses.add(responses.GET, url, status=200, json={'data': [{'token': 'D7BB4C4F8B3CF81488DEAAC8ABC1B955'}]})
+
+    data = api.export_push_tokens('token', wait=Backoff(interval=0.001, timeout=1))
+    assert data == [{'token': 'D7BB4C4F8B3CF81488DEAAC8ABC1B955'}]
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_export_wait_timeout(api):
+    url = urljoin(ExportAPI.base_url, 'installations.json')
+    responses.add(responses.GET, url, status=202, body='')
+
+    with pytest.raises(AppMetricaPrepareTimeout):
+        api.export_installations('ios_ifv', wait=Backoff(interval=0.01, timeout=0.05))
+    assert 1 < len(responses.calls) < 7
+
+    # default backoff is limited by prepare_timeout too
+    api.prepare_timeout = 1
+    with pytest.raises(AppMetricaPrepareTimeout):
+        api.export_installations('ios_ifv', wait=True)
+
+
+@responses.activate
+def test_submit_exports(api):
+    tokens_url = urljoin(ExportAPI.base_url, 'push_tokens.json')
+    responses.add(responses.GET, tokens_url, status=202, body='')
+    responses.add(responses.GET, tokens_url, status=200, json={'data': [{'token': 'D7BB4C4F8B3CF81488DEAAC8ABC1B955'}]})
+    installations_url = urljoin(ExportAPI.base_url, 'installations.json')
+    responses.add(responses.GET, installations_url, status=200, json={'data': [{'ios_ifv': 'D8218A67'}]})
+
+    done = []
+    backoff = Backoff(interval=0.001, timeout=1)
+    with api:
+        tokens = api.submit(api.export_push_tokens, 'token', wait=backoff, callback=done.append)
+        installations = api.submit(api.export_installations, 'ios_ifv', date_from=datetime.now(), wait=backoff)
+        assert set(futures.as_completed([tokens, installations], timeout=1)) == {tokens, installations}
+
+    assert tokens.result() == [{'token': 'D7BB4C4F8B3CF81488DEAAC8ABC1B955'}]
+    assert installations.result() == [{'ios_ifv': 'D8218A67'}]
+    assert done == [tokens]
+    assert api._executor is None
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024])
+def test_iter_json_array(chunk_size):
+    records = [{'token': u'\u0442\u043e\u043a\u0435\u043d %s' % i, 'n': i} for i in range(100)] + [123, 'foo', [1]]
+    document = json.dumps({'meta': {'data': 1}, 'data': records}).encode('utf-8')
+    assert list(iter_json_array(split(document, chunk_size))) == records
+    assert list(iter_json_array([b'{"data": [ ] }'])) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 1024])
+def test_iter_json_array_numbers(chunk_size):
+    numbers = [2500.0, 1e-07, -3.25E+10, 0, 12345678901234567890, 1.5, True, None]
+    document = json.dumps({'data': numbers}).encode('utf-8')
+    assert list(iter_json_array(split(document, chunk_size))) == numbers
+    assert list(iter_json_array(split(b'{"data": [ 2500.0 ,1e5 ] }', chunk_size))) == [2500.0, 1e5]
+
+
+@pytest.mark.parametrize('document', [
+    b'{"data": [{"token": "1"}, {"token": "2"',
+    b'{"rows": [{"token": "1"}]}',
+    b'{"data": [{"token": }]}',
+    b'{"data": [1 2]}',
+])
+def test_iter_json_array_malformed(document):
+    with pytest.raises(ValueError):
+        list(iter_json_array(split(document, 4)))
+
+
+def test_iter_json_array_memory_limit():
+    document = json.dumps({'data': [{'token': 'x' * 100}]}).encode('utf-8')
+    with pytest.raises(ValueError):
+        list(iter_json_array(split(document, 10), max_record_size=50))
+
+
+@responses.activate
+def test_iter_installations(api):
+    url = urljoin(ExportAPI.base_url, 'installations.json')
+    records = [{'ios_ifv': str(i)} for i in range(1000)]
+    responses.add(responses.GET, url, status=202, body='')
+    responses.add(responses.GET, url, status=200, json={'data': records})
+    responses.add(responses.GET, url, status=200, body='{"data": [{"ios_ifv": "1"}')
+
+    api.stream_chunk_size = 100
+    rows = api.iter_installations('ios_ifv', date_from=datetime.now(), wait=Backoff(interval=0.001, timeout=1))
+    assert list(rows) == records
+
+    with pytest.raises(AppMetricaExportInstallationsError):
+        list(api.iter_installations('ios_ifv'))
+
+
+@responses.activate
+def test_iter_push_tokens_prepare_data(api):
+    url = urljoin(ExportAPI.base_url, 'push_tokens.json')
+    responses.add(responses.GET, url, status=202, body='')
+    with pytest.raises(AppMetricaPrepareData):
+        list(api.iter_push_tokens('token'))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1024])
+def test_iter_csv_rows(chunk_size):
+    document = u'token,comment\r\nAAA,"multi\nline"\r\nBBB,\u0442\u0435\u043a\u0441\u0442\r\n'.encode('utf-8')
+    assert list(iter_csv_rows(split(document, chunk_size))) == [
+        ('AAA', 'multi\nline'),
+        ('BBB', u'\u0442\u0435\u043a\u0441\u0442'),
+    ]
+
+    record_type = make_record_type(['token', 'comment'])
+    rows = list(iter_csv_rows(split(document, chunk_size), record_type=record_type))
+    assert rows[0].token == 'AAA'
+    assert rows[1]._asdict() == {'token': 'BBB', 'comment': u'\u0442\u0435\u043a\u0441\u0442'}
+    assert rows[0] == record_type('AAA', 'multi\nline')
+    assert not hasattr(rows[0], '__dict__')
+
+
+def test_iter_csv_rows_by_header():
+    document = u'comment,token,os\n\u0442\u0435\u043a\u0441\u0442,AAA,ios\n'.encode('utf-8')
+    assert list(iter_csv_rows([document], fields=['token', 'comment'])) == [('AAA', u'\u0442\u0435\u043a\u0441\u0442')]
+    with pytest.raises(ValueError):
+        list(iter_csv_rows([document], fields=['token', 'ios_ifa']))
+    assert list(iter_csv_rows([b''], fields=['token'])) == []
+
+
+@responses.activate
+def test_iter_push_tokens_csv(api):
+    url = urljoin(ExportAPI.base_url, 'push_tokens.csv')
+    responses.add(responses.GET, url, status=200, body='token,ios_ifa\nAAA,1\nBBB,2\n')
+    assert list(api.iter_push_tokens('token', 'ios_ifa', format='csv')) == [('AAA', '1'), ('BBB', '2')]
+
+    url = urljoin(ExportAPI.base_url, 'installations.csv')
+    responses.add(responses.GET, url, status=200, body='os_name,ios_ifv\nios,CCC\n')
+    rows = list(api.iter_installations('ios_ifv', 'os_name', format='csv', record=True))
+    assert [(row.ios_ifv, row.os_name) for row in rows] == [('CCC', 'ios')]
+
+
+def test_iter_sharded_windows():
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch(since, until):
+        with lock:
+            fetched.append((since, until))
+        return [since]
+
+    date_from = datetime(2020, 1, 1, 12)
+    date_till = datetime(2020, 1, 3, 18)
+    rows = list(iter_sharded(fetch, date_from, date_till, window='day', max_workers=2))
+    assert rows == [datetime(2020, 1, 1, 12), datetime(2020, 1, 2, 12), datetime(2020, 1, 3, 12)]
+    assert sorted(fetched) == [
+        (datetime(2020, 1, 1, 12), datetime(2020, 1, 2, 11, 59, 59)),
+        (datetime(2020, 1, 2, 12), datetime(2020, 1, 3, 11, 59, 59)),
+        (datetime(2020, 1, 3, 12), datetime(2020, 1, 3, 18)),
+    ]
+
+
+def test_iter_sharded_dates():
+    fetched = []
+    rows = iter_sharded(lambda since, until: fetched.append((since, until)) or [since.day],
+                        date(2020, 1, 1), date(2020, 1, 3), window='day', max_workers=1)
+    assert list(rows) == [1, 2, 3]
+    assert fetched == [(datetime(2020, 1, day), datetime(2020, 1, day, 23, 59, 59)) for day in (1, 2, 3)]
+
+
+def test_iter_sharded_retries():
+    attempts = {}
+    lock = threading.Lock()
+
+    def fetch(since, until):
+        with lock:
+            attempts[since] = attempts.get(since, 0) + 1
+        if since.hour == 1 and attempts[since] < 3:
+            raise AppMetricaExportInstallationsError
+        return [since.hour]
+
+    rows = iter_sharded(fetch, datetime(2020, 1, 1), datetime(2020, 1, 1, 3, 59, 59), window='hour', retries=2)
+    assert list(rows) == [0, 1, 2, 3]
+    assert attempts == {datetime(2020, 1, 1, hour): 3 if hour == 1 else 1 for hour in range(4)}
+
+    with pytest.raises(AppMetricaExportShardError) as exc_info:
+        list(iter_sharded(fetch, datetime(2020, 1, 2), datetime(2020, 1, 2, 3), window='hour', retries=0))
+    assert exc_info.value.since == datetime(2020, 1, 2, 1)
+
+
+def test_iter_sharded_adaptive():
+    fetched = []
+
+    def fetch(since, until):
+        fetched.append((since, until))
+        if until - since > timedelta(hours=6):
+            raise AppMetricaExportInstallationsError('too much data')
+        return [(since, until)]
+
+    rows = list(iter_sharded(fetch, datetime(2020, 1, 1), datetime(2020, 1, 1, 23, 59, 59), window='day',
+                             max_workers=1, retries=0, max_rows=1000))
+    assert [since.hour for since, _ in rows] == [0, 6, 12, 18]
+    assert rows[-1][1] == datetime(2020, 1, 1, 23, 59, 59)
+
+
+@responses.activate
+def test_iter_installations_sharded(api):
+    url = urljoin(ExportAPI.base_url, 'installations.json')
+
+    def callback(request):
+        date_since = request.url.split('date_since=')[1].split('&')[0]
+        return 200, {}, json.dumps({'data': [{'date_since': date_since}]})
+
+    responses.add_callback(responses.GET, url, callback=callback)
+    rows = api.iter_installations_sharded('ios_ifv', date_from=datetime(2020, 1, 1), date_till=datetime(2020, 1, 3))
+    assert [row['date_since'] for row in rows] == ['2020-01-01+00%3A00%3A00', '2020-01-02+00%3A00%3A00',
+                                                   '2020-01-03+00%3A00%3A00']
+
+
+@pytest.mark.parametrize('window', ['week', timedelta(0), timedelta(hours=-1)])
+def test_iter_installations_sharded_invalid_window(api, window):
+    with pytest.raises(ValueError) as exc_info:
+        api.iter_installations_sharded('ios_ifv', date_from=datetime(2020, 1, 1), date_till=datetime(2020, 1, 3),
+                                       window=window)
+    if window == 'week':
+        assert 'day, hour' in str(exc_info.value)
+
+
+@responses.activate
+def test_iter_installations_incremental(api, tmpdir):
+    url = urljoin(ExportAPI.base_url, 'installations.json')
+    store = WatermarkStore(str(tmpdir.join('watermarks.json')))
+    first = [{'ios_ifv': 'a', 'install_receive_timestamp': 100}, {'ios_ifv': 'b', 'install_receive_timestamp': 200}]
+    second = [{'ios_ifv': 'b', 'install_receive_timestamp': 200}, {'ios_ifv': 'c', 'install_receive_timestamp': 200},
+              {'ios_ifv': 'z', 'install_receive_timestamp': 150}, {'ios_ifv': 'd', 'install_receive_timestamp': 300}]
+    responses.add(responses.GET, url, json={'data': first})
+    responses.add(responses.GET, url, json={'data': second})
+    responses.add(responses.GET, url, json={'data': second})
+
+    assert list(api.iter_installations_incremental('ios_ifv', watermarks=store)) == first
+    assert 'date_since' not in responses.calls[0].request.url
+    assert 'install_receive_timestamp' in responses.calls[0].request.url
+    assert store.get(123).timestamp == 200
+
+    # interrupted export does not move the watermark
+    delta = api.iter_installations_incremental('ios_ifv', watermarks=store)
+    next(iter(delta))
+    assert store.get(123).timestamp == 200
+
+    delta = api.iter_installations_incremental('ios_ifv', watermarks=store)
+    assert [row['ios_ifv'] for row in delta] == ['c', 'd']
+    assert delta.dropped == 2
+    assert 'date_since=1970-01-01+00%3A03%3A20' in responses.calls[2].request.url
+    assert store.get(123).timestamp == 300
+
+
+@pytest.mark.parametrize('file_name', ['installations.parquet', 'installations.arrow', 'installations.ndjson.gz'])
+@responses.activate
+def test_save_installations(api, tmpdir, file_name):
+    if not file_name.endswith('.gz'):
+        pytest.importorskip('pyarrow')
+    url = urljoin(ExportAPI.base_url, 'installations.json')
+    records = [{'ios_ifv': str(i), 'install_receive_timestamp': str(1600000000 + i), 'is_reinstallation': 'false'}
+               for i in range(250)]
+    responses.add(responses.GET, url, json={'data': records})
+
+    path = str(tmpdir.join(file_name))
+    fields = ('ios_ifv', 'install_receive_timestamp', 'is_reinstallation')
+    assert api.save_installations(path, *fields, chunk_size=100) == 250
+    assert list(read_records(path)) == [
+        {'ios_ifv': str(i), 'install_receive_timestamp': 1600000000 + i, 'is_reinstallation': False}
+        for i in range(250)
+    ]
+
+
+def test_parquet_sink_row_groups(tmpdir):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    path = str(tmpdir.join('tokens.parquet'))
+    with open_sink(path, ['token', 'score'], field_types={'score': 'float'}, chunk_size=2) as sink:
+        sink.write_many([('a', 1), {'token': 'b'}, ('c', '2.5')])
+
+    parquet_file = parquet.ParquetFile(path)
+    assert parquet_file.metadata.num_row_groups == 2
+    assert parquet_file.read().to_pydict() == {'token': ['a', 'b', 'c'], 'score': [1.0, None, 2.5]}
+
+
+@pytest.mark.parametrize('file_name', ['tokens.parquet', 'tokens.arrow', 'tokens.ndjson.gz'])
+def test_sink_removes_partial_file(tmpdir, file_name):
+    if not file_name.endswith('.gz'):
+        pytest.importorskip('pyarrow')
+    path = str(tmpdir.join(file_name))
+
+    def records():
+        yield ('a',)
+        yield ('b',)
+        raise ConnectionError('connection reset')
+
+    with pytest.raises(ConnectionError):
+        with open_sink(path, ['token'], chunk_size=1) as sink:
+            sink.write_many(records())
+    assert not tmpdir.join(file_name).exists()
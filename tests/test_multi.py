@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+from concurrent import futures
+
+import pytest
+import responses
+
+from appmetrica.exceptions import AppMetricaMultiAppError, AppMetricaRequestError
+from appmetrica.export.api import ExportAPI
+from appmetrica.multi import AppResult, AppRow, MultiAppClient
+from appmetrica.ratelimit import RateLimiter
+from appmetrica.retry import RetryPolicy
+from appmetrica.stat.api import StatAPI
+
+try:
+    from urllib.parse import urljoin, parse_qs, urlparse
+except ImportError:
+    from urlparse import urljoin, parse_qs, urlparse
+
+
+@pytest.fixture
+def client():
+    # retries without delays
+    with MultiAppClient([1, 2, 3], '123', max_workers=3, rate_limiter=RateLimiter({}),
+                        retry_policy=RetryPolicy(retries=0, backoff_factor=0)) as client:
+        yield client
+
+
+def app_id_of(request):
+    return int(parse_qs(urlparse(request.url).query)['ids'][0])
+
+
+@responses.activate
+def test_export_stat(client):
+    def callback(request):
+        app_id = app_id_of(request)
+        if app_id == 2:
+            return 500, {}, ''
+        return 200, {}, json.dumps({'total_rows': 1, 'data': [{'dimensions': [], 'metrics': [app_id]}]})
+
+    responses.add_callback(responses.GET, urljoin(StatAPI.base_url, 'data'), callback=callback)
+
+    results = client.export_stat({'metrics': 'ym:ts:users'})
+    assert list(results) == [1, 2, 3]
+    assert results[1].result[0]['metrics'] == [1]
+    assert results[3].result[0]['metrics'] == [3]
+    assert results[2].result is None
+    assert isinstance(results[2].error, AppMetricaRequestError)
+
+    # all instances share the session and the rate limiter
+    apis = [client.api(StatAPI, app_id) for app_id in client.app_ids]
+    assert all(api.session is client.session and api.rate_limiter is client.rate_limiter for api in apis)
+    assert client.api(StatAPI, 1) is apis[0]
+
+
+def test_run_timeout(client):
+    release = threading.Event()
+
+    def query(api):
+        if api.app_id == 2:
+            release.wait(5)
+        return api.app_id
+
+    results = client.run(ExportAPI, query, timeout=0.5)
+    assert results[1] == AppResult(1, 1, None)
+    assert results[3] == AppResult(3, 3, None)
+    assert isinstance(results[2].error, futures.TimeoutError)
+
+    release.set()
+
+
+def test_run_after_timeout(client):
+    release = threading.Event()
+    results = client.run(ExportAPI, lambda api: release.wait(5), timeout=0.1)
+    assert all(isinstance(result.error, futures.TimeoutError) for result in results.values())
+
+    # hung queries do not hold workers of the next call
+    results = client.run(ExportAPI, lambda api: api.app_id, timeout=0.5)
+    release.set()
+    assert [result.result for result in results.values()] == [1, 2, 3]
+
+    # workers of completed queries are released before close
+    for _ in range(100):
+        if not client._abandoned:
+            break
+        time.sleep(0.01)
+    assert client._abandoned == []
+
+
+@responses.activate
+def test_iter_installations(client):
+    def callback(request):
+        app_id = int(parse_qs(urlparse(request.url).query)['application_id'][0])
+        if app_id == 3:
+            return 400, {}, ''
+        return 200, {}, json.dumps({'data': [{'ios_ifv': '{}-{}'.format(app_id, i)} for i in range(100)]})
+
+    responses.add_callback(responses.GET, urljoin(ExportAPI.base_url, 'installations.json'), callback=callback)
+
+    rows = []
+    with pytest.raises(AppMetricaMultiAppError) as exc_info:
+        for row in client.iter_installations('ios_ifv'):
+            rows.append(row)
+    assert list(exc_info.value.errors) == [3]
+    assert sorted((row.app_id, row.row['ios_ifv']) for row in rows) == sorted(
+        (app_id, '{}-{}'.format(app_id, i)) for app_id in (1, 2) for i in range(100))
+    assert isinstance(rows[0], AppRow)
+
+
+def test_stream_close():
+    with MultiAppClient([1, 2], '123', max_workers=2) as client:
+        rows = client.stream(ExportAPI, lambda api: iter(range(1000000)), buffer_size=10)
+        assert next(rows).row == 0
+        # producers blocked on the full buffer are stopped
+        rows.close()
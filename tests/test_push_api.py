@@ -1,11 +1,21 @@
 import json
+import re
+import threading
+
 import pytest
 import responses
 from requests.exceptions import ConnectionError
 
-from appmetrica.push.api import PushAPI, TokenTypes
+from appmetrica.push import api as push_api
+from appmetrica.push.api import PushAPI, TokenTypes, TransferStatus
+from appmetrica.push.batching import iter_device_batches, read_tokens
+from appmetrica.push.campaign import Campaign, CampaignJournal
 from appmetrica.push.exceptions import (AppMetricaCreateGroupError, AppMetricaSendPushError,
-                                        AppMetricaCheckStatusError, AppMetricaGetGroupsError)
+                                        AppMetricaCheckStatusError, AppMetricaGetGroupsError,
+                                        AppMetricaBulkSendError)
+from appmetrica.push.personalized import MessageTemplate, PersonalizedBatches
+from appmetrica.push.validation import DropReasons, TokenFilter
+from appmetrica.retry import RetryPolicy
 
 try:
     from urllib.parse import urljoin
@@ -15,7 +25,8 @@ except ImportError:
 
 @pytest.fixture
 def api():
-    yield PushAPI(app_id=123, access_token='123')
+    # retries without delays
+    yield PushAPI(app_id=123, access_token='123', retry_policy=RetryPolicy(backoff_factor=0))
 
 
 @pytest.fixture
@@ -212,6 +223,51 @@ def test_get_groups_error(params, api):
         api.get_groups()
 
 
+@responses.activate
+def test_get_or_create_group(api):
+    url = urljoin(PushAPI.base_url, 'management/groups')
+    responses.add(responses.GET, url, json={'groups': [{'id': 11, 'app_id': 123, 'name': 'foobar'}]})
+    responses.add(responses.POST, url, json={'group': {'id': 12, 'app_id': 123, 'name': 'new'}})
+
+    threads = [threading.Thread(target=api.get_or_create_group, args=('new',)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert api.get_or_create_group('foobar') == 11
+    assert api.get_or_create_group('new', send_rate=100) == 12
+    assert api.groups.get_by_id(12)['name'] == 'new'
+    # groups are loaded once, refreshed once before creation and created once
+    assert [call.request.method for call in responses.calls] == ['GET', 'GET', 'POST']
+
+
+@responses.activate
+def test_group_registry_file(api, tmpdir):
+    path = str(tmpdir.join('groups.json'))
+    url = urljoin(PushAPI.base_url, 'management/groups')
+    responses.add(responses.GET, url, json={'groups': [{'id': 11, 'app_id': 123, 'name': 'foobar'}]})
+
+    assert PushAPI(app_id=123, access_token='123', groups_path=path).get_or_create_group('foobar') == 11
+    assert len(responses.calls) == 1
+    assert PushAPI(app_id=123, access_token='123', groups_path=path).get_or_create_group('foobar') == 11
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_group_registry_background_refresh(api):
+    url = urljoin(PushAPI.base_url, 'management/groups')
+    responses.add(responses.GET, url, json={'groups': [{'id': 11, 'app_id': 123, 'name': 'foobar'}]})
+    responses.add(responses.GET, url, json={'groups': [{'id': 11, 'app_id': 123, 'name': 'renamed'}]})
+
+    api.groups_ttl = 0
+    assert api.groups.get('foobar')['id'] == 11
+    # stale index is returned while it is refreshed
+    assert api.groups.get('foobar')['id'] == 11
+    api.groups._refreshing.join()
+    assert api.groups.get('foobar') is None
+    assert api.groups.get('renamed')['id'] == 11
+
+
 @responses.activate
 def test_send_success(api, devices, messages_batch):
     data = {
@@ -306,3 +362,379 @@ def test_check_status_error(api, params):
     responses.add(responses.GET, url, **params)
     with pytest.raises(AppMetricaCheckStatusError):
         api.check_status(2999)
+
+
+def test_iter_device_batches():
+    devices = [
+        {'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': [str(i) for i in range(7)]},
+        {'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': ['a', 'b']},
+        {'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': ['x']},
+    ]
+    chunks = list(iter_device_batches(devices, max_devices=4, max_groups=1))
+    assert [(start, stop) for start, stop, _ in chunks] == [(0, 4), (4, 8), (8, 10)]
+    assert chunks[0][2] == [[{'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': ['0', '1', '2', '3']}]]
+    # groups of the different types are split into separate batch items
+    assert chunks[1][2] == [[{'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': ['4', '5', '6']}],
+                            [{'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': ['a']}]]
+    assert chunks[2][2] == [[{'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': ['b']}],
+                            [{'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': ['x']}]]
+
+    # groups of the same type are merged
+    chunks = list(iter_device_batches(devices, max_devices=20, max_groups=5))
+    assert chunks == [(0, 10, [[
+        {'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': [str(i) for i in range(7)] + ['x']},
+        {'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': ['a', 'b']},
+    ]])]
+
+
+@responses.activate
+def test_send_bulk_success(api, ios_message, monkeypatch):
+    monkeypatch.setattr(push_api, 'MAX_NUMBER_IN_BATCH', 3)
+    url = urljoin(PushAPI.base_url, 'send-batch')
+    transfer_ids = iter(range(100, 200))
+
+    def callback(request):
+        return 200, {}, json.dumps({'push_response': {'transfer_id': next(transfer_ids)}})
+
+    responses.add_callback(responses.POST, url, callback=callback)
+    devices = [{'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': [str(i) for i in range(8)]}]
+    results = api.send_bulk(9, devices, android_message=ios_message, tag='bulk', max_workers=2)
+
+    assert [(result.start, result.stop) for result in results] == [(0, 3), (3, 6), (6, 8)]
+    assert sorted(result.transfer_id for result in results) == [100, 101, 102]
+    sent = sorted(json.loads(call.request.body)['push_batch_request']['batch'][0]['devices'][0]['id_values']
+                  for call in responses.calls)
+    assert sent == [['0', '1', '2'], ['3', '4', '5'], ['6', '7']]
+
+
+@responses.activate
+def test_send_bulk_error(api, ios_message, monkeypatch):
+    monkeypatch.setattr(push_api, 'MAX_NUMBER_IN_BATCH', 2)
+    url = urljoin(PushAPI.base_url, 'send-batch')
+
+    def callback(request):
+        values = json.loads(request.body)['push_batch_request']['batch'][0]['devices'][0]['id_values']
+        if values == ['2', '3']:
+            return 500, {}, ''
+        return 200, {}, json.dumps({'push_response': {'transfer_id': 1}})
+
+    responses.add_callback(responses.POST, url, callback=callback)
+    devices = [{'id_type': TokenTypes.ANDROID_PUSH_TOKEN, 'id_values': [str(i) for i in range(6)]}]
+    with pytest.raises(AppMetricaBulkSendError) as exc_info:
+        api.send_bulk(9, devices, ios_message=ios_message)
+
+    assert [(result.start, result.stop) for result in exc_info.value.results] == [(0, 2), (4, 6)]
+    assert [(start, stop) for start, stop, _ in exc_info.value.errors] == [(2, 4)]
+
+
+def test_message_template():
+    message = PushAPI.build_ios_message(title='Hi, $name', text='${book} is ready', extra_data={'book_id': 42})
+    template = MessageTemplate(ios_message=message)
+    assert template.fields == ('name', 'book')
+
+    digest, messages = template.render({'name': 'Ann', 'book': 'Dune', 'city': 'Moscow'})
+    assert messages['iOS']['content']['title'] == 'Hi, Ann'
+    assert messages['iOS']['content']['text'] == 'Dune is ready'
+    assert json.loads(messages['iOS']['content']['data']) == {'book_id': 42}
+    assert template.render({'name': 'Ann', 'book': 'Dune', 'city': 'Paris'}) == (digest, messages)
+    assert template.render({'name': 'Bob', 'book': 'Dune'})[0] != digest
+    assert template.renders == 2
+
+    with pytest.raises(AppMetricaSendPushError):
+        template.render({'name': 'Ann'})
+
+    template = MessageTemplate(android_message={'content': {'text': '$book for $$5'}})
+    assert template.render({'book': 'Dune'})[1]['android']['content']['text'] == 'Dune for $5'
+    with pytest.raises(AppMetricaSendPushError):
+        MessageTemplate(android_message={'content': {'text': 'books from $5'}})
+
+
+def test_personalized_batches():
+    template = MessageTemplate(android_message={'silent': False, 'content': {'title': 'T', 'text': '$text'}})
+    batches = PersonalizedBatches(template, max_devices=4, max_groups=1)
+    batches.add_many([
+        (TokenTypes.ANDROID_PUSH_TOKEN, '0', {'text': 'a'}),
+        (TokenTypes.ANDROID_PUSH_TOKEN, '1', {'text': 'b'}),
+        (TokenTypes.GOOGLE_AID, '2', {'text': 'a'}),
+        (TokenTypes.ANDROID_PUSH_TOKEN, '3', {'text': 'a'}),
+        (TokenTypes.ANDROID_PUSH_TOKEN, '4', {'text': 'b'}),
+        (TokenTypes.ANDROID_PUSH_TOKEN, '5', {'text': 'c'}),
+    ])
+    assert batches.devices == 6
+    assert batches.distinct_messages == 3
+
+    def texts(batch):
+        return [(item['messages']['android']['content']['text'],
+                 [(group['id_type'], group['id_values']) for group in item['devices']]) for item in batch]
+
+    chunks = [(devices, texts(batch)) for devices, batch in batches]
+    assert chunks == [
+        ([0, 1, 2, 3], [('a', [(TokenTypes.ANDROID_PUSH_TOKEN, ['0', '3'])]),
+                        ('a', [(TokenTypes.GOOGLE_AID, ['2'])]),
+                        ('b', [(TokenTypes.ANDROID_PUSH_TOKEN, ['1'])])]),
+        ([4, 5], [('b', [(TokenTypes.ANDROID_PUSH_TOKEN, ['4'])]),
+                  ('c', [(TokenTypes.ANDROID_PUSH_TOKEN, ['5'])])]),
+    ]
+
+
+@responses.activate
+def test_send_personalized(api, monkeypatch):
+    monkeypatch.setattr(push_api, 'MAX_NUMBER_IN_BATCH', 1000)
+    url = urljoin(PushAPI.base_url, 'send-batch')
+    sent = {}
+
+    def callback(request):
+        batch = json.loads(request.body)['push_batch_request']['batch']
+        transfer_id = len(sent) + 1
+        sent[transfer_id] = sorted(int(value) for item in batch for group in item['devices']
+                                   for value in group['id_values'])
+        return 200, {}, json.dumps({'push_response': {'transfer_id': transfer_id}})
+
+    responses.add_callback(responses.POST, url, callback=callback)
+    template = MessageTemplate(ios_message=api.build_ios_message(title='Title', text='Book $book_id'))
+    devices = ((TokenTypes.IOS_PUSH_TOKEN, str(i), {'book_id': i % 8}) for i in range(2500))
+    results = api.send_personalized(9, template, devices, tag='personal')
+
+    # devices of results are positions of passed devices
+    assert [len(result.devices) for result in results] == [1000, 1000, 500]
+    assert all(sent[result.transfer_id] == result.devices for result in results)
+    assert sorted(position for result in results for position in result.devices) == list(range(2500))
+    assert template.renders == 8
+    batches = [json.loads(call.request.body)['push_batch_request']['batch'] for call in responses.calls]
+    # every distinct message is one batch item except for two messages split by the end of request
+    assert sum(len(batch) for batch in batches) == 10
+    assert sorted(set(item['messages']['iOS']['content']['text'] for batch in batches for item in batch)) == \
+        sorted('Book {}'.format(i) for i in range(8))
+
+    with pytest.raises(AppMetricaSendPushError):
+        api.send_personalized(9, template, [])
+
+
+def test_iter_device_batches_from_pairs():
+    pairs = ((TokenTypes.IOS_PUSH_TOKEN if i % 4 else TokenTypes.GOOGLE_AID, str(i)) for i in range(6))
+    chunks = list(iter_device_batches(pairs, max_devices=4, max_groups=5))
+    assert chunks == [
+        (0, 4, [[{'id_type': TokenTypes.GOOGLE_AID, 'id_values': ['0']},
+                 {'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': ['1', '2', '3']}]]),
+        (4, 6, [[{'id_type': TokenTypes.GOOGLE_AID, 'id_values': ['4']},
+                 {'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': ['5']}]]),
+    ]
+    assert list(iter_device_batches(iter([]), max_devices=4, max_groups=5)) == []
+
+
+def test_read_tokens(tmpdir):
+    path = tmpdir.join('tokens.txt')
+    path.write('AAA\n\nios_ifa\tBBB\nCCC\n')
+    assert list(read_tokens(str(path), id_type=TokenTypes.IOS_PUSH_TOKEN)) == [
+        (TokenTypes.IOS_PUSH_TOKEN, 'AAA'),
+        (TokenTypes.IOS_IFA, 'BBB'),
+        (TokenTypes.IOS_PUSH_TOKEN, 'CCC'),
+    ]
+    with pytest.raises(ValueError):
+        list(read_tokens(str(path)))
+
+
+@responses.activate
+def test_send_bulk_from_file(api, ios_message, monkeypatch, tmpdir):
+    monkeypatch.setattr(push_api, 'MAX_NUMBER_IN_BATCH', 2)
+    url = urljoin(PushAPI.base_url, 'send-batch')
+    responses.add(responses.POST, url, status=200, json={'push_response': {'transfer_id': 7}})
+    path = tmpdir.join('tokens.txt')
+    path.write('\n'.join(str(i) for i in range(5)))
+
+    results = api.send_bulk(9, str(path), ios_message=ios_message, id_type=TokenTypes.IOS_PUSH_TOKEN)
+    assert [(result.start, result.stop) for result in results] == [(0, 2), (2, 4), (4, 5)]
+    assert len(responses.calls) == 3
+
+
+def test_token_filter():
+    ifa = '29868ed6-826e-442c-a234-5c5ad8a42b72'
+    ios_token = 'F6A79E9F844A24C5FBED5C58A4C71561C180F5F3A79E9F844A24C5FBED5C58A4'
+    token_filter = TokenFilter()
+    devices = [
+        {'id_type': TokenTypes.IOS_IFA, 'id_values': [ifa, ' ', ifa, 'not-uuid']},
+        {'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': [ios_token, ios_token[:-1] + 'Z', ios_token[:10]]},
+        {'id_type': TokenTypes.IOS_IFA, 'id_values': [ifa + ' ']},
+        {'id_type': TokenTypes.APPMETRICA_DEVICE_ID, 'id_values': ['123456789', 'abc']},
+        {'id_type': 'unknown', 'id_values': ['1']},
+    ]
+    assert list(token_filter.filter(devices)) == [
+        {'id_type': TokenTypes.IOS_IFA, 'id_values': [ifa]},
+        {'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': [ios_token]},
+        {'id_type': TokenTypes.APPMETRICA_DEVICE_ID, 'id_values': ['123456789']},
+    ]
+    assert token_filter.report() == {
+        'accepted': 3,
+        DropReasons.EMPTY: 1,
+        DropReasons.DUPLICATE: 2,
+        DropReasons.MALFORMED: 4,
+        DropReasons.UNKNOWN_TYPE: 1,
+    }
+
+
+def test_token_filter_not_str_values():
+    token_filter = TokenFilter()
+    values = ['123456789', 123456789, 42, None, 1.5, {'id': 1}]
+    assert token_filter.filter_values(TokenTypes.APPMETRICA_DEVICE_ID, values) == ['123456789', '42']
+    assert token_filter.report() == {
+        'accepted': 2,
+        DropReasons.EMPTY: 1,
+        DropReasons.DUPLICATE: 1,
+        DropReasons.MALFORMED: 2,
+        DropReasons.UNKNOWN_TYPE: 0,
+    }
+
+
+def test_token_filter_pairs():
+    token_filter = TokenFilter(group_size=2)
+    pairs = [(TokenTypes.APPMETRICA_DEVICE_ID, str(i % 3)) for i in range(6)] + [(TokenTypes.IOS_IFA, '1')]
+    assert list(token_filter.filter(iter(pairs))) == [
+        {'id_type': TokenTypes.APPMETRICA_DEVICE_ID, 'id_values': ['0', '1']},
+        {'id_type': TokenTypes.APPMETRICA_DEVICE_ID, 'id_values': ['2']},
+    ]
+    assert token_filter.report()[DropReasons.DUPLICATE] == 3
+    assert token_filter.report()[DropReasons.MALFORMED] == 1
+
+
+@responses.activate
+def test_send_bulk_with_token_filter(api, ios_message, monkeypatch):
+    monkeypatch.setattr(push_api, 'MAX_NUMBER_IN_BATCH', 2)
+    url = urljoin(PushAPI.base_url, 'send-batch')
+    responses.add(responses.POST, url, status=200, json={'push_response': {'transfer_id': 7}})
+    devices = [{'id_type': TokenTypes.APPMETRICA_DEVICE_ID, 'id_values': ['1', '2', '1', '', 'x', '3']}]
+
+    token_filter = TokenFilter()
+    results = api.send_bulk(9, devices, ios_message=ios_message, token_filter=token_filter)
+    assert [(result.start, result.stop) for result in results] == [(0, 2), (2, 3)]
+    assert token_filter.report()['accepted'] == 3
+
+
+@responses.activate
+def test_wait_for_transfers(api):
+    statuses = {
+        '1': ['pending', 'in_progress', 'sent'],
+        '2': ['failed'],
+        '3': ['pending', 'pending', 'in_progress', 'in_progress', 'sent'],
+    }
+
+    def callback(request):
+        transfer_id = request.url.rsplit('/', 1)[-1]
+        transfer_statuses = statuses[transfer_id]
+        status = transfer_statuses.pop(0) if len(transfer_statuses) > 1 else transfer_statuses[0]
+        errors = ['Error'] if status == 'failed' else []
+        return 200, {}, json.dumps({'transfer': {'id': int(transfer_id), 'status': status, 'errors': errors}})
+
+    responses.add_callback(responses.GET, re.compile(PushAPI.base_url + 'status/.*'), callback=callback)
+
+    transfers = list(api.iter_transfers([1, 2, 3], poll_interval=0.001, max_workers=3))
+    assert [transfer.transfer_id for transfer in transfers] == [2, 1, 3]
+
+    statuses['1'] = ['sent']
+    statuses['2'] = ['failed']
+    assert api.wait_for_transfers([1, 2], poll_interval=0.001) == {
+        1: TransferStatus(1, 'sent', []),
+        2: TransferStatus(2, 'failed', ['Error']),
+    }
+
+
+@responses.activate
+def test_wait_for_transfers_timeout(api):
+    url = urljoin(PushAPI.base_url, 'status/1')
+    responses.add(responses.GET, url, status=200, json={'transfer': {'id': 1, 'status': 'in_progress', 'errors': []}})
+    url = urljoin(PushAPI.base_url, 'status/2')
+    responses.add(responses.GET, url, status=500)
+
+    result = api.wait_for_transfers([1, 2], timeout=0.05, poll_interval=0.01)
+    assert result == {1: TransferStatus(1, 'in_progress', []), 2: TransferStatus(2, None, [])}
+    # interval grows while status is not changed
+    assert 1 < len([call for call in responses.calls if call.request.url.endswith('/1')]) < 5
+
+
+@responses.activate
+def test_wait_for_transfers_poll_errors(api):
+    responses.add(responses.GET, urljoin(PushAPI.base_url, 'status/1'), status=404)
+    responses.add(responses.GET, urljoin(PushAPI.base_url, 'status/2'), status=500)
+
+    # unknown transfer is not polled again, repeated server errors stop polling too
+    result = api.wait_for_transfers([1, 2], poll_interval=0.001, max_poll_interval=0.001, max_poll_failures=2)
+    assert set(result) == {1, 2}
+    assert result[1].status == push_api.POLL_ERROR_STATUS
+    assert result[2].status == push_api.POLL_ERROR_STATUS
+    assert len([call for call in responses.calls if call.request.url.endswith('/1')]) == 1
+
+
+@responses.activate
+def test_campaign_resume(api, ios_message, monkeypatch, tmpdir):
+    monkeypatch.setattr(push_api, 'MAX_NUMBER_IN_BATCH', 2)
+    url = urljoin(PushAPI.base_url, 'send-batch')
+    fail = {'values': ['2', '3']}
+    sent = []
+
+    def callback(request):
+        request_data = json.loads(request.body)['push_batch_request']
+        values = request_data['batch'][0]['devices'][0]['id_values']
+        if values == fail['values']:
+            return 500, {}, ''
+        sent.append((values, request_data['client_transfer_id']))
+        return 200, {}, json.dumps({'push_response': {'transfer_id': int(values[0])}})
+
+    responses.add_callback(responses.POST, url, callback=callback)
+    devices = [{'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': [str(i) for i in range(5)]}]
+    journal = CampaignJournal(str(tmpdir.join('journal.sqlite')))
+    campaign = Campaign(api, journal, 'campaign-1', group_id=9, ios_message=ios_message)
+
+    with pytest.raises(AppMetricaSendPushError):
+        campaign.run(devices)
+    assert [values for values, _ in sent] == [['0', '1']]
+    planned = journal.batches('campaign-1')[1]
+    assert planned.transfer_id is None
+
+    # resume in a new process
+    fail['values'] = None
+    journal = CampaignJournal(str(tmpdir.join('journal.sqlite')))
+    campaign = Campaign(api, journal, 'campaign-1', group_id=9, ios_message=ios_message)
+    records = campaign.run(devices)
+    assert [values for values, _ in sent] == [['0', '1'], ['2', '3'], ['4']]
+    assert sent[1][1] == planned.client_transfer_id  # deduplicated by server
+    assert [(record.start, record.stop, record.transfer_id) for record in records] == [(0, 2, 0), (2, 4, 2), (4, 5, 4)]
+
+    # devices are changed
+    with pytest.raises(AppMetricaSendPushError):
+        campaign.run([{'id_type': TokenTypes.IOS_PUSH_TOKEN, 'id_values': ['0', '1', '2']}])
+
+
+@responses.activate
+def test_campaign_reconcile(api, ios_message, tmpdir):
+    responses.add(responses.POST, urljoin(PushAPI.base_url, 'send-batch'), json={'push_response': {'transfer_id': 5}})
+    responses.add(responses.GET, urljoin(PushAPI.base_url, 'status/5'),
+                  json={'transfer': {'id': 5, 'status': 'failed', 'errors': ['Error']}})
+    journal = CampaignJournal(str(tmpdir.join('journal.sqlite')))
+    campaign = Campaign(api, journal, 'campaign-2', group_id=9, ios_message=ios_message)
+    campaign.run([(TokenTypes.IOS_PUSH_TOKEN, 'A')])
+
+    records = campaign.reconcile(poll_interval=0.001)
+    assert [(record.transfer_id, record.status, record.errors) for record in records] == [(5, 'failed', ['Error'])]
+    assert campaign.statuses() == {5: TransferStatus(5, 'failed', ['Error'])}
+    campaign.reconcile(poll_interval=0.001)
+    assert len([call for call in responses.calls if 'status' in call.request.url]) == 1
+
+
+@responses.activate
+def test_send_failure_logs_summary(devices, ios_message, caplog, tmpdir):
+    api = PushAPI(app_id=123, access_token='secret-token', retry_policy=RetryPolicy(retries=0),
+                  payload_dump_dir=str(tmpdir))
+    url = urljoin(PushAPI.base_url, 'send-batch')
+    responses.add(responses.POST, url, status=400, body='x' * 10000)
+
+    with pytest.raises(AppMetricaSendPushError):
+        api.send_push(group_id=1, devices=devices, ios_message=ios_message, tag='tag')
+
+    log = caplog.text
+    assert 'secret-token' not in log
+    assert '29868ed6-826e-442c-a234-5c5ad8a42b72' not in log
+    assert "'devices': 4" in log and "'tag': 'tag'" in log
+    assert len(log) < 5000
+
+    payload = [record.data['payload'] for record in caplog.records if 'payload' in getattr(record, 'data', {})][0]
+    with open(payload['dump'], 'rb') as dump_file:
+        assert json.loads(dump_file.read().decode('utf-8')) == json.loads(responses.calls[0].request.body)
@@ -1,7 +1,14 @@
+import json
+import time
+from datetime import datetime
+
 import pytest
 import responses
 
+from appmetrica.retry import RetryPolicy
 from appmetrica.stat.api import StatAPI
+from appmetrica.sinks import read_records
+from appmetrica.stat.cache import DiskCache, MemoryCache, cache_key, cache_ttl
 
 try:
     from urllib.parse import urljoin
@@ -11,7 +18,8 @@ except ImportError:
 
 @pytest.fixture
 def api():
-    yield StatAPI(app_id=123, access_token='123')
+    # retries without delays
+    yield StatAPI(app_id=123, access_token='123', retry_policy=RetryPolicy(backoff_factor=0))
 
 
 @responses.activate
@@ -32,3 +40,135 @@ def test_get_stat_data(api):
     with responses.RequestsMock(assert_all_requests_are_fired=True) as resp_mock:
         resp_mock.add(responses.GET, url, status=200, json=data, match_querystring=False)
         assert api.export_stat(query)
+
+
+@responses.activate
+def test_get_stat_report(api):
+    numpy = pytest.importorskip('numpy')
+    data = {
+        'total_rows': 2,
+        'sampled': False,
+        'sample_share': 1.0,
+        'data_lag': 120,
+        'query': {'ids': [123], 'dimensions': ['ym:ts:operatingSystem'], 'metrics': ['ym:ts:users', 'ym:ts:sessions']},
+        'totals': [30, 300],
+        'min': [10, 100],
+        'max': [20, 200],
+        'data': [
+            {'dimensions': [{'id': 'android', 'name': 'Android'}], 'metrics': [20, 200]},
+            {'dimensions': [{'id': 'ios', 'name': 'iOS'}], 'metrics': [10, None]},
+        ]
+    }
+    url = urljoin(StatAPI.base_url, 'data')
+    responses.add(responses.GET, url, status=200, json=data)
+
+    report = api.export_stat({'ids': 123}, columnar=True)
+    assert len(report) == 2
+    assert report.metrics.shape == (2, 2)
+    assert report.metrics[:, 0].sum() == 30
+    assert numpy.isnan(report.metrics[1, 1])
+    assert list(report.dimensions['ym:ts:operatingSystem']) == ['Android', 'iOS']
+    assert list(report.dimension_ids['ym:ts:operatingSystem']) == ['android', 'ios']
+    assert list(report.totals) == [30, 300]
+    assert report.metric_names == ['ym:ts:users', 'ym:ts:sessions']
+    assert report.data_lag == 120
+    assert report.sampled is False
+
+    responses.replace(responses.GET, url, status=200, json=dict(data, data=[]))
+    assert api.export_stat({'ids': 123}, columnar=True).metrics.shape == (0, 2)
+
+
+@responses.activate
+def test_iter_stat(api):
+    def callback(request):
+        query = dict(pair.split('=') for pair in request.url.split('?')[1].split('&'))
+        offset, limit = int(query['offset']), int(query['limit'])
+        rows = [{'dimensions': [], 'metrics': [i]} for i in range(offset, min(offset + limit, 26))]
+        return 200, {}, json.dumps({'total_rows': 25, 'data': rows})
+
+    url = urljoin(StatAPI.base_url, 'data')
+    responses.add_callback(responses.GET, url, callback=callback)
+
+    rows = list(api.iter_stat({'ids': 123, 'metrics': 'ym:ts:users'}, page_size=10, prefetch=2))
+    assert [row['metrics'][0] for row in rows] == list(range(1, 26))
+    assert len(responses.calls) == 3
+
+    rows = list(api.iter_stat({'ids': 123, 'offset': 21}, page_size=2))
+    assert [row['metrics'][0] for row in rows] == list(range(21, 26))
+
+
+def test_cache_key():
+    assert cache_key(1, {'metrics': ['a', 'b'], 'ids': 1}) == cache_key(1, {'ids': '1', 'metrics': 'a,b'})
+    assert cache_key(1, {'ids': 1}) != cache_key(2, {'ids': 1})
+
+
+@pytest.mark.parametrize('date2, data_lag, ttl', [
+    ('2020-01-01', 300, None),  # past, cached forever
+    ('2020-01-10', 300, 300),  # today
+    ('2020-01-09', 7200, 3600),  # yesterday, but data is still arriving
+    ('yesterday', 0, 60),  # relative date
+])
+def test_cache_ttl(date2, data_lag, ttl):
+    now = datetime(2020, 1, 10, 1, 0)
+    assert cache_ttl({'date2': date2}, {'data_lag': data_lag}, now=now) == ttl
+
+
+@pytest.mark.parametrize('make_cache', [
+    lambda tmpdir: MemoryCache(maxsize=2),
+    lambda tmpdir: DiskCache(str(tmpdir.join('cache')), maxsize=2),
+])
+def test_cache_eviction(make_cache, tmpdir):
+    cache = make_cache(tmpdir)
+    cache.set('a', {'value': 1})
+    time.sleep(0.01)
+    cache.set('b', {'value': 2}, ttl=0.01)
+    time.sleep(0.01)
+    assert cache.get('a') == {'value': 1}
+    assert cache.get('b') is None  # expired
+    cache.set('b', {'value': 2})
+    time.sleep(0.01)
+    assert cache.get('a') == {'value': 1}
+    time.sleep(0.01)
+    cache.set('c', {'value': 3})  # b is least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == {'value': 1}
+    assert cache.get('c') == {'value': 3}
+
+
+@pytest.mark.parametrize('make_cache', [
+    lambda tmpdir: MemoryCache(),
+    lambda tmpdir: DiskCache(str(tmpdir.join('cache'))),
+])
+def test_cache_values_are_copied(make_cache, tmpdir):
+    cache = make_cache(tmpdir)
+    value = {'data': [{'metrics': [1]}]}
+    cache.set('a', value)
+    value['data'].append({'metrics': [2]})
+    cache.get('a')['data'][0]['metrics'][0] = 3
+    assert cache.get('a') == {'data': [{'metrics': [1]}]}
+
+
+@responses.activate
+def test_export_stat_cached():
+    api = StatAPI(app_id=123, access_token='123', cache=MemoryCache())
+    url = urljoin(StatAPI.base_url, 'data')
+    responses.add(responses.GET, url, status=200, json={'total_rows': 1, 'data_lag': 0, 'data': [{'metrics': [1]}]})
+
+    params = {'ids': 123, 'metrics': ['ym:ts:users'], 'date1': '2020-01-01', 'date2': '2020-01-02'}
+    assert api.export_stat(params) == [{'metrics': [1]}]
+    assert api.export_stat(dict(params, metrics='ym:ts:users')) == [{'metrics': [1]}]
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_save_stat(api, tmpdir):
+    url = urljoin(StatAPI.base_url, 'data')
+    rows = [{'dimensions': [{'id': i, 'name': 'country %s' % i}], 'metrics': [i, None]} for i in range(3)]
+    responses.add(responses.GET, url, json={'total_rows': 3, 'data': rows})
+
+    path = str(tmpdir.join('stat.ndjson.gz'))
+    params = {'ids': 123, 'dimensions': 'ym:ts:regionCountry', 'metrics': 'ym:ts:users,ym:ts:sessions'}
+    assert api.save_stat(path, params) == 3
+    assert list(read_records(path))[1] == {
+        'ym:ts:regionCountry': 'country 1', 'ym:ts:regionCountry.id': '1', 'ym:ts:users': 1.0, 'ym:ts:sessions': None
+    }